@@ -0,0 +1,168 @@
+# audio_codec.py
+#
+# Audio codecs for the mic_client -> listener link. Encoders run on the mic,
+# decoders in the listener. Every codec works on 16 kHz mono int16 PCM frames.
+#
+#   PCM16  raw samples, 256 kbit/s
+#   ULAW   G.711 mu-law in NumPy, 128 kbit/s
+#   ADPCM  IMA ADPCM via the stdlib audioop module, 64 kbit/s (not available on Python 3.13+)
+#   OPUS   via opuslib if it is installed, ~24 kbit/s
+
+import struct
+import numpy as np
+
+from protocol import CODEC_ADPCM, CODEC_OPUS, CODEC_PCM16, CODEC_ULAW
+
+try:
+    import audioop
+except ImportError:  # Removed from the stdlib in Python 3.13
+    audioop = None
+
+try:
+    import opuslib
+except ImportError:
+    opuslib = None
+
+CODEC_NAMES = {
+    CODEC_PCM16: 'pcm16',
+    CODEC_ULAW: 'ulaw',
+    CODEC_ADPCM: 'adpcm',
+    CODEC_OPUS: 'opus',
+}
+
+OPUS_FRAME_MS = 20  # Opus only accepts 2.5-60 ms frames, so an 80 ms chunk becomes 4 packets
+OPUS_BITRATE = 24000
+OPUS_PACKET_HEADER = struct.Struct('!H')
+
+
+def available_codecs():
+    """The codecs this process can encode and decode."""
+    codecs = [CODEC_PCM16, CODEC_ULAW]
+    if audioop is not None:
+        codecs.append(CODEC_ADPCM)
+    if opuslib is not None:
+        codecs.append(CODEC_OPUS)
+    return codecs
+
+
+# --- MU-LAW ---
+
+# Same segment layout as the G.711 reference code (and audioop.lin2ulaw)
+ULAW_BIAS = 0x84
+ULAW_CLIP = 8159  # On 14-bit magnitudes
+ULAW_SEGMENT_ENDS = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+
+
+def _build_ulaw_decode_table():
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + ULAW_BIAS) << exponent) - ULAW_BIAS
+    return np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+
+ULAW_DECODE_TABLE = _build_ulaw_decode_table()
+
+
+def ulaw_encode(samples):
+    """Encodes int16 samples to G.711 mu-law bytes."""
+    x = samples.astype(np.int32) >> 2
+    mask = np.where(x < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(x), ULAW_CLIP) + (ULAW_BIAS >> 2)
+    segment = np.searchsorted(ULAW_SEGMENT_ENDS, magnitude)
+    code = (np.minimum(segment, 7) << 4) | ((magnitude >> (segment + 1)) & 0x0F)
+    code = np.where(segment >= 8, 0x7F, code)
+    return (code ^ mask).astype(np.uint8).tobytes()
+
+
+def ulaw_decode(payload):
+    """Decodes G.711 mu-law bytes to int16 samples."""
+    return ULAW_DECODE_TABLE[np.frombuffer(payload, dtype=np.uint8)]
+
+
+# --- ENCODERS AND DECODERS ---
+
+class PCM16Codec:
+    """No compression. encode() and decode() just convert between bytes and samples."""
+    def encode(self, pcm_bytes):
+        return pcm_bytes
+
+    def decode(self, payload):
+        return np.frombuffer(payload, dtype=np.int16)
+
+
+class ULawCodec:
+    def encode(self, pcm_bytes):
+        return ulaw_encode(np.frombuffer(pcm_bytes, dtype=np.int16))
+
+    def decode(self, payload):
+        return ulaw_decode(payload)
+
+
+class ADPCMCodec:
+    """IMA ADPCM. The predictor state carries over from one frame to the next."""
+    def __init__(self):
+        if audioop is None:
+            raise ValueError("ADPCM needs the audioop module, which this Python does not have")
+        self._state = None
+
+    def encode(self, pcm_bytes):
+        payload, self._state = audioop.lin2adpcm(pcm_bytes, 2, self._state)
+        return payload
+
+    def decode(self, payload):
+        pcm_bytes, self._state = audioop.adpcm2lin(payload, 2, self._state)
+        return np.frombuffer(pcm_bytes, dtype=np.int16)
+
+
+class OpusCodec:
+    """Opus via opuslib. Each chunk is sent as length-prefixed 20 ms packets."""
+    def __init__(self, sample_rate=16000):
+        if opuslib is None:
+            raise ValueError("Opus needs the opuslib package")
+        self.frame_samples = sample_rate * OPUS_FRAME_MS // 1000
+        self._encoder = None
+        self._decoder = None
+        self.sample_rate = sample_rate
+
+    def encode(self, pcm_bytes):
+        if self._encoder is None:
+            self._encoder = opuslib.Encoder(self.sample_rate, 1, opuslib.APPLICATION_VOIP)
+            self._encoder.bitrate = OPUS_BITRATE
+        frame_bytes = self.frame_samples * 2
+        packets = []
+        for start in range(0, len(pcm_bytes), frame_bytes):
+            packet = self._encoder.encode(pcm_bytes[start:start + frame_bytes], self.frame_samples)
+            packets.append(OPUS_PACKET_HEADER.pack(len(packet)) + packet)
+        return b''.join(packets)
+
+    def decode(self, payload):
+        if self._decoder is None:
+            self._decoder = opuslib.Decoder(self.sample_rate, 1)
+        payload = memoryview(payload)
+        pcm = []
+        offset = 0
+        while offset < len(payload):
+            (length,) = OPUS_PACKET_HEADER.unpack_from(payload, offset)
+            offset += OPUS_PACKET_HEADER.size
+            pcm.append(self._decoder.decode(bytes(payload[offset:offset + length]), self.frame_samples))
+            offset += length
+        return np.frombuffer(b''.join(pcm), dtype=np.int16)
+
+
+def create_codec(codec, sample_rate=16000):
+    """Returns a new stateful encoder/decoder for one stream."""
+    if codec == CODEC_PCM16:
+        return PCM16Codec()
+    if codec == CODEC_ULAW:
+        return ULawCodec()
+    if codec == CODEC_ADPCM:
+        return ADPCMCodec()
+    if codec == CODEC_OPUS:
+        return OpusCodec(sample_rate)
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def negotiate_codec(requested):
+    """The codec the server will accept for a client that asked for `requested`."""
+    return requested if requested in available_codecs() else CODEC_PCM16
@@ -1,30 +1,97 @@
-import os
-from gtts import gTTS
-from playsound import playsound
-import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from playback import SharedAudio
+from tracing import current as current_trace
+from tts import (FORMAT_MP3, TTS_LANG, AudioClip, TTSCache, TTSError, create_tts_backend,
+                 pcm_chunks)
+
+# --- CONFIGURATION ---
+TTS_WORKERS = 2  # Messages synthesized at the same time (the next sentence while one plays)
+AUDIO_OUTPUT = 'device'  # 'device' plays everything here; 'zones' routes each speaker to its own sink
+
+
+class DevicePlayer:
+    """
+    Plays audio on this computer's default output device, whatever the target
+    speaker. PCM is written to a PyAudio stream chunk by chunk as it arrives;
+    MP3 clips are played from their cache file with playsound. Each call opens
+    its own stream, so zones playing at the same time overlap on the one device.
+    """
+    def __init__(self):
+        self._pyaudio = None
+        self._lock = threading.Lock()
+
+    def play_file(self, path, on_start, speaker=None, volume=None):
+        from playsound import playsound  # Imported on first use: it is slow to load and rarely needed
+        on_start()
+        playsound(path)
+
+    def play_pcm(self, audio, speaker=None, volume=None, stopped=None):
+        with self._lock:
+            if self._pyaudio is None:
+                import pyaudio
+                self._pyaudio = pyaudio.PyAudio()
+                self._format = pyaudio.paInt16
+        stream = None
+        try:
+            for chunk in audio.chunks(stopped):
+                if stream is None:
+                    stream = self._pyaudio.open(format=self._format, channels=1, rate=audio.sample_rate,
+                                                output=True)
+                    audio.mark_playing()
+                stream.write(bytes(chunk))
+        finally:
+            if stream is not None:
+                stream.stop_stream()
+                stream.close()
+
+
+def create_player(output=None):
+    """The player for AUDIO_OUTPUT: 'device' (this computer) or 'zones' (output_engine.py)."""
+    output = output or AUDIO_OUTPUT
+    if output == 'zones':
+        from output_engine import OutputEngine
+        return OutputEngine().start()
+    if output == 'device':
+        return DevicePlayer()
+    raise ValueError(f"Unknown AUDIO_OUTPUT '{output}'. Choose 'device' or 'zones'.")
+
 
 class AudioManager:
     """
     Handles all audio-related tasks for the Jarvis system,
     such as Text-to-Speech (TTS) generation and playback.
     """
-    def __init__(self):
+    def __init__(self, backend=None, cache=None, player=None, lang=TTS_LANG):
         """
         Initializes the AudioManager.
+
+        Args:
+            backend (TTSBackend): The synthesizer (defaults to tts.TTS_BACKEND).
+            cache (TTSCache): Synthesized clips, reused for repeated phrases.
+            player: Where the audio goes (defaults to AUDIO_OUTPUT).
         """
-        print("Audio Manager initialized.")
+        self.backend = backend or create_tts_backend()
+        self.cache = cache if cache is not None else TTSCache()
+        self.player = player or create_player()
+        self.lang = lang
+        self.executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+        print(f"Audio Manager initialized (TTS backend: {self.backend.name}).")
 
     def speak(self, text, target_speakers, volume):
         """
-        Converts text to speech and plays it.
+        Converts text to speech and plays it, blocking until it has been spoken.
+        The Dispatcher goes through a PlaybackScheduler instead, which calls
+        synthesize() once and play() for every target speaker.
 
         In a real multi-speaker system, this function would be much more complex.
         It would need to:
         1. Identify the correct audio output device ID for the 'target_speakers'.
         2. Route the audio stream to that specific device.
 
-        For this simulation, we will generate the audio and play it on the
-        default output device of the computer running the script.
+        For this simulation, we will play the audio on the default output
+        device of the computer running the script.
 
         Args:
             text (str): The text to be spoken.
@@ -34,27 +101,74 @@ class AudioManager:
         if not text:
             print("Audio Manager: No text provided to speak.")
             return
+        try:
+            self.play(self.synthesize(text), target_speakers, volume)
+        except TTSError as e:
+            print(f"Audio Manager Error: Failed to generate TTS audio. {e}")
+        except Exception as e:
+            print(f"Audio Manager Error: Failed to generate or play TTS audio. {e}")
+
+    def synthesize(self, text):
+        """
+        Starts synthesizing `text` and returns at once. A phrase that was spoken
+        before comes straight from the TTS cache; otherwise the backend runs on
+        the synthesis pool and its chunks can be played while it is still going.
+
+        Returns:
+            SharedAudio: The audio, readable by any number of players.
+        """
+        key = self.cache.key(self.backend, text, self.lang)
+        clip = self.cache.get(key)
+        if clip is not None:
+            print(f"Audio Manager: Using cached TTS for text: '{text}'")
+            audio = SharedAudio(clip.format, clip.sample_rate, cached=True, trace=current_trace())
+            for chunk in ([clip.data] if clip.format == FORMAT_MP3 else pcm_chunks(clip.data)):
+                audio.append(chunk)
+            audio.finish(path=clip.path)
+            return audio
 
         print(f"Audio Manager: Generating TTS for text: '{text}'")
-        
-        try:
-            # Create a gTTS object
-            tts = gTTS(text=text, lang='en', slow=False)
+        audio = SharedAudio(self.backend.format, self.backend.sample_rate, trace=current_trace())
+        self.executor.submit(self._synthesize, key, text, audio)
+        return audio
 
-            # Use a temporary file to save the speech audio
-            with tempfile.NamedTemporaryFile(suffix=".mp3", delete=True) as fp:
-                temp_filename = fp.name
-            
-            tts.save(temp_filename)
+    def play(self, audio, speaker, volume, stopped=None):
+        """
+        Plays synthesized audio, blocking until it is done or `stopped()` is true.
+        A streamed PCM clip can be cut off between chunks; an MP3 clip has to be
+        complete before it starts and plays to the end.
 
-            # Play the sound file
-            playsound(temp_filename)
-            
-            # Clean up the temporary file
-            os.remove(temp_filename)
+        Args:
+            audio (SharedAudio): The audio returned by synthesize().
+            speaker (str or list): The speaker(s) to play on; the 'device' player ignores it.
+            volume (int): The speech volume (0-100); the 'device' player ignores it.
+            stopped (callable): Returns True once playback should be abandoned.
+        """
+        if audio.format == FORMAT_MP3:
+            if not audio.wait(stopped):
+                return
+            if audio.error is not None:
+                raise TTSError(f"Synthesis failed; {audio.error}")
+            if audio.path is None:
+                raise TTSError("MP3 clip is not on disk, so it cannot be played")
+            if stopped is None or not stopped():
+                self.player.play_file(audio.path, audio.mark_playing, speaker, volume)
+            return
+        self.player.play_pcm(audio, speaker, volume, stopped)
+        if audio.error is not None:
+            raise TTSError(f"Synthesis failed; {audio.error}")
 
+    def _synthesize(self, key, text, audio):
+        synthesized = []
+        try:
+            for chunk in self.backend.stream(text, self.lang):
+                synthesized.append(chunk)
+                audio.append(chunk)
+            clip = self.cache.put(key, AudioClip(self.backend.format, b''.join(synthesized),
+                                                 self.backend.sample_rate))
+            audio.finish(path=clip.path)
         except Exception as e:
-            print(f"Audio Manager Error: Failed to generate or play TTS audio. {e}")
+            audio.finish(error=e)  # Raised by play() in every zone waiting for it
 
 
 # This block allows you to test the AudioManager independently.
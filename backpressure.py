@@ -0,0 +1,141 @@
+# backpressure.py
+#
+# Keeps the command path from building a backlog when the LLM (or anything
+# after it) slows down. Without it, commands queue up without limit and are
+# executed minutes after they were spoken.
+#
+#   deadlines     a command not started within COMMAND_DEADLINE of the end of its speech is dropped
+#   bounded       the command queue and each room's backlog drop their oldest command when full
+#   coalescing    a newer setVolume (or stopSpeech) for the same speakers replaces a pending one
+#   rate limiting each mic may start at most MIC_COMMANDS_PER_MINUTE captures (bursts of MIC_BURST)
+#
+# Dropped commands are counted as commands_shed, commands_expired and
+# commands_coalesced, and their traces end with that outcome.
+
+import queue
+import threading
+import time
+from collections import deque
+
+from metrics import metrics
+
+# --- CONFIGURATION ---
+MAX_QUEUED_COMMANDS = 32  # Between the listener and the command workers
+MAX_PENDING_PER_ROOM = 4  # Commands from one room waiting for that room's previous one
+COMMAND_DEADLINE = 12.0  # Seconds after the end of speech a command may still be started (None disables)
+COALESCE_FUNCTIONS = ('setVolume', 'stopSpeech')  # Only the latest of these per speaker set matters
+MIC_COMMANDS_PER_MINUTE = 12
+MIC_BURST = 4
+
+
+def drop_command(command, reason):
+    """Drops a command that will not be executed: 'shed', 'expired' or 'coalesced'."""
+    metrics.increment(f'commands_{reason}')
+    command.trace.end(reason)
+    print(f"Backpressure: dropping {reason} command from '{command.source_room}': '{command.text}'")
+
+
+def coalesce_key(intent):
+    """
+    Commands with the same key supersede each other: the function and its
+    speakers, for COALESCE_FUNCTIONS. None for everything else.
+    """
+    if intent is None or intent.get('function') not in COALESCE_FUNCTIONS:
+        return None
+    if 'state' in intent:
+        return None  # Relative changes ("turn it up") add up, so none of them may replace another
+    speakers = intent.get('parameters', {}).get('speakers', 'all')
+    if isinstance(speakers, str):
+        speakers = [speakers]
+    return intent['function'], tuple(sorted(speakers))
+
+
+class CommandQueue:
+    """
+    The bounded queue between the listener and the command workers, with the
+    queue.Queue methods they use. put() never blocks a listener thread: when
+    the queue is full the oldest command is shed. get() drops commands whose
+    deadline has passed instead of handing them out.
+    """
+    def __init__(self, maxsize=MAX_QUEUED_COMMANDS):
+        self.maxsize = maxsize
+        self.items = deque()
+        self.cond = threading.Condition()
+
+    def put(self, command):
+        shed = None
+        with self.cond:
+            if self.maxsize and len(self.items) >= self.maxsize:
+                shed = self.items.popleft()
+            self.items.append(command)
+            self.cond.notify()
+        if shed is not None:
+            drop_command(shed, 'shed')
+
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.cond:
+                while not self.items:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Empty
+                    self.cond.wait(remaining)
+                command = self.items.popleft()
+            if not command.expired():
+                return command
+            drop_command(command, 'expired')
+
+    def qsize(self):
+        with self.cond:
+            return len(self.items)
+
+    def empty(self):
+        return self.qsize() == 0
+
+
+class RateLimiter:
+    """A token bucket per key (mic): `per_minute` on average, up to `burst` at once."""
+    def __init__(self, per_minute=MIC_COMMANDS_PER_MINUTE, burst=MIC_BURST):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.buckets = {}  # key -> (tokens, last refill)
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1.0
+            self.buckets[key] = (tokens - 1.0 if allowed else tokens, now)
+        return allowed
+
+
+# This block allows you to test the deadlines independently.
+# To run, execute `python backpressure.py` in your terminal.
+if __name__ == '__main__':
+    from listener import Command
+    from tracing import Trace
+    from vad import MAX_COMMAND_DURATION
+    print("--- Testing command deadlines ---")
+    # A capture that ran to the maximum length ended just now, MAX_COMMAND_DURATION after its wake word
+    trace = Trace('kitchen')
+    trace.origin -= MAX_COMMAND_DURATION
+    trace.mark('vad_end')
+    long_command = Command('kitchen', "a very long question", trace)
+    assert not long_command.expired()
+    commands = CommandQueue()
+    commands.put(long_command)
+    assert commands.get(timeout=0) is long_command  # Not expired on its way to the workers
+
+    # One that ended too long ago to still be worth starting
+    stale = Trace('office')
+    stale.mark('vad_end', time.monotonic() - COMMAND_DEADLINE - 1)
+    commands.put(Command('office', "volume 30", stale))
+    try:
+        commands.get(timeout=0)
+        raise AssertionError("an expired command was handed out")
+    except queue.Empty:
+        pass
+    print(f"OK: {metrics.snapshot()['counters']}")
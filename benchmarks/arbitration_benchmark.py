@@ -0,0 +1,70 @@
+# benchmarks/arbitration_benchmark.py
+#
+# STT and LLM calls saved by cross-mic wake word arbitration (listener.WakeArbiter).
+# Replays generated sessions through the full pipeline (replay_harness.py) with
+# mics in groups of 1, 2 and 3 that hear the same room, once with arbitration
+# off and once with it on. Without arbitration every mic that hears a wake word
+# transcribes and executes the command; with it, one mic per wake word should.
+#
+#   commands    commands executed (duplicates = commands beyond one per wake word)
+#   best mic    share of commands taken by the mic nearest the speaker (loudest
+#               copy); a farther mic in a quieter room can have the better SNR
+#   latency     end of speech -> first audio, p50, to show what the window costs
+#
+# Usage: python benchmarks/arbitration_benchmark.py [mics] [speed]
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tracing
+from replay_harness import parse_args, run_quietly
+
+GROUP_SIZES = [1, 2, 3]
+
+
+def measure(mics, speed, adjacent, arbitration):
+    argv = ['--mics', str(mics), '--speed', str(speed), '--seconds', '40', '--adjacent', str(adjacent)]
+    if not arbitration:
+        argv.append('--no-arbitration')
+    result = run_quietly(parse_args(argv))
+    nearest = {name for i, name in enumerate(result.names) if i % adjacent == 0}
+    wake_words = sum(len(regions) for i, (_, regions) in enumerate(result.sessions) if i % adjacent == 0)
+    commands = [r for r in result.records if r.get('outcome') == 'ok']
+    summary, _ = tracing.summarize(result.records)
+    return {
+        'wake_words': wake_words,
+        'stt': result.stt_calls,
+        'llm': result.llm_calls,
+        'commands': len(commands),
+        'duplicates': len(commands) - wake_words,
+        'best_mic': sum(1 for r in commands if r['room'] in nearest) / max(len(commands), 1),
+        'latency': summary['speech_to_audio'][1] if 'speech_to_audio' in summary else float('nan'),
+    }
+
+
+def main(argv):
+    mics = int(argv[0]) if argv else 6
+    speed = float(argv[1]) if len(argv) > 1 else 8.0
+    rows = []
+    for adjacent in GROUP_SIZES:
+        for arbitration in (False, True):
+            rows.append((adjacent, arbitration, measure(mics, speed, adjacent, arbitration)))
+
+    print(f"\n--- Wake word arbitration: {mics} mics, 40 s sessions at {speed:g}x real time ---")
+    print(f"{'mics/room':>9} {'arbitration':>11} {'wake words':>10} {'STT calls':>9} {'LLM calls':>9} "
+          f"{'commands':>8} {'duplicates':>10} {'best mic':>8} {'latency p50':>11}")
+    for adjacent, arbitration, r in rows:
+        print(f"{adjacent:>9} {'on' if arbitration else 'off':>11} {r['wake_words']:>10} {r['stt']:>9} "
+              f"{r['llm']:>9} {r['commands']:>8} {r['duplicates']:>10} {r['best_mic']:>8.0%} "
+              f"{r['latency']:>8.0f} ms")
+    for adjacent in GROUP_SIZES:
+        off, on = [r for a, _, r in rows if a == adjacent]
+        if off['stt']:
+            print(f"{adjacent} mics per room: arbitration saves {off['stt'] - on['stt']} of {off['stt']} STT calls "
+                  f"and {off['llm'] - on['llm']} of {off['llm']} LLM calls")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,126 @@
+# benchmarks/command_throughput_benchmark.py
+#
+# Command throughput of the CommandProcessor against a mocked LLM. Every
+# request to the mock sleeps for an injected latency (normally distributed
+# around --latency ms) and then streams back a setVolume whose volume is the
+# command's sequence number, so the benchmark can also check that each
+# room's commands were executed in the order they were spoken.
+#
+# The same burst of commands (ROOMS rooms x PER_ROOM commands each) is run
+# with several worker caps; a cap of 1 behaves like the old single consumer.
+#
+# Usage: python benchmarks/command_throughput_benchmark.py [--rooms N] [--per-room N] [--latency MS]
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # The prompt builder reads system_prompt.txt from the working directory
+
+import backpressure
+from dispatcher import Dispatcher
+from main import CommandProcessor
+from listener import queue_command
+from replay_harness import get_source_room
+
+WORKER_CAPS = (1, 2, 4, 8)
+
+
+class MockLLMClient:
+    """Mimics client.chat.completions.create(), with latency and a streamed reply."""
+    def __init__(self, latency, jitter):
+        self.latency = latency
+        self.jitter = jitter
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, stream=False, **kwargs):
+        command = next(m['content'] for m in reversed(messages) if m['role'] == 'user')
+        number = int(re.search(r'MESSAGE: (\d+)', command).group(1))
+        reply = json.dumps({"function": "setVolume",
+                            "parameters": {"speakers": [get_source_room(command)], "volume": number}})
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+        return [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=reply[i:i + 4]))])
+                for i in range(0, len(reply), 4)]
+
+
+class RecordingAudioManager:
+    def synthesize(self, text):
+        return None
+
+    def play(self, audio, speaker, volume, stopped=None):
+        pass
+
+
+class OrderCheckingDispatcher(Dispatcher):
+    """Records the order in which each room's setVolume commands were executed."""
+    def __init__(self):
+        super().__init__(audio_manager=RecordingAudioManager())
+        self.lock = threading.Lock()
+        self.executed = {}
+
+    def execute(self, function_name, parameters):
+        with self.lock:
+            self.executed.setdefault(parameters['speakers'][0], []).append(parameters['volume'])
+
+
+class CommandSink:
+    """Lets queue_command() hand commands straight to a CommandProcessor."""
+    def __init__(self, processor):
+        self.processor = processor
+
+    def put(self, command):
+        self.processor.submit(command)
+
+
+def run(max_workers, rooms, per_room, latency, jitter):
+    dispatcher = OrderCheckingDispatcher()
+    # The whole burst must run to measure throughput: nothing may be shed or expire
+    backpressure.COMMAND_DEADLINE = None
+    processor = CommandProcessor(dispatcher, MockLLMClient(latency, jitter), max_workers, max_pending=per_room)
+    sink = CommandSink(processor)
+
+    started = time.monotonic()
+    for number in range(per_room):
+        for room in range(rooms):
+            queue_command(f"room {room}", str(number), sink)
+    processor.wait_idle()
+    elapsed = time.monotonic() - started
+    processor.shutdown()
+
+    in_order = all(volumes == sorted(volumes) and len(volumes) == per_room
+                   for volumes in dispatcher.executed.values())
+    return elapsed, in_order
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=6)
+    parser.add_argument('--per-room', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=400.0, help="Mean LLM latency in ms")
+    parser.add_argument('--jitter', type=float, default=100.0, help="Standard deviation of the latency in ms")
+    args = parser.parse_args(argv)
+
+    results = []
+    for max_workers in WORKER_CAPS:
+        results.append((max_workers,) + run(max_workers, args.rooms, args.per_room,
+                                            args.latency / 1000, args.jitter / 1000))
+
+    total = args.rooms * args.per_room
+    print(f"\n--- Command throughput: {args.rooms} rooms x {args.per_room} commands, "
+          f"LLM latency {args.latency:.0f}+-{args.jitter:.0f} ms ---")
+    print(f"{'workers':>7} {'total (s)':>10} {'commands/s':>11} {'per-room order':>15}")
+    for max_workers, elapsed, in_order in results:
+        print(f"{max_workers:>7} {elapsed:10.2f} {total / elapsed:11.1f} {'ok' if in_order else 'BROKEN':>15}")
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,168 @@
+# benchmarks/device_state_benchmark.py
+#
+# LLM calls avoided by the device state store (device_state.py). A scripted
+# evening of commands across several rooms (music, relative volume changes,
+# questions about what is playing, a few open questions) goes through
+# main.process_command twice, against a mocked LLM that answers from a script:
+#
+#   stateless  the matcher's state rules off, no device state in the prompt:
+#              every relative change and question about the speakers needs the LLM
+#   state      relative changes and questions resolved from the store; the LLM
+#              gets a state summary only for commands that mention the music
+#
+#   LLM calls       requests sent to the LLM (each one a gpt-4o round trip)
+#   prompt tokens   tokens sent with them (the summary adds a few per request)
+#   with state      requests that carried the device state summary
+#
+# The state run also checks every volume the session expects after a relative
+# change, and prints the spoken answers to the questions.
+#
+# Usage: python benchmarks/device_state_benchmark.py [--llm MS]
+
+import argparse
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # The prompt builder reads system_prompt.txt from the working directory
+
+import main
+from dispatcher import Dispatcher
+from intents import IntentMatcher
+from listener import Command
+from metrics import metrics
+from replay_harness import get_source_room
+
+# (source room, utterance, {speaker: expected volume afterwards})
+SESSION = [
+    ("kitchen", "play the dinner party playlist in the kitchen and the family room at 40 percent", {}),
+    ("kitchen", "turn it up a bit", {"kitchen": 45, "family room": 45}),
+    ("family room", "what's playing?", {}),
+    ("office", "play Hey Jude by the Beatles in the office", {}),
+    ("office", "louder", {"office": 60}),
+    ("office", "what's the volume", {}),
+    ("kitchen", "turn the music down", {"kitchen": 35, "family room": 35}),
+    ("patio", "play jazz", {}),
+    ("patio", "a little quieter", {"patio": 45}),
+    ("kitchen", "how loud is the patio", {}),
+    ("office", "turn it up by 20", {"office": 80}),
+    ("deck", "what is the tallest mountain in the world", {}),
+    ("family room", "make it louder", {"kitchen": 45, "family room": 45}),
+    ("office", "what song is this", {}),
+    ("deck", "play the same thing as the patio", {}),
+    ("deck", "turn it down a lot", {"deck": 30, "patio": 30}),
+    ("kitchen", "volume 30", {"kitchen": 30}),
+    ("kitchen", "turn it up", {"kitchen": 40, "family room": 40}),
+    ("bar area", "what's playing in the kitchen", {}),
+    ("office", "turn the volume down to 20 percent", {"office": 20}),
+]
+
+# What the LLM answers to the commands the rules leave to it
+SCRIPTED_REPLIES = {
+    "play jazz": {"function": "playMusic", "parameters": {"playlist": "jazz", "speakers": ["patio"]}},
+    "play the same thing as the patio": {"function": "playMusic",
+                                         "parameters": {"playlist": "jazz", "speakers": ["patio", "deck"]}},
+}
+
+
+class ScriptedLLMClient:
+    """Mimics client.chat.completions.create(): streams the scripted reply, or a short makeSpeech."""
+    def __init__(self):
+        self.calls = 0
+        self.with_state = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, stream=False, **kwargs):
+        self.calls += 1
+        if "Device state:" in messages[-1]['content']:
+            self.with_state += 1
+        command = next(m['content'] for m in reversed(messages) if m['role'] == 'user')
+        text = command.split('MESSAGE: ', 1)[1]
+        reply = SCRIPTED_REPLIES.get(text) or {
+            "function": "makeSpeech", "parameters": {"speakers": [get_source_room(command)], "message": "Sure."}}
+        reply = json.dumps(reply)
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+        return [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=reply[i:i + 8]))])
+                for i in range(0, len(reply), 8)]
+
+
+class SpokenAudioManager:
+    """Keeps what would have been spoken instead of synthesizing it."""
+    def __init__(self):
+        self.spoken = []
+
+    def synthesize(self, text):
+        self.spoken.append(text)
+        return None
+
+    def play(self, audio, speaker, volume, stopped=None):
+        pass
+
+
+def run(with_state):
+    main.DEVICE_STATE_CONTEXT = with_state
+    audio_manager = SpokenAudioManager()
+    dispatcher = Dispatcher(audio_manager=audio_manager)
+    matcher = IntentMatcher(state_rules=with_state)
+    llm = ScriptedLLMClient()
+    tokens_before = metrics.snapshot()['counters'].get('llm_prompt_tokens', 0)
+
+    histories = {}
+    wrong = []
+    answers = []
+    for room, text, expected in SESSION:
+        spoken_before = len(audio_manager.spoken)
+        command = Command(room, text)
+        main.process_command(command, histories.setdefault(room, []), dispatcher, llm, matcher)
+        command.trace.end('ok')
+        dispatcher.executor.submit(lambda: None).result()  # Let the handlers catch up
+        for speaker, volume in expected.items():
+            actual = dispatcher.state.get(speaker).volume
+            if actual != volume:
+                wrong.append(f"[{room}] {text!r}: {speaker} at {actual}, expected {volume}")
+        answers += [(room, text, spoken) for spoken in audio_manager.spoken[spoken_before:] if spoken != "Sure."]
+    dispatcher.shutdown()
+
+    tokens = metrics.snapshot()['counters'].get('llm_prompt_tokens', 0) - tokens_before
+    return {'calls': llm.calls, 'tokens': tokens, 'with_state': llm.with_state, 'wrong': wrong,
+            'answers': answers}
+
+
+def main_benchmark(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--llm', type=float, default=1200.0, help="LLM round trip in ms, for the time saved")
+    args = parser.parse_args(argv)
+
+    # The command path prints every step; keep the table readable
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            rows = [('stateless', run(False)), ('state', run(True))]
+        finally:
+            sys.stdout = stdout
+
+    print(f"\n--- Device state: {len(SESSION)} commands in {len({room for room, _, _ in SESSION})} rooms ---")
+    print(f"{'mode':<10} {'LLM calls':>9} {'prompt tokens':>13} {'with state':>10} {'tokens/call':>11}")
+    for mode, r in rows:
+        print(f"{mode:<10} {r['calls']:>9} {r['tokens']:>13} {r['with_state']:>10} "
+              f"{r['tokens'] / max(r['calls'], 1):>11.0f}")
+
+    stateless, state = rows[0][1], rows[1][1]
+    avoided = stateless['calls'] - state['calls']
+    print(f"\nLLM calls avoided: {avoided} of {stateless['calls']} "
+          f"({avoided * args.llm / 1000:.1f} s of LLM round trips at {args.llm:.0f} ms)")
+    print("\nAnswered from the device state:")
+    for room, text, spoken in state['answers']:
+        print(f"  [{room}] {text!r} -> {spoken}")
+    checks = sum(len(expected) for *_, expected in SESSION)
+    print(f"\nvolumes after relative changes: {checks - len(state['wrong'])}/{checks} as expected")
+    for problem in state['wrong']:
+        print(f"  WRONG: {problem}")
+
+
+if __name__ == '__main__':
+    main_benchmark(sys.argv[1:])
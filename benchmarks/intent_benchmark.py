@@ -0,0 +1,169 @@
+# benchmarks/intent_benchmark.py
+#
+# Hit rate and latency of the local intent matcher (intents.py) on a corpus of
+# sample utterances. Each sample lists the command the LLM should produce, or
+# None if the utterance must fall back to the LLM. A wrong local match is worse
+# than a fallback, so the report separates:
+#
+#   hits       matched locally with exactly the expected command
+#   wrong      matched locally with a different command (should be 0)
+#   missed     expected a local match but fell back to the LLM
+#   fallbacks  correctly left to the LLM
+#
+# Usage: python benchmarks/intent_benchmark.py [llm_round_trip_ms]
+
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+
+from intents import IntentMatcher
+
+ALL = ["joseph's room", "rec room", "bar area", "office", "abe's room", "andrea's room", "family room",
+       "kitchen", "master room", "master bath", "patio", "deck"]
+
+
+def volume(speakers, level):
+    return {"function": "setVolume", "parameters": {"speakers": speakers, "volume": level}}
+
+
+def music(**parameters):
+    return {"function": "playMusic", "parameters": parameters}
+
+
+def adjust(speakers, change, follow_group):
+    """A relative setVolume; device_state.py fills in the volume when it runs."""
+    return {"function": "setVolume", "parameters": {"speakers": speakers},
+            "state": {"change": change, "follow_group": follow_group}}
+
+
+def question(room, query, about, follow_group):
+    """A question about the speakers, answered from the device state."""
+    return {"function": "makeSpeech", "parameters": {"speakers": [room]},
+            "state": {"query": query, "about": about, "follow_group": follow_group}}
+
+
+# (source room, utterance, expected command or None)
+CORPUS = [
+    ("kitchen", "volume 30 in the kitchen", volume(["kitchen"], 30)),
+    ("kitchen", "Volume 30.", volume(["kitchen"], 30)),
+    ("office", "set the volume to 45", volume(["office"], 45)),
+    ("office", "Jarvis, turn the volume down to 20 percent please", volume(["office"], 20)),
+    ("patio", "turn the music up to 80", volume(["patio"], 80)),
+    ("deck", "set the volume to fifty in the family room", volume(["family room"], 50)),
+    ("deck", "set the kitchen to 40", volume(["kitchen"], 40)),
+    ("deck", "turn the patio volume down to 10", volume(["patio"], 10)),
+    ("rec room", "rec room volume 65", volume(["rec room"], 65)),
+    ("rec room", "set the volume in josephs room to 25", volume(["joseph's room"], 25)),
+    ("rec room", "volume 15 in the kitchen and the bar area", volume(["kitchen", "bar area"], 15)),
+    ("office", "set the volume to 35 everywhere", volume(ALL, 35)),
+    ("master room", "mute", volume(["master room"], 0)),
+    ("master room", "mute the music in the master bath", volume(["master bath"], 0)),
+    ("kitchen", "mute the deck", volume(["deck"], 0)),
+    ("kitchen", "could you set the volume to thirty five", volume(["kitchen"], 35)),
+    ("kitchen", "volume 30 in the kitchn", volume(["kitchen"], 30)),
+    ("abe's room", "set abe room to 20", volume(["abe's room"], 20)),
+    ("office", "play Like a Rolling Stone by Bob Dylan in the office at 65% volume",
+     music(song="Like a Rolling Stone", artist="Bob Dylan", speakers=["office"], volume=65)),
+    ("kitchen", "play the dinner party playlist",
+     music(playlist="dinner party", speakers=["kitchen"])),
+    ("kitchen", "play the dinner party playlist in the kitchen and the family room on Spotify",
+     music(playlist="dinner party", speakers=["kitchen", "family room"], platform="Spotify")),
+    ("patio", "play Hey Jude by the Beatles on the patio",
+     music(song="Hey Jude", artist="the Beatles", speakers=["patio"])),
+    ("bar area", "play some music by Queen at 40 percent",
+     music(artist="Queen", speakers=["bar area"], volume=40)),
+    ("bar area", "play a song by Queen", music(artist="Queen", speakers=["bar area"])),
+    ("office", "play In the Air Tonight by Phil Collins in the office",
+     music(song="In the Air Tonight", artist="Phil Collins", speakers=["office"])),
+    ("deck", "play playlist summer vibes everywhere",
+     music(playlist="summer vibes", speakers=ALL)),
+    ("kitchen", "stop", {"function": "stopSpeech", "parameters": {"speakers": ["kitchen"]}}),
+    ("office", "Jarvis, stop talking.", {"function": "stopSpeech", "parameters": {"speakers": ["office"]}}),
+    ("office", "be quiet in the patio", {"function": "stopSpeech", "parameters": {"speakers": ["patio"]}}),
+    ("family room", "put on Thriller by Michael Jackson on Apple Music",
+     music(song="Thriller", artist="Michael Jackson", platform="Apple Music", speakers=["family room"])),
+    ("kitchen", "turn it up a little", adjust(["kitchen"], 5, True)),
+    ("kitchen", "make it louder in here", adjust(["kitchen"], 10, False)),
+    ("office", "turn the music down in the patio", adjust(["patio"], -10, False)),
+    ("deck", "turn the kitchen up by 20", adjust(["kitchen"], 20, False)),
+    # Up or down with a bare number is relative, never "set the volume to N"
+    ("kitchen", "turn it up 5", adjust(["kitchen"], 5, True)),
+    ("office", "volume up 10", adjust(["office"], 10, True)),
+    ("patio", "turn the music down 10", adjust(["patio"], -10, True)),
+    ("deck", "turn it down 10 percent", adjust(["deck"], -10, True)),
+    ("office", "turn it up 20 in the kitchen", adjust(["kitchen"], 20, False)),
+    ("office", "how loud is the kitchen", question("office", "volume", ["kitchen"], False)),
+    ("family room", "what's playing?", question("family room", "now_playing", ["family room"], True)),
+    # These need the LLM: open questions, ambiguous requests, no such function
+    ("kitchen", "stop the music", None),
+    ("office", "play jazz", None),
+    ("office", "play something relaxing", None),
+    ("abe's room", "what is the largest country", None),
+    ("abe's room", "who was the 16th president of the united states", None),
+    ("kitchen", "tell the patio dinner is ready", None),
+    ("kitchen", "volume 30 in the garage", None),
+    ("kitchen", "set the volume to 150", None),
+    ("kitchen", "what's the weather like tomorrow", None),
+    ("garage", "volume 40", None),
+    ("office", "play the same song again", None),
+    ("kitchen", "turn the garage up", None),
+    ("kitchen", "play the song by the Beatles", None),  # Which song? Not one called "the song"
+    ("office", "play that song by Adele again", None),
+    # Near-misses of real speaker names must not be taken for them
+    ("kitchen", "turn the bedroom to 40", None),
+    ("kitchen", "turn the bedroom up", None),
+    ("office", "volume 30 in the bed room", None),
+    ("office", "set the game room to 25", None),
+    ("deck", "volume 20 in the rest room", None),
+    ("deck", "turn the red room down", None),
+    ("deck", "set the deck room to 50", None),
+]
+
+
+def main(argv):
+    llm_ms = float(argv[0]) if argv else 1200.0
+    matcher = IntentMatcher(os.path.join(ROOT, 'system_prompt.txt'))
+
+    hits = wrong = missed = fallbacks = 0
+    timings = []
+    for room, utterance, expected in CORPUS:
+        started = time.perf_counter()
+        result = matcher.match(utterance, room)
+        timings.append(time.perf_counter() - started)
+
+        if result is None:
+            if expected is None:
+                fallbacks += 1
+            else:
+                missed += 1
+                print(f"  missed: [{room}] {utterance!r}")
+        elif result == expected:
+            hits += 1
+        else:
+            wrong += 1
+            print(f"  WRONG:  [{room}] {utterance!r} -> {result}")
+
+    # Repeat to get stable per-call timings
+    for _ in range(20):
+        for room, utterance, _ in CORPUS:
+            started = time.perf_counter()
+            matcher.match(utterance, room)
+            timings.append(time.perf_counter() - started)
+    timings.sort()
+
+    expected_local = sum(1 for *_, expected in CORPUS if expected is not None)
+    print(f"\n--- Intent matcher: {len(CORPUS)} utterances ({expected_local} expected locally) ---")
+    print(f"hits={hits} wrong={wrong} missed={missed} fallbacks={fallbacks}")
+    print(f"fast-path hit rate: {hits / len(CORPUS):.0%} of all commands, "
+          f"{hits / max(expected_local, 1):.0%} of matchable ones")
+    print(f"match latency: p50={timings[len(timings) // 2] * 1e6:.0f}us "
+          f"p99={timings[int(len(timings) * 0.99)] * 1e6:.0f}us")
+    print(f"LLM time saved at {llm_ms:.0f} ms per round trip: {hits * llm_ms / 1000:.1f}s "
+          f"over {len(CORPUS)} commands")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,123 @@
+# benchmarks/listener_load_test.py
+#
+# Load test for the event-loop listener server. Connects hundreds of simulated
+# mic clients that stream silence in real time and reports the server's thread
+# count and traced memory while they run.
+#
+# Usage: python benchmarks/listener_load_test.py [n_clients] [seconds]
+
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import listener
+from protocol import CODEC_PCM16, FRAME_AUDIO, pack_frame_header, pack_hello
+
+CLIENT_CHUNK_SAMPLES = 1280  # mic_client sends one 80ms frame at a time
+CLIENT_CHUNK_BYTES = CLIENT_CHUNK_SAMPLES * listener.AUDIO_WIDTH
+CLIENT_CHUNK_SECONDS = CLIENT_CHUNK_SAMPLES / listener.AUDIO_RATE
+
+
+class SilentStream:
+    def add_audio(self, audio_np):
+        pass
+
+    def reset(self):
+        pass
+
+
+class SilentWakeEngine:
+    """Stands in for wake_word.WakeWordEngine: never detects the wake word."""
+    def __init__(self):
+        self.frames = 0
+
+    def create_stream(self, mic_id):
+        return SilentStream()
+
+    def predict(self, streams):
+        self.frames += len(streams)
+        return {stream: 0.0 for stream in streams}
+
+
+def connect_clients(address, n_clients):
+    clients = []
+    for i in range(n_clients):
+        client_socket = socket.create_connection(address)
+        client_socket.sendall(pack_hello(f"load mic {i}", CODEC_PCM16, listener.AUDIO_RATE, CLIENT_CHUNK_SAMPLES))
+        if client_socket.recv(1) != b'\x01':
+            raise RuntimeError(f"Client {i} was not acknowledged")
+        clients.append(client_socket)
+    return clients
+
+
+def stream_silence(clients, duration, stop_event, sent):
+    """Sends one chunk per client every CLIENT_CHUNK_SECONDS from a single thread."""
+    chunk = bytes(CLIENT_CHUNK_BYTES)
+    sequence = 0
+    next_send = time.monotonic()
+    deadline = next_send + duration
+    while not stop_event.is_set() and next_send < deadline:
+        frame = pack_frame_header(FRAME_AUDIO, CODEC_PCM16, len(chunk), sequence) + chunk
+        for client_socket in clients:
+            client_socket.sendall(frame)
+        sequence += 1
+        sent[0] += len(clients)
+        next_send += CLIENT_CHUNK_SECONDS
+        time.sleep(max(0.0, next_send - time.monotonic()))
+
+
+def run(n_clients=300, duration=10.0):
+    tracemalloc.start()
+    threads_before = threading.active_count()
+
+    engine = SilentWakeEngine()
+    server = listener.EventListenerServer(queue.Queue(), engine, host='127.0.0.1', port=0)
+    address = server.bind()
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    clients = connect_clients(address, n_clients)
+    stop_event = threading.Event()
+    sent = [0]
+    sender = threading.Thread(target=stream_silence, args=(clients, duration, stop_event, sent), daemon=True)
+    sender.start()
+
+    samples = []
+    start = time.monotonic()
+    while sender.is_alive():
+        time.sleep(duration / 5)
+        current, _ = tracemalloc.get_traced_memory()
+        # Every thread started since threads_before except the sender belongs to the server
+        server_threads = threading.active_count() - threads_before - 1
+        samples.append((time.monotonic() - start, server_threads, current))
+    elapsed = time.monotonic() - start
+    time.sleep(0.5)  # let the workers drain what is still buffered
+
+    _, peak = tracemalloc.get_traced_memory()
+    dropped = sum(conn.dropped_frames for conn in list(server.connections.values()))
+    for client_socket in clients:
+        client_socket.close()
+    server.stop()
+    server_thread.join()
+    tracemalloc.stop()
+
+    expected = sent[0] * CLIENT_CHUNK_SAMPLES // listener.CHUNK_SIZE
+    print(f"\n--- Listener load test: {n_clients} clients for {elapsed:.1f}s ---")
+    print(f"{'t (s)':>8} {'server threads':>15} {'traced memory (KiB)':>20}")
+    for t, n_threads, current in samples:
+        print(f"{t:8.1f} {n_threads:15d} {current / 1024:20.0f}")
+    print(f"Peak traced memory: {peak / 1024:.0f} KiB")
+    print(f"Frames processed: {engine.frames} of {expected} sent, dropped: {dropped}")
+    print(f"STT worker pool size: {listener.STT_WORKER_THREADS}")
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    run(n, seconds)
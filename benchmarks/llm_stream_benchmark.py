@@ -0,0 +1,196 @@
+# benchmarks/llm_stream_benchmark.py
+#
+# Measures time-to-first-action for LLM replies, offline. A local fake
+# OpenAI-compatible server answers /v1/chat/completions with canned replies,
+# streamed token by token (Server-Sent Events, like the real API) with a
+# configurable time-to-first-token and per-token delay. Each reply is run
+# through the blocking path (get_llm_response + parse_and_execute) and the
+# streaming path (stream_llm_response + StreamingCommandHandler) against a
+# Dispatcher whose AudioManager only records when it was asked to speak.
+#
+# "First action" is the first Dispatcher handler call or spoken sentence.
+#
+# Usage: python benchmarks/llm_stream_benchmark.py [--first-token-ms MS] [--per-token-ms MS]
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from openai import OpenAI
+
+from dispatcher import Dispatcher
+from playback import SharedAudio
+from tts import FORMAT_PCM16
+from llm_stream import StreamingCommandHandler
+from main import get_llm_response, parse_and_execute, stream_llm_response
+
+CANNED_REPLIES = {
+    'setVolume': {"function": "setVolume", "parameters": {"speakers": ["kitchen"], "volume": 30}},
+    'playMusic': {"function": "playMusic", "parameters": {
+        "playlist": "dinner party", "platform": "Spotify", "speakers": ["kitchen", "family room"], "volume": 40}},
+    'makeSpeech': {"function": "makeSpeech", "parameters": {
+        "speakers": ["office"],
+        "message": "The Great Wall of China is about 21,000 kilometers long. It was built over many "
+                   "centuries, mostly during the Ming dynasty. Contrary to popular belief, it is not "
+                   "visible from space with the naked eye. Parts of it are more than two thousand years old."}},
+}
+TOKEN_CHARS = 4  # Roughly how much text one token carries
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Serves the canned reply named by the last user message, streamed or not."""
+    protocol_version = 'HTTP/1.1'
+    first_token_delay = 0.3
+    per_token_delay = 0.02
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        reply = json.dumps(CANNED_REPLIES[body['messages'][-1]['content']], indent=1)
+        tokens = [reply[i:i + TOKEN_CHARS] for i in range(0, len(reply), TOKEN_CHARS)]
+
+        if not body.get('stream'):
+            time.sleep(self.first_token_delay + self.per_token_delay * len(tokens))
+            self._send_json(200, self._completion(reply))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        time.sleep(self.first_token_delay)
+        for token in tokens:
+            self._send_chunk(f"data: {json.dumps(self._chunk(token))}\n\n")
+            time.sleep(self.per_token_delay)
+        self._send_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    @staticmethod
+    def _completion(content):
+        return {"id": "fake", "object": "chat.completion", "created": int(time.time()), "model": "fake",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}]}
+
+    @staticmethod
+    def _chunk(content):
+        return {"id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": "fake",
+                "choices": [{"index": 0, "finish_reason": None, "delta": {"content": content}}]}
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The OpenAI client drops its keep-alive connections when it is done
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class RecordingAudioManager:
+    """Stands in for AudioManager: remembers when each sentence would have been spoken."""
+    def __init__(self):
+        self.spoken_at = []
+
+    def synthesize(self, text):
+        audio = SharedAudio(FORMAT_PCM16, 16000, cached=True)
+        audio.finish()
+        return audio
+
+    def play(self, audio, speaker, volume, stopped=None):
+        self.spoken_at.append(time.monotonic())
+
+
+class TimedDispatcher(Dispatcher):
+    """A Dispatcher that records when its first handler ran."""
+    def __init__(self):
+        super().__init__(audio_manager=RecordingAudioManager())
+        self.executed_at = []
+        self.futures = []
+        self.streams = []
+
+    def execute(self, function_name, parameters):
+        self.executed_at.append(time.monotonic())
+        future = super().execute(function_name, parameters)
+        self.futures.append(future)
+        return future
+
+    def begin_speech(self, parameters):
+        stream = super().begin_speech(parameters)
+        self.streams.append(stream)
+        return stream
+
+    def first_action(self):
+        # Handlers and playback run on other threads; let them finish first
+        for future in self.futures + [f for stream in self.streams for f in stream.futures]:
+            future.result()
+        self.shutdown()
+        return min(self.executed_at + self.audio_manager.spoken_at, default=None)
+
+
+def run_once(client, name, streaming):
+    dispatcher = TimedDispatcher()
+    messages = [{"role": "user", "content": name}]
+    started = time.monotonic()
+    if streaming:
+        handler = StreamingCommandHandler(dispatcher)
+        stream_llm_response(client, messages, handler)
+        handler.finish()
+    else:
+        parse_and_execute(get_llm_response(client, messages), dispatcher)
+    done = time.monotonic()
+    first = dispatcher.first_action()
+    return (first - started if first else float('nan')), done - started
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--first-token-ms', type=float, default=FakeOpenAIHandler.first_token_delay * 1000,
+                        help="Time to the first token of every reply")
+    parser.add_argument('--per-token-ms', type=float, default=FakeOpenAIHandler.per_token_delay * 1000,
+                        help="Delay between streamed tokens")
+    args = parser.parse_args(argv)
+    FakeOpenAIHandler.first_token_delay = args.first_token_ms / 1000
+    FakeOpenAIHandler.per_token_delay = args.per_token_ms / 1000
+
+    server = FakeOpenAIServer(('127.0.0.1', 0), FakeOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = OpenAI(api_key='fake', base_url=f"http://127.0.0.1:{server.server_address[1]}/v1")
+
+    results = []
+    for name in CANNED_REPLIES:
+        for streaming in (False, True):
+            first_action, total = run_once(client, name, streaming)
+            results.append((name, 'streaming' if streaming else 'blocking', first_action, total))
+    client.close()
+    server.shutdown()
+
+    print(f"\n--- LLM time to first action (first token {FakeOpenAIHandler.first_token_delay * 1000:.0f} ms, "
+          f"{FakeOpenAIHandler.per_token_delay * 1000:.0f} ms/token) ---")
+    print(f"{'reply':<12} {'mode':<10} {'first action (ms)':>18} {'total (ms)':>11}")
+    for name, mode, first_action, total in results:
+        print(f"{name:<12} {mode:<10} {first_action * 1000:18.0f} {total * 1000:11.0f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
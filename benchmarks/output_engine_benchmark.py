@@ -0,0 +1,147 @@
+# benchmarks/output_engine_benchmark.py
+#
+# Per-zone cost and latency of the multi-zone output engine (output_engine.py)
+# as the number of zones grows to 12. For each zone count, one message is
+# fanned out to every zone, the way PlaybackScheduler does it: one thread per
+# zone calls OutputEngine.play_pcm with the same SharedAudio, at 22.05 kHz so
+# it is resampled like piper/espeak output.
+#
+#   null sinks  mixing cost only: CPU ms per zone per second of audio
+#   tcp sinks   one in-process speaker client per zone over localhost, measuring
+#               start latency (play_pcm call -> first frame received),
+#               inter-zone skew (spread of arrival times of the same frame) and
+#               jitter (deviation of frame arrival intervals from 20 ms)
+#
+# The tcp CPU column includes the in-process clients, so it overstates the
+# server's share.
+#
+# Usage: python benchmarks/output_engine_benchmark.py [seconds_of_audio]
+
+import os
+import socket
+import sys
+import threading
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from output_engine import OUTPUT_FRAME_SAMPLES, OUTPUT_RATE, OutputEngine
+from playback import SharedAudio
+from protocol import ACK, CODEC_PCM16, FRAME_HEADER, pack_hello
+from tts import FORMAT_PCM16, pcm_chunks
+
+ZONE_COUNTS = [1, 2, 4, 8, 12]
+SOURCE_RATE = 22050
+SPEAKERS = ["joseph's room", "rec room", "bar area", "office", "abe's room", "andrea's room", "family room",
+            "kitchen", "master room", "master bath", "patio", "deck"]
+
+
+class FrameRecorder(threading.Thread):
+    """A minimal speaker client that records when each frame arrived."""
+    def __init__(self, port, speaker):
+        super().__init__(daemon=True)
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.sock.sendall(pack_hello(speaker, CODEC_PCM16, OUTPUT_RATE, OUTPUT_FRAME_SAMPLES))
+        if self.sock.recv(2)[:1] != ACK:
+            raise RuntimeError(f"speaker '{speaker}' was rejected")
+        self.arrivals = {}
+
+    def run(self):
+        header = bytearray(FRAME_HEADER.size)
+        payload = bytearray(0xFFFF)
+        try:
+            while True:
+                if not self._fill(memoryview(header)):
+                    return
+                _, _, length, sequence = FRAME_HEADER.unpack(header)
+                if not self._fill(memoryview(payload)[:length]):
+                    return
+                self.arrivals[sequence] = time.perf_counter()
+        except OSError:
+            return
+
+    def _fill(self, view):
+        while len(view):
+            n = self.sock.recv_into(view)
+            if not n:
+                return False
+            view = view[n:]
+        return True
+
+
+def make_audio(seconds):
+    t = np.arange(int(SOURCE_RATE * seconds)) / SOURCE_RATE
+    tone = (np.sin(2 * np.pi * 220 * t) * 8000).astype(np.int16)
+    audio = SharedAudio(FORMAT_PCM16, SOURCE_RATE, cached=True)
+    for chunk in pcm_chunks(tone.tobytes()):
+        audio.append(chunk)
+    audio.finish()
+    return audio
+
+
+def fan_out(engine, audio, speakers):
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    threads = [threading.Thread(target=engine.play_pcm, args=(audio, speaker, 80)) for speaker in speakers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return started, time.process_time() - cpu_started
+
+
+def run(zone_count, seconds, sink):
+    speakers = SPEAKERS[:zone_count]
+    engine = OutputEngine(speakers=speakers, default_sink=sink, host='127.0.0.1', port=0).start()
+    recorders = []
+    if sink == 'tcp':
+        recorders = [FrameRecorder(engine.server.port, speaker) for speaker in speakers]
+        for recorder in recorders:
+            recorder.start()
+        time.sleep(0.2)  # Let the handshakes finish
+    started, cpu = fan_out(engine, make_audio(seconds), speakers)
+    time.sleep(0.1)
+    engine.close()
+    result = {'cpu_ms_per_zone_second': cpu * 1000 / zone_count / seconds}
+    if not recorders:
+        return result
+
+    first = [min(r.arrivals.values()) - started for r in recorders if r.arrivals]
+    common = set.intersection(*(set(r.arrivals) for r in recorders))
+    skew = [max(r.arrivals[s] for r in recorders) - min(r.arrivals[s] for r in recorders) for s in common]
+    jitter = []
+    for recorder in recorders:
+        times = [recorder.arrivals[s] for s in sorted(recorder.arrivals)]
+        jitter.extend(abs(b - a - engine.frame_seconds) for a, b in zip(times, times[1:]))
+    frames = sum(len(r.arrivals) for r in recorders) / zone_count
+    result.update(start_ms=np.mean(first) * 1000, start_max_ms=max(first) * 1000,
+                  skew_p95_ms=np.percentile(skew, 95) * 1000, skew_max_ms=max(skew) * 1000,
+                  jitter_p95_ms=np.percentile(jitter, 95) * 1000, jitter_max_ms=max(jitter) * 1000,
+                  frames=frames)
+    return result
+
+
+def main(argv):
+    seconds = float(argv[0]) if argv else 3.0
+    rows = []
+    for zone_count in ZONE_COUNTS:
+        null = run(zone_count, seconds, 'null')
+        tcp = run(zone_count, seconds, 'tcp')
+        rows.append((zone_count, null, tcp))
+
+    expected_frames = int(seconds * OUTPUT_RATE / OUTPUT_FRAME_SAMPLES)
+    print(f"\n--- Output engine: {seconds:.1f}s message fanned out to N zones "
+          f"({expected_frames} frames of {OUTPUT_FRAME_SAMPLES * 1000 // OUTPUT_RATE} ms each) ---")
+    print(f"{'zones':>5} {'cpu/zone null':>14} {'cpu/zone tcp':>13} {'start ms':>13} "
+          f"{'skew p95/max':>13} {'jitter p95/max':>15} {'frames':>7}")
+    for zone_count, null, tcp in rows:
+        print(f"{zone_count:>5} {null['cpu_ms_per_zone_second']:>11.2f} ms {tcp['cpu_ms_per_zone_second']:>10.2f} ms "
+              f"{tcp['start_ms']:>6.1f}/{tcp['start_max_ms']:<6.1f} "
+              f"{tcp['skew_p95_ms']:>6.2f}/{tcp['skew_max_ms']:<6.2f} "
+              f"{tcp['jitter_p95_ms']:>7.2f}/{tcp['jitter_max_ms']:<7.2f} {tcp['frames']:>7.0f}")
+    print("cpu/zone = CPU milliseconds per zone per second of audio")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,199 @@
+# benchmarks/overload_benchmark.py
+#
+# Stress test of the command backpressure (backpressure.py). Commands arrive
+# faster than a slow mocked LLM can answer them, for --seconds: half are
+# "set the volume to N" (local intents, coalesced per room), half need the LLM,
+# and one chatty mic ("tv") fires far more often than anyone speaks.
+#
+# The same arrivals are run twice:
+#   unbounded   no queue limits, deadlines, coalescing or rate limiting
+#   bounded     the backpressure.py defaults, with --deadline
+#
+#   latency     arrival (wake word) -> first function executed, for the commands that ran
+#   late p95    p95 latency of the commands that arrived in the last third of the run;
+#               it keeps growing without backpressure and stays flat with it
+#   drain       seconds after the last arrival until everything accepted has finished
+#
+# Usage: python benchmarks/overload_benchmark.py [--seconds S] [--rate N] [--llm MS] [--deadline S]
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # The prompt builder reads system_prompt.txt from the working directory
+
+import backpressure
+import tracing
+from backpressure import CommandQueue, RateLimiter
+from dispatcher import Dispatcher
+from intents import IntentMatcher
+from listener import queue_command
+from main import CommandProcessor
+from metrics import metrics
+from replay_harness import get_source_room
+
+ROOMS = ['kitchen', 'office', 'bedroom', 'living room', 'bathroom', 'garage']
+CHATTY_MIC = 'tv'
+COUNTERS = ['commands_shed', 'commands_expired', 'commands_coalesced']
+
+
+class SlowLLMClient:
+    """Mimics client.chat.completions.create(): sleeps for the injected latency, then streams a makeSpeech."""
+    def __init__(self, latency, jitter, rng):
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = rng
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, stream=False, **kwargs):
+        command = next(m['content'] for m in reversed(messages) if m['role'] == 'user')
+        reply = json.dumps({"function": "makeSpeech",
+                            "parameters": {"speakers": [get_source_room(command)], "text": "Sure."}})
+        time.sleep(max(0.0, self.rng.gauss(self.latency, self.jitter)))
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+        return [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=reply[i:i + 8]))])
+                for i in range(0, len(reply), 8)]
+
+
+class SilentAudioManager:
+    def synthesize(self, text):
+        return None
+
+    def play(self, audio, speaker, volume, stopped=None):
+        pass
+
+
+class LatencyDispatcher(Dispatcher):
+    """Records, per command, how long after its arrival the first function was executed."""
+    def __init__(self):
+        super().__init__(audio_manager=SilentAudioManager())
+        self.lock = threading.Lock()
+        self.executed = {}  # trace_id -> (arrived at, latency)
+
+    def execute(self, function_name, parameters):
+        trace = tracing.current()
+        if trace is None:
+            return
+        with self.lock:
+            if trace.trace_id not in self.executed:
+                self.executed[trace.trace_id] = (trace.origin, time.monotonic() - trace.origin)
+
+
+def arrivals(seconds, rate, chatty_rate, seed):
+    """(offset, mic, text) for every command of the run, in arrival order."""
+    rng = random.Random(seed)
+    events = []
+    for mic, mic_rate in [(None, rate), (CHATTY_MIC, chatty_rate)]:
+        at = rng.expovariate(mic_rate)
+        while at < seconds:
+            room = mic or rng.choice(ROOMS)
+            text = f"set the volume to {rng.randrange(10, 90)}" if rng.random() < 0.5 else f"question {len(events)}"
+            events.append((at, room, text))
+            at += rng.expovariate(mic_rate)
+    return sorted(events)
+
+
+def consume(command_queue, processor, stop):
+    while not stop.is_set():
+        try:
+            processor.submit(command_queue.get(timeout=0.1))
+        except Exception:
+            continue
+
+
+def run(bounded, events, args):
+    baseline = metrics.snapshot()['counters']
+    backpressure.COMMAND_DEADLINE = args.deadline if bounded else None
+    backpressure.COALESCE_FUNCTIONS = ('setVolume', 'stopSpeech') if bounded else ()
+    command_queue = CommandQueue() if bounded else CommandQueue(maxsize=0)
+    limiter = RateLimiter() if bounded else None
+    dispatcher = LatencyDispatcher()
+    llm = SlowLLMClient(args.llm / 1000, args.jitter / 1000, random.Random(args.seed))
+    processor = CommandProcessor(dispatcher, llm, args.workers, IntentMatcher(),
+                                 max_pending=backpressure.MAX_PENDING_PER_ROOM if bounded else 0)
+    stop = threading.Event()
+    threading.Thread(target=consume, args=(command_queue, processor, stop), daemon=True).start()
+
+    limited = 0
+    started = time.monotonic()
+    for offset, mic, text in events:
+        time.sleep(max(0.0, started + offset - time.monotonic()))
+        if limiter is not None and not limiter.allow(mic):
+            limited += 1  # The listener would not even have captured it
+            continue
+        queue_command(mic, text, command_queue)
+    arrivals_end = time.monotonic()
+
+    # Drained when nothing is queued or in flight twice in a row (the consumer may hold one in between)
+    idle_polls = 0
+    while idle_polls < 2:
+        time.sleep(0.05)
+        busy = command_queue.qsize() or processor.pending_commands()
+        idle_polls = 0 if busy else idle_polls + 1
+    drain = time.monotonic() - arrivals_end
+    stop.set()
+    processor.shutdown()
+
+    counters = metrics.snapshot()['counters']
+    late_from = started + args.seconds * 2 / 3
+    latencies = sorted(latency for _, latency in dispatcher.executed.values())
+    late = sorted(latency for arrived, latency in dispatcher.executed.values() if arrived >= late_from)
+    result = {name: counters.get(name, 0) - baseline.get(name, 0) for name in COUNTERS}
+    result.update(offered=len(events), executed=len(latencies), limited=limited, drain=drain,
+                  p50=tracing.percentile(latencies, 0.50) if latencies else 0.0,
+                  p95=tracing.percentile(latencies, 0.95) if latencies else 0.0,
+                  max=latencies[-1] if latencies else 0.0,
+                  late_p95=tracing.percentile(late, 0.95) if late else 0.0)
+    return result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=30.0, help="How long commands keep arriving")
+    parser.add_argument('--rate', type=float, default=1.0, help="Commands per second from all the rooms together")
+    parser.add_argument('--tv-rate', type=float, default=0.5, help="Commands per second from the chatty mic")
+    parser.add_argument('--llm', type=float, default=4000.0, help="Mean LLM latency in ms")
+    parser.add_argument('--jitter', type=float, default=800.0, help="Standard deviation of the latency in ms")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--deadline', type=float, default=8.0, help="Command deadline in the bounded run, in s")
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    events = arrivals(args.seconds, args.rate, args.tv_rate, args.seed)
+    rows = []
+    for bounded in (False, True):
+        print(f"Running {'bounded' if bounded else 'unbounded'}...", file=sys.stderr)
+        # The command path prints every command; keep the table readable
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                rows.append(('bounded' if bounded else 'unbounded', run(bounded, events, args)))
+            finally:
+                sys.stdout = stdout
+
+    print(f"\n--- Overload: {args.rate:g}/s from {len(ROOMS)} rooms + {args.tv_rate:g}/s from '{CHATTY_MIC}' "
+          f"for {args.seconds:g} s, LLM {args.llm:.0f}+-{args.jitter:.0f} ms, {args.workers} workers ---")
+    print(f"{'mode':<10} {'offered':>7} {'executed':>8} {'shed':>5} {'expired':>7} {'coalesced':>9} "
+          f"{'limited':>7} {'p50 s':>6} {'p95 s':>6} {'max s':>6} {'late p95':>8} {'drain s':>7}")
+    for mode, r in rows:
+        print(f"{mode:<10} {r['offered']:>7} {r['executed']:>8} {r['commands_shed']:>5} {r['commands_expired']:>7} "
+              f"{r['commands_coalesced']:>9} {r['limited']:>7} {r['p50']:>6.1f} {r['p95']:>6.1f} "
+              f"{r['max']:>6.1f} {r['late_p95']:>8.1f} {r['drain']:>7.1f}")
+
+    # A command is started before its deadline, and then waits at most for one LLM reply
+    bound = args.deadline + (args.llm + 4 * args.jitter) / 1000
+    worst = rows[1][1]['max']
+    print(f"\nbounded latency: max {worst:.1f} s, limit {bound:.1f} s "
+          f"(deadline + slowest LLM reply) -> {'ok' if worst <= bound else 'EXCEEDED'}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
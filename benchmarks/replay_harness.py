@@ -0,0 +1,626 @@
+# benchmarks/replay_harness.py
+#
+# Offline replay of the whole pipeline. N fake mic clients stream WAV files
+# over TCP, in real time or faster, into the listener's EventListenerServer
+# (what run_server starts, bound to a free localhost port). From there commands
+# go to the command queue, command_consumer_thread, the Dispatcher, the
+# AudioManager and the output engine (null sinks). STT, LLM and TTS are stubs
+# with configurable latency distributions, so no mics, Google STT or OpenAI
+# are needed.
+#
+# Wake word: --wake marker (the default) uses a stand-in engine that fires on
+# a 1 kHz tone, which the synthetic sessions play where "hey jarvis" would be.
+# --wake openwakeword runs the real model on real recordings (needs the models).
+# --shards N replays into the sharded listener (sharded_listener.py) instead,
+# with the wake word engine in N worker processes.
+#
+# Audio: --wav-dir plays 16 kHz mono 16-bit WAVs, one per mic (round robin).
+# A label file next to a WAV (name.txt, Audacity format as in vad_evaluation.py)
+# marks its wake words, which is needed to score detection accuracy. Without
+# --wav-dir every mic plays a generated session of room noise, wake tones
+# followed by commands, and conversation that should not wake anything.
+# With --adjacent K, mics come in groups of K that hear the same session, as
+# mics in neighbouring rooms would: quieter and slightly later, over their own
+# noise. Each group is one wake word arbitration area.
+#
+# Reported: throughput, wake word hits/misses/false wakes, dropped audio,
+# queue depths and per-stage latency from the command traces (tracing.py).
+#
+# Usage: python benchmarks/replay_harness.py [--mics N] [--speed X] [--wav-dir DIR] [--seconds S]
+#        [--adjacent K] [--no-arbitration] [--wake marker|openwakeword] [--shards N]
+#        [--stt MEAN:SD] [--llm MEAN:SD] [--tts MEAN:SD] [--verbose]
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # The intent matcher and prompt builder read system_prompt.txt from the working directory
+
+import listener
+import tracing
+from audio_manager import AudioManager
+from backpressure import CommandQueue
+from dispatcher import Dispatcher
+from intents import load_prompt_spec
+from main import MAX_CONCURRENT_COMMANDS, command_consumer_thread
+from metrics import metrics
+from output_engine import OutputEngine
+from protocol import ACK, CODEC_PCM16, FRAME_AUDIO, pack_frame_header, pack_hello
+from sharded_listener import ShardedListenerServer
+from stt import STTBackend, STTStream
+from tts import FORMAT_PCM16, TTSBackend, TTSCache
+from vad import frame_energy_db
+from vad_evaluation import load_labels, load_wav
+
+CHUNK_SAMPLES = listener.CHUNK_SIZE
+CHUNK_SECONDS = CHUNK_SAMPLES / listener.AUDIO_RATE
+MARKER_HZ = 1000.0
+MARKER_SECONDS = 0.5
+MARKER_MIN_DB = 50.0  # Quieter windows never count as the marker
+WAKE_TOLERANCE = 1.5  # Seconds after a labelled wake word a detection still counts as hitting it
+DRAIN_TIMEOUT = 30.0  # Seconds to wait after the audio ends for commands to finish
+ARBITRATION_WINDOW = listener.ARBITRATION_WINDOW
+
+# What the stub STT "hears": a mix the intent rules handle and ones that go to the LLM
+COMMANDS = [
+    "set the volume to 30",
+    "volume 45",
+    "turn it down to 20",
+    "stop",
+    "what's the weather like tomorrow",
+    "tell me a joke",
+    "remind me to call mom at six",
+    "play my dinner party playlist at volume 40",
+]
+SOURCE_ROOM_PATTERN = re.compile(r"source_room: '(.*?)'\}")  # Up to the brace: "joseph's room" has a quote
+
+
+def get_source_room(tagged_command):
+    """Reads the room out of a "METADATA: {source_room: '...'} MESSAGE: ..." message, for the stand-in LLMs."""
+    match = SOURCE_ROOM_PATTERN.search(tagged_command)
+    return match.group(1) if match else 'unknown'
+
+
+class Latency:
+    """A latency distribution given as "MEAN[:SD]" seconds; samples are normal, clipped at zero."""
+    def __init__(self, spec, rng):
+        mean, _, sd = spec.partition(':')
+        self.mean = float(mean)
+        self.sd = float(sd) if sd else 0.0
+        self.rng = rng
+        self.lock = threading.Lock()
+
+    def sample(self):
+        with self.lock:
+            return max(0.0, self.rng.gauss(self.mean, self.sd))
+
+    def __str__(self):
+        return f"{self.mean * 1000:.0f}+-{self.sd * 1000:.0f} ms"
+
+
+# --- STUB BACKENDS ---
+
+class ReplaySTTStream(STTStream):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def accept_audio(self, pcm_bytes):
+        return None
+
+    def finish(self):
+        time.sleep(self.backend.latency.sample())
+        return self.backend.next_text()
+
+
+class ReplaySTT(STTBackend):
+    """Pretends to transcribe: after the configured latency, returns one of COMMANDS."""
+    name = 'replay'
+
+    def __init__(self, latency, rng):
+        self.latency = latency
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def next_text(self):
+        with self.lock:
+            self.calls += 1
+            return self.rng.choice(COMMANDS)
+
+    def start_stream(self):
+        return ReplaySTTStream(self)
+
+
+class ReplayLLMClient:
+    """Mimics client.chat.completions.create(): waits for the first token, then streams the reply."""
+    TOKEN_SECONDS = 0.02  # Per streamed piece of 4 characters
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, stream=False, **kwargs):
+        self.calls += 1
+        command = next(m['content'] for m in reversed(messages) if m['role'] == 'user')
+        reply = json.dumps(self.reply(command))
+        time.sleep(self.latency.sample())
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+        return self._stream(reply)
+
+    def _stream(self, reply):
+        for i in range(0, len(reply), 4):
+            if i:
+                time.sleep(self.TOKEN_SECONDS)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=reply[i:i + 4]))])
+
+    @staticmethod
+    def reply(command):
+        room = re.sub(r" \d+$", '', get_source_room(command))  # "kitchen 2" is another mic in the kitchen
+        text = re.search(r"MESSAGE: (.*)$", command, re.S).group(1)
+        volume = re.search(r"\d+", text)
+        if 'volume' in text and volume:
+            return {"function": "setVolume", "parameters": {"speakers": [room], "volume": int(volume.group())}}
+        if text.startswith('play'):
+            return {"function": "playMusic", "parameters": {"speakers": [room], "playlist": text[5:]}}
+        return {"function": "makeSpeech",
+                "parameters": {"speakers": [room], "message": f"Here is what I found: {text}. Anything else?"}}
+
+
+class ReplayTTS(TTSBackend):
+    """Streams a quiet tone: the first chunk after the configured latency, the rest at 5x real time."""
+    name = 'replay'
+    voice = 'tone'
+    format = FORMAT_PCM16
+    sample_rate = 22050
+    streaming = True
+    CHUNK_SECONDS = 0.1
+    REAL_TIME_FACTOR = 0.2
+    CHARS_PER_SECOND = 15
+
+    def __init__(self, latency):
+        self.latency = latency
+        t = np.arange(int(self.sample_rate * self.CHUNK_SECONDS)) / self.sample_rate
+        self.chunk = (np.sin(2 * np.pi * 200 * t) * 2000).astype(np.int16).tobytes()
+
+    def stream(self, text, lang='en'):
+        time.sleep(self.latency.sample())
+        chunks = max(1, int(len(text) / self.CHARS_PER_SECOND / self.CHUNK_SECONDS))
+        for i in range(chunks):
+            if i:
+                time.sleep(self.CHUNK_SECONDS * self.REAL_TIME_FACTOR)
+            yield self.chunk
+
+
+# --- WAKE WORD ---
+
+class MarkerStream:
+    def __init__(self):
+        self.window = np.zeros(CHUNK_SAMPLES, dtype=np.int16)
+        self.armed = True  # Like openWakeWord after reset(), the rest of a marker cannot fire again
+
+    def add_audio(self, audio_np):
+        self.window[:] = audio_np
+
+    def reset(self):
+        self.window[:] = 0
+        self.armed = False
+
+
+class MarkerWakeEngine:
+    """Stands in for wake_word.WakeWordEngine: scores each window by its share of energy at MARKER_HZ."""
+    def __init__(self):
+        frequencies = np.fft.rfftfreq(CHUNK_SAMPLES, 1.0 / listener.AUDIO_RATE)
+        self.marker_bins = np.abs(frequencies - MARKER_HZ) <= 25.0
+
+    def create_stream(self, mic_id):
+        return MarkerStream()
+
+    def predict(self, streams):
+        windows = np.stack([stream.window for stream in streams]).astype(np.float32)
+        power = np.abs(np.fft.rfft(windows, axis=1)) ** 2
+        share = power[:, self.marker_bins].sum(axis=1) / (power.sum(axis=1) + 1.0)
+        share[frame_energy_db(windows) < MARKER_MIN_DB] = 0.0
+        scores = {}
+        for stream, score in zip(streams, share.tolist()):
+            if score <= listener.WAKE_THRESHOLD:
+                stream.armed = True
+            scores[stream] = score if stream.armed else 0.0
+        return scores
+
+
+class RecordingShardedServer(ShardedListenerServer):
+    """The sharded listener, noting detections as the shards report them (what RecordingWakeEngine does in-process)."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.detections = []  # (mic_id, monotonic time)
+
+    def _on_wake(self, index, slot, *details):
+        conn = self.by_slot.get((index, slot))
+        if conn is not None:
+            self.detections.append((conn.mic_id, time.monotonic()))
+        super()._on_wake(index, slot, *details)
+
+
+class RecordingWakeEngine:
+    """Wraps a wake word engine and notes when each mic's wake word fired."""
+    def __init__(self, engine):
+        self.engine = engine
+        self.mic_ids = {}
+        self.detections = []  # (mic_id, monotonic time)
+        self.lock = threading.Lock()
+
+    def create_stream(self, mic_id):
+        stream = self.engine.create_stream(mic_id)
+        self.mic_ids[stream] = mic_id
+        return stream
+
+    def predict(self, streams):
+        scores = self.engine.predict(streams)
+        now = time.monotonic()
+        with self.lock:
+            for stream in streams:
+                if scores[stream] > listener.WAKE_THRESHOLD:
+                    self.detections.append((self.mic_ids[stream], now))
+        return scores
+
+
+# --- AUDIO ---
+
+def voiced(rng, seconds):
+    """A voiced burst (harmonics with a slow attack), like vad_evaluation's synthetic speech."""
+    n = int(seconds * listener.AUDIO_RATE)
+    t = np.arange(n) / listener.AUDIO_RATE
+    pitch = rng.uniform(100, 220)
+    signal = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 8))
+    envelope = np.minimum(1.0, t / 0.15) * np.minimum(1.0, (seconds - t) / 0.1)
+    return signal * envelope * rng.uniform(1500, 6000)
+
+
+def synthetic_session(seconds, seed):
+    """Room noise with wake tones followed by commands, and some conversation. Returns (audio, wake regions)."""
+    rng = np.random.default_rng(seed)
+    rate = listener.AUDIO_RATE
+    audio = rng.normal(0, rng.uniform(20, 150), int(seconds * rate))
+    wake_regions = []
+    t = rng.uniform(1.0, 3.0)
+    while t + 6.0 < seconds:
+        if rng.random() < 0.75:
+            n = int(MARKER_SECONDS * rate)
+            tone = np.sin(2 * np.pi * MARKER_HZ * np.arange(n) / rate) * 4000
+            ramp = np.minimum(1.0, np.minimum(np.arange(n), n - np.arange(n)) / (0.02 * rate))
+            audio[int(t * rate):int(t * rate) + n] += tone * ramp
+            wake_regions.append((t, t + MARKER_SECONDS))
+            t += MARKER_SECONDS + rng.uniform(0.1, 0.3)
+        for _ in range(rng.integers(1, 3)):
+            burst = voiced(rng, rng.uniform(0.6, 1.6))
+            audio[int(t * rate):int(t * rate) + len(burst)] += burst
+            t += len(burst) / rate + rng.uniform(0.15, 0.4)
+        t += rng.uniform(2.5, 5.0)  # Long enough for the capture to end
+    return np.clip(audio, -32768, 32767).astype(np.int16), wake_regions
+
+
+def overheard(audio, rng):
+    """The same audio as a mic in the next room hears it: quieter, up to 10 ms later, over its own noise."""
+    delay = int(rng.uniform(0.0, 0.01) * listener.AUDIO_RATE)
+    heard = np.concatenate([np.zeros(delay), audio[:len(audio) - delay] * rng.uniform(0.25, 0.6)])
+    heard += rng.normal(0, rng.uniform(20, 60), len(audio))
+    return np.clip(heard, -32768, 32767).astype(np.int16)
+
+
+def load_sessions(wav_dir, n_mics, seconds, seed, adjacent=1):
+    """One (audio, wake regions or None) per mic."""
+    n_sources = -(-n_mics // adjacent)
+    if wav_dir is None:
+        sources = [synthetic_session(seconds, seed + i) for i in range(n_sources)]
+    else:
+        paths = sorted(glob.glob(os.path.join(wav_dir, '*.wav')))
+        if not paths:
+            raise SystemExit(f"No WAV files in {wav_dir}")
+        files = []
+        for path in paths:
+            label_path = os.path.splitext(path)[0] + '.txt'
+            files.append((load_wav(path), load_labels(label_path) if os.path.exists(label_path) else None))
+        sources = [files[i % len(files)] for i in range(n_sources)]
+    rng = np.random.default_rng(seed)
+    sessions = []
+    for i in range(n_mics):
+        audio, regions = sources[i // adjacent]
+        sessions.append((audio if i % adjacent == 0 else overheard(audio, rng), regions))
+    return sessions
+
+
+def mic_names(n_mics):
+    """Mics named after the house's speakers, so replies go to a real zone."""
+    speakers = load_prompt_spec()[0]
+    return [speakers[i % len(speakers)] + (f" {i // len(speakers) + 1}" if i >= len(speakers) else '')
+            for i in range(n_mics)]
+
+
+# --- FAKE MICS ---
+
+def connect_mics(address, names):
+    clients = []
+    for name in names:
+        client_socket = socket.create_connection(address)
+        client_socket.sendall(pack_hello(name, CODEC_PCM16, listener.AUDIO_RATE, CHUNK_SAMPLES))
+        if client_socket.recv(2)[:1] != ACK:
+            raise RuntimeError(f"Mic '{name}' was not acknowledged")
+        clients.append(client_socket)
+    return clients
+
+
+def stream_sessions(clients, sessions, speed, started, progress):
+    """Sends every mic's next 80 ms chunk together, one tick every CHUNK_SECONDS / speed."""
+    longest = max(len(audio) for audio, _ in sessions)
+    sequence = 0
+    for offset in range(0, longest, CHUNK_SAMPLES):
+        for client_socket, (audio, _) in zip(clients, sessions):
+            chunk = audio[offset:offset + CHUNK_SAMPLES]
+            if not len(chunk):
+                continue
+            if len(chunk) < CHUNK_SAMPLES:
+                chunk = np.pad(chunk, (0, CHUNK_SAMPLES - len(chunk)))
+            payload = chunk.tobytes()
+            client_socket.sendall(pack_frame_header(FRAME_AUDIO, CODEC_PCM16, len(payload), sequence) + payload)
+            progress['windows'] += 1
+        sequence += 1
+        next_send = started + (sequence * CHUNK_SECONDS) / speed
+        lag = time.monotonic() - next_send
+        progress['max_lag'] = max(progress['max_lag'], lag)
+        time.sleep(max(0.0, -lag))
+
+
+class Sampler(threading.Thread):
+    """Samples queue depths and each mic's dropped windows while the replay runs."""
+    def __init__(self, server, interval=0.1):
+        super().__init__(daemon=True)
+        self.server = server
+        self.interval = interval
+        self.depths = {}
+        self.dropped = {}
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        for name, depth in metrics.snapshot()['queue_depth'].items():
+            if depth is not None:
+                self.depths.setdefault(name, []).append(depth)
+        with self.server.connections_lock:
+            connections = list(self.server.connections.values())
+        for conn in connections:
+            if conn.mic_id is not None:
+                self.dropped[conn.mic_id] = max(self.dropped.get(conn.mic_id, 0), conn.dropped_frames)
+
+
+# --- SCORING ---
+
+def score_wake(detections, names, sessions, started, speed):
+    """Matches detections to labelled wake words. Returns (labelled, hits, misses, false wakes) or None."""
+    labelled = hits = false_wakes = 0
+    scored = False
+    for name, (_, regions) in zip(names, sessions):
+        if regions is None:
+            continue
+        scored = True
+        # Detection time -> position in the mic's audio; the sender is at most one tick ahead of the server
+        positions = sorted((at - started) * speed for mic_id, at in detections if mic_id == name)
+        unmatched = list(regions)
+        for position in positions:
+            match = next((r for r in unmatched if r[0] - CHUNK_SECONDS <= position <= r[1] + WAKE_TOLERANCE), None)
+            if match is None:
+                false_wakes += 1
+            else:
+                unmatched.remove(match)
+                hits += 1
+        labelled += len(regions)
+    if not scored:
+        return None
+    return labelled, hits, labelled - hits, false_wakes
+
+
+def counters_since(baseline):
+    """Counter increments since `baseline`, so several runs can share the process-wide registry."""
+    return {name: value - baseline.get(name, 0) for name, value in metrics.snapshot()['counters'].items()
+            if value != baseline.get(name, 0)}
+
+
+def finished_traces(baseline):
+    return sum(value for name, value in counters_since(baseline).items() if name.startswith('trace_outcome_'))
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    baseline = metrics.snapshot()['counters']
+    listener.WAKE_ARBITRATION = not args.no_arbitration
+    # The arbitration window is wall-clock time; keep it covering the same amount of audio
+    listener.ARBITRATION_WINDOW = ARBITRATION_WINDOW / args.speed
+    # So is the mic rate limit; faster than real time, every mic would look like it is flooding
+    listener.MIC_RATE_LIMIT = args.speed <= 1
+    sessions = load_sessions(args.wav_dir, args.mics, args.seconds, args.seed, args.adjacent)
+    names = mic_names(args.mics)
+    # Mics that hear the same session can hear each other; the others are rooms apart
+    listener.ARBITRATION_AREAS = {name: f"area {i // args.adjacent}" for i, name in enumerate(names)}
+    audio_seconds = sum(len(audio) for audio, _ in sessions) / listener.AUDIO_RATE
+
+    if args.wake == 'openwakeword':
+        from wake_word import load_wake_word_engine
+        engine_factory = load_wake_word_engine
+    else:
+        engine_factory = MarkerWakeEngine
+
+    work_dir = tempfile.mkdtemp(prefix='replay_')
+    trace_path = args.trace_log or os.path.join(work_dir, 'traces.jsonl')
+    tracing.start_trace_log(trace_path)
+
+    command_queue = CommandQueue()
+    metrics.register_depth('command_queue', command_queue.qsize)
+    stt = ReplaySTT(Latency(args.stt, rng), rng)
+    llm = ReplayLLMClient(Latency(args.llm, rng))
+    if args.shards:
+        server = wake_engine = RecordingShardedServer(command_queue, engine_factory, args.shards,
+                                                      host='127.0.0.1', port=0, stt_backend=stt)
+    else:
+        wake_engine = RecordingWakeEngine(engine_factory())
+        server = listener.EventListenerServer(command_queue, wake_engine, host='127.0.0.1', port=0,
+                                              stt_backend=stt)
+    address = server.bind()
+    engine = OutputEngine(default_sink='null').start()
+    audio_manager = AudioManager(backend=ReplayTTS(Latency(args.tts, rng)),
+                                 cache=TTSCache(os.path.join(work_dir, 'tts')), player=engine)
+    dispatcher = Dispatcher(audio_manager=audio_manager)
+    metrics.register_depth('zones_speaking', dispatcher.playback.busy_zones)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    if args.shards and not server.wait_ready(timeout=60):
+        raise RuntimeError("The wake word shards did not start")
+    threading.Thread(target=command_consumer_thread, daemon=True,
+                     args=(command_queue, dispatcher, llm, None, args.workers)).start()
+
+    clients = connect_mics(address, names)
+    sampler = Sampler(server)
+    sampler.start()
+    progress = {'windows': 0, 'max_lag': 0.0}
+    started = time.monotonic()
+    stream_sessions(clients, sessions, args.speed, started, progress)
+    streamed = time.monotonic() - started
+
+    # Every wake word that won its arbitration starts a trace; wait until each
+    # has ended (spoken, failed or dropped)
+    def drained():
+        counters = counters_since(baseline)
+        expected = len(wake_engine.detections) - counters.get('wake_suppressed', 0)
+        return finished_traces(baseline) >= expected
+
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    time.sleep(listener.ARBITRATION_WINDOW)
+    while not drained() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    elapsed = time.monotonic() - started
+    sampler.stop_event.set()
+    sampler.join()
+    sampler.sample()
+
+    for client_socket in clients:
+        client_socket.close()
+    server.stop()
+    server_thread.join()  # Shards and their shared memory are released on the way out
+    dispatcher.shutdown()
+    engine.close()
+    records = tracing.load_traces(trace_path) if os.path.exists(trace_path) else []
+    if not args.trace_log:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return SimpleNamespace(sessions=sessions, names=names, audio_seconds=audio_seconds, streamed=streamed,
+                           elapsed=elapsed, progress=progress, sampler=sampler, records=records,
+                           detections=wake_engine.detections,
+                           wake=score_wake(wake_engine.detections, names, sessions, started, args.speed),
+                           drained=drained(), counters=counters_since(baseline),
+                           stt_calls=stt.calls, llm_calls=llm.calls)
+
+
+def report(args, result):
+    source = args.wav_dir or 'synthetic sessions'
+    print(f"\n--- Replay: {args.mics} mics, {result.audio_seconds:.0f} s of audio from {source} "
+          f"at {args.speed:g}x real time ---")
+    if args.adjacent > 1:
+        print(f"mics in groups of {args.adjacent} hearing the same room, wake word arbitration "
+              + ("off" if args.no_arbitration else "on"))
+    print(f"stubs: STT {Latency(args.stt, None)}, LLM first token {Latency(args.llm, None)}, "
+          f"TTS first chunk {Latency(args.tts, None)}; wake engine: {args.wake}"
+          + (f" in {args.shards} shard processes" if args.shards else ""))
+    print(f"streamed in {result.streamed:.1f} s (sender max lag {result.progress['max_lag'] * 1000:.0f} ms), "
+          f"drained after {result.elapsed:.1f} s" + ("" if result.drained else " (TIMED OUT)"))
+
+    outcomes = {}
+    for record in result.records:
+        outcomes[record.get('outcome')] = outcomes.get(record.get('outcome'), 0) + 1
+    routes = {}
+    for record in result.records:
+        routes[record.get('route')] = routes.get(record.get('route'), 0) + 1
+    completed = outcomes.get('ok', 0)
+    print(f"\nthroughput: {completed / result.elapsed:.2f} commands/s completed, "
+          f"{result.audio_seconds / result.elapsed:.1f} s of audio per second")
+    print("outcomes: " + (", ".join(f"{k}={v}" for k, v in sorted(outcomes.items(), key=str)) or "none"))
+    print("routes:   " + (", ".join(f"{k}={v}" for k, v in sorted(routes.items(), key=str)) or "none"))
+
+    if result.wake is None:
+        print(f"wake words: {len(result.detections)} detected (no labels to score against)")
+    else:
+        labelled, hits, misses, false_wakes = result.wake
+        print(f"wake words: {labelled} labelled, {hits} detected ({hits / max(labelled, 1):.1%}), "
+              f"{misses} missed, {false_wakes} false wakes")
+
+    print(f"calls: STT {result.stt_calls}, LLM {result.llm_calls}; "
+          f"wake detections suppressed by arbitration: {result.counters.get('wake_suppressed', 0)}")
+
+    dropped = sum(result.sampler.dropped.values())
+    print(f"dropped audio: {dropped} of {result.progress['windows']} windows "
+          f"({dropped / max(result.progress['windows'], 1):.2%})")
+
+    print(f"\n{'queue':<22} {'max':>6} {'mean':>8}")
+    for name, depths in sorted(result.sampler.depths.items()):
+        print(f"{name:<22} {max(depths):>6} {sum(depths) / len(depths):>8.2f}")
+
+    summary, _ = tracing.summarize(result.records)
+    print(f"\n{'stage':<16} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, (count, p50, p95, p99, worst) in summary.items():
+        print(f"{name:<16} {count:>6} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {worst:>9.1f}")
+
+    counters = {k: v for k, v in result.counters.items() if not k.startswith('trace_outcome_')}
+    if counters:
+        print("\ncounters: " + ", ".join(f"{k}={v}" for k, v in sorted(counters.items())))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Replays recorded or generated mic audio through the pipeline.")
+    parser.add_argument('--mics', type=int, default=4)
+    parser.add_argument('--speed', type=float, default=1.0, help="Multiple of real time to stream at")
+    parser.add_argument('--wav-dir', help="16 kHz mono WAVs (with optional wake word label files)")
+    parser.add_argument('--seconds', type=float, default=30.0, help="Length of each generated session")
+    parser.add_argument('--adjacent', type=int, default=1, help="Mics per group hearing the same audio")
+    parser.add_argument('--no-arbitration', action='store_true', help="Let every mic that hears a wake word act on it")
+    parser.add_argument('--wake', choices=['marker', 'openwakeword'], default='marker')
+    parser.add_argument('--shards', type=int, default=0, help="Wake word processes (0: the event server)")
+    parser.add_argument('--stt', default='0.3:0.1', help="STT latency after end of speech, MEAN:SD seconds")
+    parser.add_argument('--llm', default='0.8:0.3', help="LLM time to first token, MEAN:SD seconds")
+    parser.add_argument('--tts', default='0.15:0.05', help="TTS time to first chunk, MEAN:SD seconds")
+    parser.add_argument('--workers', type=int, default=MAX_CONCURRENT_COMMANDS, help="Command workers")
+    parser.add_argument('--trace-log', help="Keep the command traces in this JSONL file")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="Show the pipeline's own log output")
+    return parser.parse_args(argv)
+
+
+def run_quietly(args):
+    """run(), with the pipeline's log output hidden unless --verbose."""
+    with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()):
+        return run(args)
+
+
+def main(argv):
+    args = parse_args(argv)
+    report(args, run_quietly(args))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,132 @@
+# benchmarks/shard_scaling_benchmark.py
+#
+# Wake word throughput of the sharded listener (sharded_listener.py) with 1 to
+# N shard processes, against the single-process event server. Simulated mics
+# stream silence in real time; a stand-in engine spends --cost ms of CPU per
+# window holding the GIL, like openWakeWord's preprocessing and model calls
+# (pass --engine openwakeword to run the real model instead).
+#
+#   processed   windows that went through the wake word model, per second and as a
+#               share of those sent; the rest were dropped from the mics' rings
+#   main cpu    CPU time of the main process over the run, per second of wall time;
+#               with shards it only receives audio
+#
+# With more mics than one core can run, the event server processes a fixed
+# number of windows per second and drops the rest, while the sharded server
+# scales with the cores it is given.
+#
+# Usage: python benchmarks/shard_scaling_benchmark.py [--mics N] [--cost MS] [--max-shards N] [--seconds S]
+
+import argparse
+import contextlib
+import functools
+import io
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import listener
+from listener_load_test import connect_clients, stream_silence
+from metrics import metrics
+from sharded_listener import SHARD_STATS_INTERVAL, ShardedListenerServer
+
+
+class BusyStream:
+    def add_audio(self, audio_np):
+        pass
+
+    def reset(self):
+        pass
+
+
+class BusyWakeEngine:
+    """Stands in for wake_word.WakeWordEngine: burns `cost_ms` of thread CPU per window, never detects."""
+    def __init__(self, cost_ms):
+        self.cost = cost_ms / 1000
+
+    def create_stream(self, mic_id):
+        return BusyStream()
+
+    def predict(self, streams):
+        end = time.thread_time() + self.cost * len(streams)
+        while time.thread_time() < end:
+            pass
+        return {stream: 0.0 for stream in streams}
+
+
+def openwakeword_engine():
+    from wake_word import load_wake_word_engine
+    return load_wake_word_engine()
+
+
+def wake_frames():
+    """Windows run through the wake word model so far, by any server in this process."""
+    return metrics.snapshot()['counters'].get('wake_frames', 0)
+
+
+def measure(server, mics, seconds):
+    # The servers log every connection; keep the table readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        return _measure(server, mics, seconds)
+
+
+def _measure(server, mics, seconds):
+    address = server.bind()
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    if isinstance(server, ShardedListenerServer) and not server.wait_ready(timeout=60):
+        raise RuntimeError("The shards did not start")
+
+    clients = connect_clients(address, mics)
+    stop_event = threading.Event()
+    sent = [0]
+    before = wake_frames()
+    cpu_started, started = time.process_time(), time.monotonic()
+    stream_silence(clients, seconds, stop_event, sent)
+    elapsed = time.monotonic() - started
+    main_cpu = (time.process_time() - cpu_started) / elapsed
+    time.sleep(2 * SHARD_STATS_INTERVAL)  # The shards' last reports
+    processed = wake_frames() - before
+
+    dropped = sum(conn.dropped_frames for conn in list(server.connections.values()))
+    for client_socket in clients:
+        client_socket.close()
+    server.stop()
+    server_thread.join()
+    return {'processed': processed, 'sent': sent[0], 'dropped': dropped, 'elapsed': elapsed, 'main_cpu': main_cpu}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mics', type=int, default=60)
+    parser.add_argument('--cost', type=float, default=2.0, help="CPU ms per window of the stand-in engine")
+    parser.add_argument('--max-shards', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--engine', choices=['busy', 'openwakeword'], default='busy')
+    args = parser.parse_args(argv)
+    factory = openwakeword_engine if args.engine == 'openwakeword' else functools.partial(BusyWakeEngine, args.cost)
+
+    rows = []
+    server = listener.EventListenerServer(queue.Queue(), factory(), host='127.0.0.1', port=0)
+    rows.append(('event', measure(server, args.mics, args.seconds)))
+    for shards in range(1, args.max_shards + 1):
+        server = ShardedListenerServer(queue.Queue(), factory, shards, host='127.0.0.1', port=0)
+        rows.append((f"sharded x{shards}", measure(server, args.mics, args.seconds)))
+
+    print(f"\n--- Wake word scaling: {args.mics} mics in real time for {args.seconds:g} s, "
+          f"{args.engine} engine{f' ({args.cost:g} ms/window)' if args.engine == 'busy' else ''}, "
+          f"{os.cpu_count()} CPUs ---")
+    print(f"{'server':<12} {'windows/s':>10} {'processed':>10} {'dropped':>8} {'main cpu':>9}")
+    for name, r in rows:
+        print(f"{name:<12} {r['processed'] / r['elapsed']:>10.0f} {r['processed'] / max(r['sent'], 1):>10.0%} "
+              f"{r['dropped']:>8} {r['main_cpu']:>9.0%}")
+    print(f"Offered: {args.mics * listener.AUDIO_RATE / listener.CHUNK_SIZE:.0f} windows/s")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
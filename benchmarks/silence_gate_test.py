@@ -0,0 +1,161 @@
+# benchmarks/silence_gate_test.py
+#
+# Checks that a command capture ends when the mic's silence gate closes in the
+# middle of it. A simulated framed client sends a loud window (the stand-in
+# engine takes it for the wake word), then SILENCE_GATE_SECONDS of quiet audio,
+# then only keepalives, like mic_client.py's SilenceGate. The server must put
+# the withheld silence back (listener.GatedSilence) so the capture ends on its
+# no-speech timeout instead of staying open until the next sound in the room.
+#
+# Usage: python benchmarks/silence_gate_test.py [--server event|threaded] [--keepalive-seconds S]
+
+import argparse
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import listener
+from protocol import CODEC_PCM16, FRAME_AUDIO, FRAME_KEEPALIVE, pack_frame_header, pack_hello
+from stt import STTBackend, STTStream
+from vad import NO_SPEECH_TIMEOUT
+
+SILENCE_GATE_SECONDS = 1.5  # mic_client.py's defaults
+KEEPALIVE_INTERVAL = 1.0
+MIC_ID = 'kitchen'
+CHUNK_SECONDS = listener.CHUNK_SIZE / listener.AUDIO_RATE
+
+
+class LoudStream:
+    def __init__(self):
+        self.loud = False
+
+    def add_audio(self, audio_np):
+        self.loud = int(np.abs(audio_np).max()) > 10000
+
+    def reset(self):
+        self.loud = False
+
+
+class LoudWakeEngine:
+    """Stands in for wake_word.WakeWordEngine: any loud window is a wake word."""
+    def create_stream(self, mic_id):
+        return LoudStream()
+
+    def predict(self, streams):
+        return {stream: 1.0 if stream.loud else 0.0 for stream in streams}
+
+
+class CountingSTTStream(STTStream):
+    def accept_audio(self, pcm_bytes):
+        return None
+
+    def finish(self):
+        return ""
+
+
+class CountingSTT(STTBackend):
+    """Transcribes nothing; the test only cares when the capture ends."""
+    name = 'test'
+
+    def start_stream(self):
+        return CountingSTTStream()
+
+
+def send_frame(client_socket, frame_type, payload, sequence):
+    client_socket.sendall(pack_frame_header(frame_type, CODEC_PCM16, len(payload), sequence) + payload)
+
+
+def capture_open(server):
+    """True while the simulated mic has a capture in progress."""
+    if isinstance(server, listener.EventListenerServer):
+        with server.connections_lock:
+            return any(conn.capture is not None for conn in server.connections.values())
+    return server.capturing
+
+
+def run(kind, keepalive_seconds):
+    listener.WAKE_ARBITRATION = False
+    command_queue = queue.Queue()
+    if kind == 'event':
+        server = listener.EventListenerServer(command_queue, LoudWakeEngine(), host='127.0.0.1', port=0,
+                                              workers=1, stt_backend=CountingSTT())
+        address = server.bind()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server_socket = socket.create_server(('127.0.0.1', 0))
+        address = server_socket.getsockname()
+
+    client_socket = socket.create_connection(address)
+    if kind == 'threaded':
+        handler_socket, handler_address = server_socket.accept()
+        transcriber = listener.TranscriptionPool(command_queue, CountingSTT(), workers=1)
+        server = listener.ClientHandler(handler_socket, handler_address, LoudWakeEngine(), transcriber)
+        server.daemon = True
+        server.start()
+    client_socket.sendall(pack_hello(MIC_ID, CODEC_PCM16, listener.AUDIO_RATE, listener.CHUNK_SIZE))
+    client_socket.recv(2)
+
+    sequence = 0
+    loud = np.full(listener.CHUNK_SIZE, 20000, dtype=np.int16).tobytes()
+    quiet = np.zeros(listener.CHUNK_SIZE, dtype=np.int16).tobytes()
+    send_frame(client_socket, FRAME_AUDIO, loud, sequence)
+    sequence += 1
+    woke_at = time.monotonic()
+    # Quiet audio until the gate closes, in real time
+    for _ in range(int(SILENCE_GATE_SECONDS / CHUNK_SECONDS)):
+        send_frame(client_socket, FRAME_AUDIO, quiet, sequence)
+        sequence += 1
+        time.sleep(CHUNK_SECONDS)
+    if not capture_open(server):
+        raise RuntimeError("The capture ended before the gate closed; the test proves nothing")
+
+    # Gate closed: keepalives only
+    ended_at = None
+    gate_closed_at = time.monotonic()
+    next_keepalive = gate_closed_at + KEEPALIVE_INTERVAL
+    while time.monotonic() - gate_closed_at < keepalive_seconds:
+        if time.monotonic() >= next_keepalive:
+            send_frame(client_socket, FRAME_KEEPALIVE, b'', sequence)
+            sequence += 1
+            next_keepalive += KEEPALIVE_INTERVAL
+        if ended_at is None and not capture_open(server):
+            ended_at = time.monotonic()
+        time.sleep(0.02)
+    client_socket.close()
+    if kind == 'event':
+        server.stop()
+    return None if ended_at is None else ended_at - woke_at
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--server', choices=['event', 'threaded'], default=None, help="Default: both")
+    parser.add_argument('--keepalive-seconds', type=float, default=6.0)
+    args = parser.parse_args(argv)
+
+    failed = False
+    # The capture should end on the no-speech timeout, give or take one keepalive
+    limit = NO_SPEECH_TIMEOUT + KEEPALIVE_INTERVAL + 0.5
+    for kind in [args.server] if args.server else ['event', 'threaded']:
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                ended = run(kind, args.keepalive_seconds)
+            finally:
+                sys.stdout = stdout
+        ok = ended is not None and ended <= limit
+        failed |= not ok
+        result = "still open" if ended is None else f"ended {ended:.1f} s after the wake word"
+        print(f"{kind:<9} gate closed mid-capture: {result} (limit {limit:.1f} s) -> {'ok' if ok else 'FAILED'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
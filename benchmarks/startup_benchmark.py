@@ -0,0 +1,140 @@
+# benchmarks/startup_benchmark.py
+#
+# Time to ready of the main application. Each run starts main.py's startup in a
+# fresh interpreter and waits for the milestones it reports (metrics.startup):
+#
+#   accepting mics   the listener's socket is bound; mics can connect
+#   wake words       the wake word model is loaded and warmed up
+#   taking commands  the LLM client, response cache and dispatcher are up
+#   ready            all three
+#
+# The same startup is run two ways:
+#   eager   the heavy packages imported up front and the wake word model loaded
+#           before the socket binds, as main.py and listener.py used to
+#   lazy    the current code: heavy imports where they are used, the model loaded
+#           and warmed up on a background thread while mics connect
+#
+# With --engine standin (the default) the model load is a sleep of --load-ms
+# and the model cache check finds everything cached, so the benchmark runs
+# without the model files; --engine openwakeword loads the real model.
+#
+# Usage: python benchmarks/startup_benchmark.py [--runs N] [--load-ms MS] [--engine standin|openwakeword]
+
+import time
+T0 = time.monotonic()  # The child's clock starts before any import
+
+import argparse
+import functools
+import json
+import os
+import subprocess
+import sys
+import threading
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MILESTONES = ['accepting mics', 'wake words', 'taking commands']
+HEAVY_MODULES = ['openai', 'speech_recognition', 'openwakeword.model']  # Imported at the top before
+
+
+class StandInWakeEngine:
+    """Stands in for wake_word.WakeWordEngine: takes `load_ms` to build, like loading the ONNX models."""
+    def __init__(self, load_ms):
+        time.sleep(load_ms / 1000)
+
+    def warm_up(self):
+        pass
+
+
+def child(mode, engine, load_ms):
+    """One startup, in this process: prints the milestones and steps as JSON once ready."""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)  # The prompt builder reads system_prompt.txt from the working directory
+    os.environ.setdefault('OPENAI_KEY', 'startup-benchmark')  # The client is built, never used
+
+    if mode == 'eager':
+        for name in HEAVY_MODULES:
+            try:
+                __import__(name)
+            except ImportError:
+                pass
+
+    import listener
+    import main
+    import wake_word
+    from metrics import startup
+
+    factory = wake_word.WakeWordEngine
+    if engine == 'standin':
+        factory = functools.partial(StandInWakeEngine, load_ms)
+        listener.download_wake_word_models = lambda: None  # A warm cache: nothing to download
+
+    class Loader(wake_word.WakeEngineLoader):
+        def __init__(self):
+            super().__init__(factory)
+            if mode == 'eager':
+                self.result()  # Loaded before the server binds
+
+    listener.WakeEngineLoader = Loader
+    listener.EventListenerServer = functools.partial(listener.EventListenerServer, port=0)
+    main.STARTED_AT = T0
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # main() prints its progress; only the result goes out
+    threading.Thread(target=main.main, daemon=True).start()
+    while startup.ready_after() is None:
+        time.sleep(0.01)
+    stdout.write(json.dumps({'milestones': startup.milestones, 'ready': startup.ready_after(),
+                             'steps': [[name, end - start] for name, start, end, _ in startup.steps]}) + "\n")
+    stdout.flush()
+    os._exit(0)
+
+
+def run(mode, args):
+    command = [sys.executable, os.path.abspath(__file__), '--child', mode,
+               '--engine', args.engine, '--load-ms', str(args.load_ms)]
+    output = subprocess.run(command, capture_output=True, text=True, timeout=120)
+    if output.returncode != 0:
+        raise RuntimeError(f"The {mode} startup failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--load-ms', type=float, default=1500.0, help="Model load time of the stand-in engine")
+    parser.add_argument('--engine', choices=['standin', 'openwakeword'], default='standin')
+    parser.add_argument('--child', choices=['eager', 'lazy'], help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(args.child, args.engine, args.load_ms)
+        return
+
+    results = {}
+    for mode in ('eager', 'lazy'):
+        print(f"Running {mode} x{args.runs}...", file=sys.stderr)
+        results[mode] = [run(mode, args) for _ in range(args.runs)]
+
+    engine = f"stand-in engine ({args.load_ms:.0f} ms load)" if args.engine == 'standin' else "openwakeword"
+    print(f"\n--- Time to ready: median of {args.runs} runs, {engine} ---")
+    print(f"{'mode':<6} " + " ".join(f"{name:>15}" for name in MILESTONES) + f" {'ready':>8}")
+    for mode, runs in results.items():
+        cells = [median([r['milestones'][name] for r in runs]) for name in MILESTONES]
+        print(f"{mode:<6} " + " ".join(f"{cell:>13.2f} s" for cell in cells)
+              + f" {median([r['ready'] for r in runs]):>6.2f} s")
+
+    print("\nSteps of the lazy startup (median ms):")
+    steps = {}
+    for r in results['lazy']:
+        for name, seconds in r['steps']:
+            steps.setdefault(name, []).append(seconds)
+    for name, values in steps.items():
+        print(f"  {name:<22} {median(values) * 1000:7.0f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,98 @@
+# benchmarks/stt_benchmark.py
+#
+# Compares STT backends on recorded WAV files (16 kHz, mono, 16-bit). Each file
+# is streamed into the backend in 80 ms chunks, the way the listener does during
+# VAD capture, and for every backend the script reports:
+#
+#   RTF          total processing time / audio duration
+#   EOS latency  time from the last chunk (end of speech) to the final text
+#
+# With --realtime the chunks are paced at 80 ms so streaming engines can decode
+# while "speaking", which is what the end-of-speech latency looks like live.
+#
+# Usage: python benchmarks/stt_benchmark.py [--realtime] WAV_DIR [backend ...]
+
+import glob
+import os
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from stt import SAMPLE_RATE, SAMPLE_WIDTH, STT_BACKENDS, STTError, create_stt_backend
+
+CHUNK_BYTES = 1280 * SAMPLE_WIDTH
+CHUNK_SECONDS = 1280 / SAMPLE_RATE
+
+
+def load_wav(path):
+    with wave.open(path, 'rb') as wav:
+        if wav.getframerate() != SAMPLE_RATE or wav.getnchannels() != 1 or wav.getsampwidth() != SAMPLE_WIDTH:
+            raise ValueError(f"{path} must be 16 kHz mono 16-bit PCM")
+        return wav.readframes(wav.getnframes())
+
+
+def run_file(backend, audio, realtime):
+    stream = backend.start_stream()
+    processing = 0.0
+    for start in range(0, len(audio), CHUNK_BYTES):
+        chunk_start = time.perf_counter()
+        stream.accept_audio(audio[start:start + CHUNK_BYTES])
+        elapsed = time.perf_counter() - chunk_start
+        processing += elapsed
+        if realtime:
+            time.sleep(max(0.0, CHUNK_SECONDS - elapsed))
+
+    eos = time.perf_counter()
+    text = stream.finish()
+    eos_latency = time.perf_counter() - eos
+    processing += eos_latency
+    return text, processing, eos_latency
+
+
+def main(argv):
+    realtime = '--realtime' in argv
+    args = [a for a in argv if a != '--realtime']
+    if not args:
+        print("Usage: python benchmarks/stt_benchmark.py [--realtime] WAV_DIR [backend ...]")
+        return
+    wav_paths = sorted(glob.glob(os.path.join(args[0], '*.wav')))
+    backend_names = args[1:] or list(STT_BACKENDS)
+    if not wav_paths:
+        print(f"No .wav files found in {args[0]}")
+        return
+
+    files = [(os.path.basename(p), load_wav(p)) for p in wav_paths]
+    total_audio = sum(len(audio) for _, audio in files) / SAMPLE_WIDTH / SAMPLE_RATE
+
+    print(f"\n--- STT benchmark: {len(files)} files, {total_audio:.1f}s of audio"
+          f"{', real-time pacing' if realtime else ''} ---")
+    print(f"{'backend':<16} {'RTF':>6} {'EOS p50 (ms)':>13} {'EOS max (ms)':>13}")
+    for name in backend_names:
+        try:
+            backend = create_stt_backend(name)
+        except (STTError, ValueError, OSError) as e:
+            print(f"{name:<16} skipped: {e}")
+            continue
+
+        processing = 0.0
+        latencies = []
+        for file_name, audio in files:
+            try:
+                text, file_processing, eos_latency = run_file(backend, audio, realtime)
+            except STTError as e:
+                print(f"{name:<16} {file_name}: {e}")
+                continue
+            processing += file_processing
+            latencies.append(eos_latency)
+            print(f"    {name} {file_name}: {text!r}")
+
+        if latencies:
+            latencies.sort()
+            print(f"{name:<16} {processing / total_audio:6.2f} {latencies[len(latencies) // 2] * 1000:13.0f} "
+                  f"{latencies[-1] * 1000:13.0f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,118 @@
+# benchmarks/tts_benchmark.py
+#
+# Time-to-first-audio of AudioManager.speak for each TTS backend, measured
+# from the speak() call until the player receives the first audio:
+#
+#   miss         the phrase is synthesized (streaming backends play the first chunk)
+#   memory hit   the same phrase again, served from the in-memory LRU
+#   disk hit     a fresh cache on the same directory, i.e. after a restart
+#
+# Playback itself is replaced by a player that only notes when audio starts,
+# so the numbers exclude the output device. Backends that are not installed
+# (or need a network that is not there) are skipped. The 'simulated' backend
+# streams silence with a fixed per-chunk synthesis delay so the cache and
+# streaming paths can be compared on any machine.
+#
+# Usage: python benchmarks/tts_benchmark.py [backend ...]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from audio_manager import AudioManager
+from tts import FORMAT_PCM16, TTSBackend, TTSCache, TTSError, create_tts_backend
+
+PHRASES = [
+    "Okay.",
+    "Done.",
+    "Which room did you mean?",
+    "Playing your dinner party playlist in the kitchen.",
+    "Sorry, I couldn't find that song. Could you say the artist again?",
+]
+
+
+class SimulatedBackend(TTSBackend):
+    """Streams silence like an offline synthesizer: 20 ms of work per 100 ms of audio."""
+    name = 'simulated'
+    voice = 'silence'
+    format = FORMAT_PCM16
+    sample_rate = 22050
+    streaming = True
+    CHUNK_SECONDS = 0.1
+    SECONDS_PER_CHUNK = 0.02
+
+    def stream(self, text, lang='en'):
+        chunk = bytes(int(self.sample_rate * self.CHUNK_SECONDS) * 2)
+        for _ in range(max(1, len(text) // 12)):  # Roughly 1.2 s of speech per sentence
+            time.sleep(self.SECONDS_PER_CHUNK)
+            yield chunk
+
+
+class TimingPlayer:
+    """Consumes the audio without playing it and records when it started."""
+    def __init__(self):
+        self.started = None
+
+    def play_file(self, path, on_start, speaker=None, volume=None):
+        self.started = time.perf_counter()
+        on_start()
+
+    def play_pcm(self, audio, speaker=None, volume=None, stopped=None):
+        for _ in audio.chunks(stopped):
+            if self.started is None:
+                self.started = time.perf_counter()
+                audio.mark_playing()
+
+
+def first_audio_ms(audio_manager, text):
+    audio_manager.player.started = None
+    started = time.perf_counter()
+    audio_manager.speak(text, ["office"], 50)
+    if audio_manager.player.started is None:
+        return None
+    return (audio_manager.player.started - started) * 1000
+
+
+def benchmark(backend):
+    cache_dir = tempfile.mkdtemp(prefix='tts_cache_')
+    try:
+        manager = AudioManager(backend=backend, cache=TTSCache(cache_dir), player=TimingPlayer())
+        misses = [first_audio_ms(manager, text) for text in PHRASES]
+        if None in misses:
+            return None
+        memory_hits = [first_audio_ms(manager, text) for text in PHRASES]
+        manager.cache = TTSCache(cache_dir)
+        disk_hits = [first_audio_ms(manager, text) for text in PHRASES]
+        return misses, memory_hits, disk_hits
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def main(argv):
+    names = argv or ['simulated', 'espeak', 'piper', 'gtts']
+    results = []
+    for name in names:
+        try:
+            backend = SimulatedBackend() if name == 'simulated' else create_tts_backend(name)
+        except (TTSError, ValueError, ImportError) as e:
+            print(f"Skipping {name}: {e}")
+            continue
+        timings = benchmark(backend)
+        if timings is None:
+            print(f"Skipping {name}: synthesis failed (see the errors above)")
+            continue
+        results.append((name, *timings))
+
+    print(f"\n--- Time to first audio over {len(PHRASES)} phrases (mean / max, ms) ---")
+    print(f"{'backend':<10} {'miss':>16} {'memory hit':>16} {'disk hit':>16}")
+    for name, *columns in results:
+        cells = [f"{sum(c) / len(c):7.1f} / {max(c):6.1f}" for c in columns]
+        print(f"{name:<10} {cells[0]:>16} {cells[1]:>16} {cells[2]:>16}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
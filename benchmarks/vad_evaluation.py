@@ -0,0 +1,217 @@
+# benchmarks/vad_evaluation.py
+#
+# Scores the listener's VAD against labeled recordings and compares it with the
+# old fixed-threshold capture (RMS > 600, 2 s of silence, no pre-roll).
+#
+# Each WAV (16 kHz, mono, 16-bit) needs a label file next to it with the speech
+# regions in seconds, in Audacity's label format: `name.txt` with one
+# "start<TAB>end[<TAB>label]" line per region. The start of the file stands in
+# for the wake word, so recordings should begin right after it.
+#
+# Reported per method:
+#   F1           frame-level speech/non-speech accuracy (new VAD only)
+#   clipped      speech lost before the first captured frame (first-syllable loss)
+#   EOS latency  time from the end of the last speech region to the end of capture
+#   truncated    captures that ended before the speaker was done
+#   us/frame     processing time per 80 ms frame
+#
+# Usage: python benchmarks/vad_evaluation.py WAV_DIR
+#        python benchmarks/vad_evaluation.py --synthetic   (generated clips, no data needed)
+
+import glob
+import os
+import sys
+import time
+import wave
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vad import (FRAME_SAMPLES, FRAME_SECONDS, MAX_COMMAND_DURATION, SAMPLE_RATE,
+                 UtteranceSegmenter, VoiceActivityDetector)
+
+LEGACY_THRESHOLD = 600
+LEGACY_SILENCE_TIMEOUT = 2.0
+
+
+def load_wav(path):
+    with wave.open(path, 'rb') as wav:
+        if wav.getframerate() != SAMPLE_RATE or wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+            raise ValueError(f"{path} must be 16 kHz mono 16-bit PCM")
+        return np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+
+
+def load_labels(path):
+    regions = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 2:
+                regions.append((float(fields[0]), float(fields[1])))
+    return sorted(regions)
+
+
+def split_frames(audio):
+    n = len(audio) // FRAME_SAMPLES
+    return audio[:n * FRAME_SAMPLES].reshape(n, FRAME_SAMPLES)
+
+
+def frame_labels(n_frames, regions):
+    """True for frames that are at least half covered by a speech region."""
+    starts = np.arange(n_frames) * FRAME_SECONDS
+    labels = np.zeros(n_frames, dtype=bool)
+    for begin, end in regions:
+        overlap = np.minimum(starts + FRAME_SECONDS, end) - np.maximum(starts, begin)
+        labels |= overlap >= FRAME_SECONDS / 2
+    return labels
+
+
+def synthetic_clips(count=20, seed=0):
+    """Voiced bursts (harmonics with a slow attack) over room noise, with labels."""
+    rng = np.random.default_rng(seed)
+    clips = []
+    for i in range(count):
+        noise_level = rng.uniform(20, 200)
+        duration = rng.uniform(4.0, 7.0)
+        audio = rng.normal(0, noise_level, int(duration * SAMPLE_RATE))
+        regions = []
+        t = rng.uniform(0.2, 1.0)
+        for _ in range(rng.integers(1, 4)):
+            length = rng.uniform(0.4, 1.2)
+            if t + length > duration - 2.5:
+                break
+            n = int(length * SAMPLE_RATE)
+            time_axis = np.arange(n) / SAMPLE_RATE
+            pitch = rng.uniform(100, 220)
+            voiced = sum(np.sin(2 * np.pi * pitch * k * time_axis) / k for k in range(1, 8))
+            envelope = np.minimum(1.0, time_axis / 0.15) * np.minimum(1.0, (length - time_axis) / 0.1)
+            start = int(t * SAMPLE_RATE)
+            audio[start:start + n] += voiced * envelope * rng.uniform(1500, 6000)
+            regions.append((t, t + length))
+            t += length + rng.uniform(0.15, 0.5)
+        clips.append((f"synthetic_{i:02d}", np.clip(audio, -32768, 32767).astype(np.int16), regions))
+    return clips
+
+
+def run_adaptive(frames):
+    """The listener's VAD: returns (per-frame decisions, first kept frame, end frame, seconds)."""
+    vad = VoiceActivityDetector()
+    decisions = np.zeros(len(frames), dtype=bool)
+    started = time.perf_counter()
+    for i, frame in enumerate(frames):
+        decisions[i] = vad.is_speech(frame)
+    elapsed = time.perf_counter() - started
+
+    segmenter = UtteranceSegmenter(VoiceActivityDetector())
+    first_kept = end = None
+    for i, frame in enumerate(frames):
+        kept, ended = segmenter.feed(frame)
+        if kept and first_kept is None:
+            first_kept = i + 1 - len(kept)
+        if ended:
+            end = i + 1
+            break
+    return decisions, first_kept, end, elapsed
+
+
+def run_legacy(frames):
+    """The old capture: fixed RMS threshold, 2 s silence timeout, no pre-roll."""
+    max_silence = int(LEGACY_SILENCE_TIMEOUT / FRAME_SECONDS)
+    max_frames = int(MAX_COMMAND_DURATION / FRAME_SECONDS)
+    started = time.perf_counter()
+    rms = np.sqrt(np.mean(frames.astype(np.float32) ** 2, axis=1))
+    first_kept = end = None
+    silence = kept = 0
+    for i, level in enumerate(rms):
+        if level > LEGACY_THRESHOLD:
+            if first_kept is None:
+                first_kept = i
+            silence = 0
+            kept += 1
+        elif first_kept is not None:
+            silence += 1
+            kept += 1
+            if silence > max_silence:
+                end = i + 1
+                break
+        if kept >= max_frames:
+            end = i + 1
+            break
+    return first_kept, end, time.perf_counter() - started
+
+
+def capture_scores(first_kept, end, regions, n_frames):
+    """(seconds of speech clipped at the start, end-of-speech latency, truncated?)"""
+    if not regions:
+        return 0.0, None, False
+    if first_kept is None:
+        return regions[0][1] - regions[0][0], None, True
+    end = n_frames if end is None else end
+    clipped = max(0.0, first_kept * FRAME_SECONDS - regions[0][0])
+    last_speech = regions[-1][1]
+    end_time = end * FRAME_SECONDS
+    return clipped, end_time - last_speech, end_time < last_speech
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[int((len(ordered) - 1) * q)]
+
+
+def main(argv):
+    if not argv:
+        print("Usage: python benchmarks/vad_evaluation.py WAV_DIR | --synthetic")
+        return
+    if argv[0] == '--synthetic':
+        clips = synthetic_clips()
+    else:
+        clips = []
+        for wav_path in sorted(glob.glob(os.path.join(argv[0], '*.wav'))):
+            label_path = os.path.splitext(wav_path)[0] + '.txt'
+            if not os.path.exists(label_path):
+                print(f"Skipping {wav_path}: no {os.path.basename(label_path)}")
+                continue
+            clips.append((os.path.basename(wav_path), load_wav(wav_path), load_labels(label_path)))
+    if not clips:
+        print("No labeled clips found.")
+        return
+
+    results = {'adaptive': {'clipped': [], 'eos': [], 'truncated': 0, 'seconds': 0.0},
+               'legacy': {'clipped': [], 'eos': [], 'truncated': 0, 'seconds': 0.0}}
+    tp = fp = fn = 0
+    total_frames = 0
+    for name, audio, regions in clips:
+        frames = split_frames(audio)
+        total_frames += len(frames)
+        truth = frame_labels(len(frames), regions)
+
+        decisions, first_kept, end, elapsed = run_adaptive(frames)
+        tp += np.count_nonzero(decisions & truth)
+        fp += np.count_nonzero(decisions & ~truth)
+        fn += np.count_nonzero(~decisions & truth)
+        runs = [('adaptive', first_kept, end, elapsed), ('legacy',) + run_legacy(frames)]
+        for method, first, stop, seconds in runs:
+            clipped, eos, truncated = capture_scores(first, stop, regions, len(frames))
+            r = results[method]
+            r['clipped'].append(clipped)
+            if eos is not None and not truncated:
+                r['eos'].append(eos)
+            r['truncated'] += truncated
+            r['seconds'] += seconds
+
+    precision = tp / max(tp + fp, 1)
+    recall = tp / max(tp + fn, 1)
+    f1 = 2 * precision * recall / max(precision + recall, 1e-9)
+    print(f"\n--- VAD evaluation: {len(clips)} clips, {total_frames} frames ---")
+    print(f"adaptive frame accuracy: precision={precision:.3f} recall={recall:.3f} F1={f1:.3f}")
+    print(f"{'method':<10} {'clipped p50/max (ms)':>21} {'EOS p50/p95 (ms)':>18} {'truncated':>10} {'us/frame':>9}")
+    for method, r in results.items():
+        print(f"{method:<10} {percentile(r['clipped'], 0.5) * 1000:10.0f}/{max(r['clipped']) * 1000:<10.0f}"
+              f" {percentile(r['eos'], 0.5) * 1000:8.0f}/{percentile(r['eos'], 0.95) * 1000:<9.0f}"
+              f" {r['truncated']:>10} {r['seconds'] / total_frames * 1e6:9.1f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
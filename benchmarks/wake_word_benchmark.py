@@ -0,0 +1,62 @@
+# benchmarks/wake_word_benchmark.py
+#
+# Measures wake word throughput for 1, 8, 32 and 128 concurrent mic streams,
+# comparing one batched WakeWordEngine.predict call per tick against one call
+# per mic. Requires the openWakeWord models (downloaded on first run).
+#
+# Usage: python benchmarks/wake_word_benchmark.py [seconds_of_audio_per_mic]
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from wake_word import WINDOW_SAMPLES, load_wake_word_engine
+
+STREAM_COUNTS = [1, 8, 32, 128]
+WINDOW_SECONDS = WINDOW_SAMPLES / 16000
+
+
+def run_case(engine, n_streams, n_ticks, batched):
+    streams = [engine.create_stream(f"mic {i}") for i in range(n_streams)]
+    rng = np.random.default_rng(0)
+    audio = rng.integers(-2000, 2000, size=(n_ticks, WINDOW_SAMPLES), dtype=np.int16)
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for tick in range(n_ticks):
+        for stream in streams:
+            stream.add_audio(audio[tick])
+        if batched:
+            engine.predict(streams)
+        else:
+            for stream in streams:
+                engine.predict([stream])
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    frames = n_streams * n_ticks
+    audio_seconds = n_ticks * WINDOW_SECONDS
+    # Share of one CPU core that each mic costs when streaming in real time
+    cpu_per_mic = cpu / audio_seconds / n_streams * 100
+    return frames / wall, cpu_per_mic
+
+
+def main(seconds_per_mic=10.0):
+    engine = load_wake_word_engine()
+    n_ticks = int(seconds_per_mic / WINDOW_SECONDS)
+
+    print(f"\n--- Wake word benchmark: {seconds_per_mic:.0f}s of audio per mic ---")
+    print(f"{'streams':>8} {'mode':>10} {'frames/sec':>12} {'CPU % per mic':>15}")
+    for n_streams in STREAM_COUNTS:
+        for batched in (False, True):
+            fps, cpu_per_mic = run_case(engine, n_streams, n_ticks, batched)
+            mode = "batched" if batched else "per-mic"
+            print(f"{n_streams:8d} {mode:>10} {fps:12.0f} {cpu_per_mic:15.2f}")
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 10.0)
@@ -0,0 +1,376 @@
+# device_state.py
+#
+# What the house's speakers are doing: each speaker's volume, what is playing
+# on it and which speakers play together as a group. The Dispatcher records
+# every playMusic and setVolume here as it dispatches it, so commands that
+# depend on the current state resolve without the LLM:
+#
+#   relative volume  "turn it up a bit", "quieter in the office"
+#   questions        "what's playing?", "what's the volume in the kitchen?"
+#
+# (intents.py matches those and marks them with a "state" key; resolve() turns
+# them into an ordinary setVolume or makeSpeech.) Commands that still go to the
+# LLM but mention the music or the volume get a compact summary() in the
+# prompt's live context. The state is saved as a JSON snapshot, so volumes and
+# groups survive restarts.
+
+import json
+import os
+import re
+import threading
+import time
+
+from intents import SYSTEM_PROMPT_PATH, load_prompt_spec
+from metrics import metrics
+from playback import DEFAULT_MUSIC_VOLUME
+
+# --- CONFIGURATION ---
+DEVICE_STATE_PATH = 'cache/device_state.json'
+DEVICE_STATE_SAVE_INTERVAL = 10.0  # Minimum seconds between snapshots written to disk
+NOW_PLAYING_TTL = 6 * 3600.0  # Seconds after which a restored "now playing" is assumed to have ended
+MUSIC_FIELDS = ('song', 'artist', 'playlist', 'platform')  # playMusic parameters that say what is playing
+
+# Commands the LLM can only answer well if it knows the current state
+NEEDS_STATE = re.compile(
+    r"\b(?:volume|loud(?:er)?|quiet(?:er)?|soft(?:er)?|up|down|mute|unmute|playing|song|track|artist|album|"
+    r"music|playlist|again|same|group(?:ed)?|together)\b", re.I)
+# Questions about the state, whose answer changes as soon as the state does
+STATE_QUESTION = re.compile(
+    r"\b(?:what|which|who|how)\b.*\b(?:playing|song|track|artist|album|volume|loud)\b", re.I)
+
+
+def needs_state(message):
+    """True if the command refers to the music or the volume, so the LLM should see the device state."""
+    return bool(NEEDS_STATE.search(message))
+
+
+def describe_music(now_playing):
+    """{'song': 'Hey Jude', 'artist': 'The Beatles'} -> '"Hey Jude" by The Beatles'."""
+    if now_playing.get('song'):
+        text = f'"{now_playing["song"]}"'
+        if now_playing.get('artist'):
+            text += f" by {now_playing['artist']}"
+    elif now_playing.get('playlist'):
+        text = f'the "{now_playing["playlist"]}" playlist'
+    elif now_playing.get('artist'):
+        text = f"music by {now_playing['artist']}"
+    else:
+        text = "music"
+    if now_playing.get('platform'):
+        text += f" on {now_playing['platform']}"
+    return text
+
+
+def join_names(names):
+    """['kitchen', 'patio', 'deck'] -> 'the kitchen, the patio and the deck'."""
+    names = [f"the {name}" for name in names]
+    return names[0] if len(names) == 1 else f"{', '.join(names[:-1])} and {names[-1]}"
+
+
+class SpeakerState:
+    """One speaker: its volume (None until known), what it plays and the speakers it is grouped with."""
+    __slots__ = ('volume', 'now_playing', 'group', 'updated_at')
+
+    def __init__(self, volume=None, now_playing=None, group=None, updated_at=0.0):
+        self.volume = volume
+        self.now_playing = now_playing  # Dict of MUSIC_FIELDS, or None
+        self.group = group  # Every speaker of the group (this one included), or None
+        self.updated_at = updated_at  # Wall-clock time, so the TTL holds across restarts
+
+    def row(self):
+        return {'volume': self.volume, 'now_playing': self.now_playing, 'group': self.group,
+                'updated_at': int(self.updated_at)}
+
+
+class DeviceStateStore:
+    """
+    A thread-safe, in-memory record of every speaker's state. Pass `path=None`
+    to keep it in memory only; otherwise save() writes a snapshot there and
+    load() restores it.
+    """
+    def __init__(self, path=DEVICE_STATE_PATH, speakers=None, prompt_path=SYSTEM_PROMPT_PATH):
+        """
+        Args:
+            speakers (list): Every speaker name; read from the system prompt if omitted.
+        """
+        self.path = path
+        self.speakers = speakers
+        self.prompt_path = prompt_path
+        self.states = {}  # Speaker name -> SpeakerState
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self._flush_timer = None  # Saves a change made too soon after the last save
+
+    # --- UPDATES (called by the Dispatcher) ---
+
+    def set_volume(self, speakers, parameters):
+        volume = parameters.get('volume')
+        if not isinstance(volume, int) or not 0 <= volume <= 100:
+            return
+        with self.lock:
+            for name in self._names(speakers):
+                state = self._state(name)
+                state.volume = volume
+                state.updated_at = time.time()
+        self._changed()
+
+    def play(self, speakers, parameters):
+        """Records what started playing; several speakers playing one thing form a group."""
+        names = self._names(speakers)
+        now_playing = {field: parameters[field] for field in MUSIC_FIELDS if parameters.get(field)}
+        volume = parameters.get('volume')
+        with self.lock:
+            for name in names:
+                self._leave_group(name)
+            for name in names:
+                state = self._state(name)
+                state.now_playing = now_playing
+                state.group = list(names) if len(names) > 1 else None
+                if isinstance(volume, int) and 0 <= volume <= 100:
+                    state.volume = volume
+                state.updated_at = time.time()
+        self._changed()
+
+    # --- QUERIES ---
+
+    def get(self, name):
+        """A copy of one speaker's state."""
+        with self.lock:
+            state = self.states.get(name) or SpeakerState()
+            return SpeakerState(state.volume, state.now_playing, state.group, state.updated_at)
+
+    def group_of(self, name):
+        """The speakers playing together with `name` (itself included)."""
+        with self.lock:
+            state = self.states.get(name)
+            return list(state.group) if state is not None and state.group else [name]
+
+    def resolve(self, intent):
+        """
+        Completes an intent that needs the device state (one with a "state"
+        key, from intents.py) into a command the Dispatcher can run. Returns
+        None if it cannot be answered locally.
+        """
+        request = intent.get('state', {})
+        speakers = intent['parameters'].get('speakers') or []
+        if not speakers:
+            return None
+        if 'change' in request:
+            # A group moves together, from the volume of the speaker that was named (or asked from)
+            current = self.get(speakers[0]).volume
+            if request.get('follow_group') and len(speakers) == 1:
+                speakers = self.group_of(speakers[0])
+            current = DEFAULT_MUSIC_VOLUME if current is None else current
+            volume = max(0, min(100, current + request['change']))
+            metrics.increment('device_state_resolved')
+            return {"function": "setVolume", "parameters": {"speakers": speakers, "volume": volume}}
+
+        about = request.get('about') or speakers
+        if request.get('follow_group') and len(about) == 1:
+            about = self.group_of(about[0])
+        if request.get('query') == 'now_playing':
+            message = self.describe_playing(about)
+        elif request.get('query') == 'volume':
+            message = self.describe_volume(about)
+        else:
+            return None
+        metrics.increment('device_state_resolved')
+        return {"function": "makeSpeech", "parameters": {"speakers": speakers, "message": message}}
+
+    def describe_playing(self, names):
+        """A spoken answer to "what's playing" on these speakers."""
+        playing = {}  # Description -> speakers, in order
+        idle = []
+        for name in names:
+            now_playing = self.get(name).now_playing
+            if now_playing is None:
+                idle.append(name)
+            else:
+                playing.setdefault(describe_music(now_playing), []).append(name)
+        if not playing:
+            return f"Nothing is playing in {join_names(names)}."
+        return " ".join(f"{music[0].upper()}{music[1:]} is playing in {join_names(where)}."
+                        for music, where in playing.items())
+
+    def describe_volume(self, names):
+        """A spoken answer to "what's the volume" on these speakers."""
+        volumes = {}  # Volume -> speakers, in order
+        for name in names:
+            volumes.setdefault(self.get(name).volume, []).append(name)
+        if len(volumes) == 1:
+            volume = next(iter(volumes))
+            if volume is None:
+                return f"I haven't set the volume in {join_names(names)} yet."
+            return f"The volume in {join_names(names)} is {volume} percent."
+        parts = [f"{'unknown' if volume is None else f'{volume} percent'} in {join_names(where)}"
+                 for volume, where in volumes.items()]
+        return f"The volume is {', '.join(parts[:-1])} and {parts[-1]}."
+
+    def summary(self, source_room=None):
+        """
+        The state in a few tokens, for the LLM's live context: every speaker
+        that has a known state, grouped speakers on one line, e.g.
+        'kitchen + family room: "Hey Jude" by The Beatles, volume 40/35; office: nothing playing, volume 20'.
+        """
+        with self.lock:
+            known = [name for name, state in self.states.items()
+                     if state.volume is not None or state.now_playing is not None]
+        if source_room and source_room not in known:
+            known.insert(0, source_room)
+        parts = []
+        seen = set()
+        for name in known:
+            if name in seen:
+                continue
+            group = [member for member in self.group_of(name) if member not in seen]
+            seen.update(group)
+            states = [self.get(member) for member in group]
+            now_playing = states[0].now_playing
+            volumes = "/".join('?' if state.volume is None else str(state.volume) for state in states)
+            music = describe_music(now_playing) if now_playing is not None else "nothing playing"
+            parts.append(f"{' + '.join(group)}: {music}, volume {volumes}")
+        return "; ".join(parts) if parts else "nothing playing"
+
+    # --- PERSISTENCE ---
+
+    def save(self):
+        """Writes a snapshot to disk (atomically) if anything changed."""
+        if self.path is None:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            rows = {name: state.row() for name, state in self.states.items()}
+            self.dirty = False
+            self.last_save = time.monotonic()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(rows, f, separators=(',', ':'))
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Device state: could not save to '{self.path}'; {e}")
+
+    def load(self):
+        """Restores the last snapshot. Music that started too long ago is assumed to have ended."""
+        if self.path is None:
+            return 0
+        try:
+            with open(self.path, 'r') as f:
+                rows = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            print(f"Device state: ignoring unreadable '{self.path}'; {e}")
+            return 0
+
+        now = time.time()
+        with self.lock:
+            for name, row in rows.items():
+                state = SpeakerState(row.get('volume'), row.get('now_playing'), row.get('group'),
+                                     row.get('updated_at', 0))
+                if now - state.updated_at > NOW_PLAYING_TTL:
+                    state.now_playing = state.group = None
+                self.states[name] = state
+            return len(self.states)
+
+    # --- INTERNALS ---
+
+    def _names(self, speakers):
+        """Accepts a list of names, a single name or 'all', like PlaybackScheduler.resolve()."""
+        if not speakers or speakers == 'all':
+            if self.speakers is None:
+                self.speakers = load_prompt_spec(self.prompt_path)[0]
+            return list(self.speakers)
+        if isinstance(speakers, str):
+            return [speakers]
+        return list(dict.fromkeys(speakers))
+
+    def _state(self, name):
+        state = self.states.get(name)
+        if state is None:
+            state = self.states[name] = SpeakerState()
+        return state
+
+    def _leave_group(self, name):
+        """Takes a speaker out of its group; a group left with one speaker is dissolved. Holds the lock."""
+        state = self.states.get(name)
+        if state is None or not state.group:
+            return
+        rest = [member for member in state.group if member != name]
+        for member in rest:
+            self.states[member].group = rest if len(rest) > 1 else None
+        state.group = None
+
+    def _changed(self):
+        timer = None
+        with self.lock:
+            self.dirty = True
+            wait = DEVICE_STATE_SAVE_INTERVAL - (time.monotonic() - self.last_save)
+            if wait > 0 and self.path is not None and self._flush_timer is None:
+                # Too soon to save again; save once the interval is up, or the change is lost on a crash
+                timer = self._flush_timer = threading.Timer(wait, self._flush)
+                timer.daemon = True
+        if wait <= 0:
+            self.save()
+        elif timer is not None:
+            timer.start()
+
+    def _flush(self):
+        with self.lock:
+            self._flush_timer = None
+        self.save()
+
+
+# This block allows you to test the store independently.
+# To run, execute `python device_state.py` in your terminal.
+if __name__ == '__main__':
+    import tempfile
+    print("--- Testing DeviceStateStore ---")
+    path = os.path.join(tempfile.mkdtemp(), 'device_state.json')
+    store = DeviceStateStore(path=path, speakers=['kitchen', 'family room', 'office', 'patio'])
+
+    store.play(['kitchen', 'family room'], {"song": "Hey Jude", "artist": "The Beatles", "volume": 40})
+    store.set_volume(['family room'], {"volume": 35})
+    assert store.group_of('kitchen') == ['kitchen', 'family room']
+    assert store.describe_playing(['kitchen']) == '"Hey Jude" by The Beatles is playing in the kitchen.'
+    assert store.describe_volume(['kitchen', 'family room']) == \
+        "The volume is 40 percent in the kitchen and 35 percent in the family room."
+    assert store.summary('office') == 'office: nothing playing, volume ?; ' \
+        'kitchen + family room: "Hey Jude" by The Beatles, volume 40/35'
+
+    # "Turn it up a bit" from the kitchen moves the whole group, from the kitchen's volume
+    up = {"function": "setVolume", "parameters": {"speakers": ["kitchen"]},
+          "state": {"change": 5, "follow_group": True}}
+    assert store.resolve(up) == {"function": "setVolume",
+                                 "parameters": {"speakers": ["kitchen", "family room"], "volume": 45}}
+    down = {"function": "setVolume", "parameters": {"speakers": ["office"]}, "state": {"change": -70}}
+    assert store.resolve(down)["parameters"]["volume"] == 0  # Unknown starts at the default, clamped at 0
+    question = {"function": "makeSpeech", "parameters": {"speakers": ["office"]},
+                "state": {"query": "now_playing", "about": ["family room"]}}
+    assert store.resolve(question)["parameters"]["message"].endswith("is playing in the family room.")
+
+    # Playing something else in the family room takes it out of the group
+    store.play(['family room', 'patio'], {"playlist": "dinner party"})
+    assert store.group_of('kitchen') == ['kitchen'] and store.group_of('patio') == ['family room', 'patio']
+
+    store.save()
+    reloaded = DeviceStateStore(path=path, speakers=store.speakers)
+    assert reloaded.load() == 3 and reloaded.get('family room').volume == 35
+    assert reloaded.describe_playing(['patio']) == 'The "dinner party" playlist is playing in the patio.'
+
+    # A change right after a save is written once the save interval is up
+    DEVICE_STATE_SAVE_INTERVAL = 0.2
+    store = DeviceStateStore(path=path, speakers=store.speakers)
+    store.load()
+    store.set_volume(['office'], {"volume": 55})
+    assert DeviceStateStore(path=path, speakers=store.speakers).load() == 3  # Not saved yet
+    time.sleep(0.5)
+    reloaded = DeviceStateStore(path=path, speakers=store.speakers)
+    assert reloaded.load() == 4 and reloaded.get('office').volume == 55
+    print("All DeviceStateStore tests passed.")
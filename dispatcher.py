@@ -1,5 +1,80 @@
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from audio_manager import AudioManager
+from device_state import DeviceStateStore
+from metrics import metrics
+from playback import PlaybackScheduler
+import tracing
+
+# --- CONFIGURATION ---
+DISPATCHER_WORKERS = 4  # Handlers that can run at the same time
+
+
+def follow(future):
+    """
+    A Future that resolves like `future`, except that if `future` resolves to
+    another Future (a handler that started playback), it waits for that too.
+    """
+    outer = Future()
+
+    def on_done(done):
+        if done.cancelled():
+            outer.cancel()
+        elif done.exception() is not None:
+            outer.set_exception(done.exception())
+        elif isinstance(done.result(), Future):
+            done.result().add_done_callback(on_done)
+        else:
+            outer.set_result(done.result())
+
+    future.add_done_callback(on_done)
+    return outer
+
+
+class SpeechStream:
+    """
+    Speaks a message that arrives one sentence at a time (from a streaming LLM
+    reply). Each sentence is queued on the target zones as soon as it arrives,
+    so it is synthesized while the ones before it are still being spoken.
+    """
+    def __init__(self, playback, target_speakers, volume, trace=None):
+        self.playback = playback
+        self.target_speakers = target_speakers
+        self.volume = volume
+        self.trace = trace  # Held open until the last sentence has been spoken
+        self.futures = []
+        self.lock = threading.Lock()
+        if trace is not None:
+            trace.hold()
+            trace.mark('dispatched')
+
+    def say(self, sentence):
+        with tracing.activate(self.trace):
+            future = self.playback.speak(sentence, self.target_speakers, self.volume)
+        with self.lock:
+            self.futures.append(future)
+
+    def close(self):
+        """
+        Ends the message without waiting for it to be spoken.
+
+        Returns:
+            Future: Resolves to True once every sentence has been spoken.
+        """
+        with self.lock:
+            futures = list(self.futures)
+        done = Future()
+        if self.trace is not None:
+            done.add_done_callback(lambda _: self.trace.release())
+        if not futures:
+            done.set_result(True)
+            return done
+        # Sentences finish in order, so the message is done when its last one is
+        futures[-1].add_done_callback(
+            lambda last: done.set_result(all(not f.exception() and f.result() for f in futures)))
+        return done
+
 
 class Dispatcher:
     """
@@ -7,41 +82,119 @@ class Dispatcher:
     This class acts as a bridge between the AI's instructions
     and the actual smart home device control logic.
     """
-    def __init__(self):
+    # Functions a streaming LLM reply may run as soon as these parameters are
+    # complete, without waiting for the rest of the response.
+    EARLY_DISPATCH = {
+        "setVolume": ("speakers", "volume"),
+        "stopSpeech": ("speakers",),
+    }
+
+    def __init__(self, audio_manager=None, playback=None, max_workers=DISPATCHER_WORKERS, state=None):
         """
         Initializes the Dispatcher and maps function names to handler methods.
+        Handlers run on a thread pool, so a slow one never holds up the caller.
+        `state` (a DeviceStateStore) records what the speakers are doing; by
+        default it is kept in memory only.
         """
         self.function_map = {
             "playMusic": self._handle_play_music,
             "setVolume": self._handle_set_volume,
             "makeSpeech": self._handle_make_speech,
+            "stopSpeech": self._handle_stop_speech,
             # As you add more functions to your API, you will add their handlers here.
         }
-        self.audio_manager = AudioManager()
+        self.audio_manager = audio_manager or AudioManager()
+        self.playback = playback or PlaybackScheduler(self.audio_manager)
+        self.state = state if state is not None else DeviceStateStore(path=None)
+        # Functions that change the device state, and how
+        self.state_updates = {
+            "playMusic": self.state.play,
+            "setVolume": self.state.set_volume,
+        }
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dispatcher")
 
         print("Dispatcher initialized.")
 
     def execute(self, function_name, parameters):
         """
-        Executes a command by calling the appropriate handler method.
+        Executes a command by scheduling the appropriate handler method. Returns
+        immediately.
 
         Args:
             function_name (str): The name of the function to execute.
             parameters (dict): A dictionary of parameters for the function.
+
+        Returns:
+            Future: Resolves once the command has taken effect; for makeSpeech,
+                    once the message has been spoken.
         """
         handler = self.function_map.get(function_name)
 
         if handler:
             print(f"\n--- DISPATCHER ---")
             print(f"Received command: '{function_name}' with params: {parameters}")
-            try:
+            self._update_state(function_name, parameters)
+            # The command's trace stays open until the handler (and any speech it started) is done
+            trace = tracing.current()
+            if trace is not None:
+                trace.hold()
+            future = follow(self.executor.submit(self._run_handler, function_name, handler, parameters, trace))
+            if trace is not None:
+                future.add_done_callback(lambda _: trace.release())
+            return future
+
+        print(f"\n--- DISPATCHER WARNING ---")
+        print(f"Unknown function called: '{function_name}'. No action taken.")
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def begin_speech(self, parameters):
+        """
+        Starts a makeSpeech whose message will arrive sentence by sentence.
+
+        Args:
+            parameters (dict): The makeSpeech parameters known so far (speakers, volume).
+
+        Returns:
+            SpeechStream: Call say() for each sentence, then close().
+        """
+        print(f"\n--- DISPATCHER ---")
+        print(f"Streaming command: 'makeSpeech' with params: {parameters}")
+        return SpeechStream(self.playback, parameters.get('speakers', 'all'), parameters.get('volume'),
+                            tracing.current())
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.playback.shutdown()
+        self.state.save()
+
+    def _update_state(self, function_name, parameters):
+        """
+        Records the command in the device state as it is dispatched rather than
+        when its handler runs, so the room's next command ("a bit more") sees it.
+        """
+        update = self.state_updates.get(function_name)
+        if update is None or not parameters.get('speakers'):
+            return
+        try:
+            update(parameters['speakers'], parameters)
+        except Exception as e:
+            print(f"Could not record '{function_name}' in the device state: {e}")
+
+    def _run_handler(self, function_name, handler, parameters, trace=None):
+        started = time.monotonic()
+        try:
+            with tracing.activate(trace):
+                tracing.mark('dispatched')
                 # Call the associated handler method with the parameters
-                handler(parameters)
-            except Exception as e:
-                print(f"Error executing '{function_name}': {e}")
-        else:
-            print(f"\n--- DISPATCHER WARNING ---")
-            print(f"Unknown function called: '{function_name}'. No action taken.")
+                return handler(parameters)
+        except Exception as e:
+            print(f"Error executing '{function_name}': {e}")
+            metrics.increment('handler_errors')
+            raise
+        finally:
+            metrics.record_latency(f'handler_{function_name}', time.monotonic() - started)
 
     # --- Handler Methods ---
 
@@ -56,6 +209,8 @@ class Dispatcher:
         artist = f" by {params.get('artist')}" if params.get('artist') else ""
         platform = f" on {params.get('platform')}" if params.get('platform') else ""
         volume = f" at {params.get('volume')}% volume" if params.get('volume') is not None else ""
+        if params.get('speakers'):
+            self.playback.set_music(params['speakers'], playing=True, volume=params.get('volume'))
 
         #print(f"Action: Playing '{song_info}{artist}' in '{target}'{platform}{volume}.")
 
@@ -65,6 +220,8 @@ class Dispatcher:
         """
         target = params.get('speakers', 'unknown location')
         volume = params.get('volume', 'a default level')
+        if params.get('speakers') and isinstance(volume, int):
+            self.playback.set_music(params['speakers'], volume=volume)
 
         #print(f"Action: Setting volume to {volume}% in '{target}'.")
 
@@ -78,7 +235,16 @@ class Dispatcher:
         volume = f" at {params.get('volume')}% volume" if params.get('volume') is not None else ""
 
         #print(f"Action: Announcing to '{target}'{volume}: '{message}'")
-        self.audio_manager.speak(text=message, target_speakers=target, volume=volume)
+        return self.playback.speak(message, target, params.get('volume'))
+
+    def _handle_stop_speech(self, params):
+        """
+        Cuts off whatever is being said on the speakers and drops queued messages.
+        """
+        target = params.get('speakers', 'all')
+        stopped = self.playback.stop(target)
+
+        #print(f"Action: Stopped speech on {stopped} speaker(s) in '{target}'.")
 
 # This block allows you to test the dispatcher independently.
 # To run, execute `python dispatcher.py` in your terminal.
@@ -105,3 +271,10 @@ if __name__ == '__main__':
         }
     }
     dispatcher.execute(volume_command['function'], volume_command['parameters'])
+
+    # Test case 3: Make Speech, then cut it off
+    speech = dispatcher.execute("makeSpeech", {"speakers": ["kitchen"], "message": "This sentence will be cut off."})
+    time.sleep(1.0)
+    dispatcher.execute("stopSpeech", {"speakers": ["kitchen"]})
+    print(f"Speech finished without interruption: {speech.result()}")
+    dispatcher.shutdown()
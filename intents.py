@@ -0,0 +1,386 @@
+# intents.py
+#
+# A local fast path in front of the LLM. Common commands ("volume 30 in the
+# kitchen", "play Hey Jude by the Beatles on the patio", "stop") are matched
+# with regex rules and turned into the same {function, parameters} dict the LLM
+# would return, without a network round trip. The speaker names and function
+# parameters come from system_prompt.txt, so rules for a function are only
+# active if the prompt's API spec declares it. Anything the rules are not
+# sure about returns None and goes to the LLM as before.
+#
+# Relative volume changes ("turn it up a bit") and questions about the music
+# ("what's playing?") are matched too, but their result depends on the device
+# state: they carry a "state" key and device_state.py completes them into a
+# setVolume or makeSpeech just before they run.
+
+import difflib
+import re
+
+# --- CONFIGURATION ---
+SYSTEM_PROMPT_PATH = 'system_prompt.txt'
+SPEAKER_MATCH_CUTOFF = 0.9  # difflib ratio needed to accept a fuzzy speaker name ("kitchn")
+SPEAKER_MATCH_MARGIN = 0.1  # ...and how much closer it must be than any other speaker's name
+VOLUME_STEP = 10  # Change for a plain "turn it up"
+VOLUME_STEP_SMALL = 5  # "a bit", "a little"
+VOLUME_STEP_LARGE = 20  # "a lot"
+PLATFORMS = {
+    'spotify': 'Spotify', 'apple music': 'Apple Music', 'youtube music': 'YouTube Music',
+    'youtube': 'YouTube', 'pandora': 'Pandora', 'amazon music': 'Amazon Music', 'tidal': 'Tidal',
+}
+
+_NUMBER_WORDS = {
+    'zero': 0, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7,
+    'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'thirteen': 13, 'fourteen': 14,
+    'fifteen': 15, 'sixteen': 16, 'seventeen': 17, 'eighteen': 18, 'nineteen': 19, 'twenty': 20,
+    'thirty': 30, 'forty': 40, 'fifty': 50, 'sixty': 60, 'seventy': 70, 'eighty': 80, 'ninety': 90,
+    'hundred': 100, 'a hundred': 100, 'one hundred': 100,
+}
+_WORD = '|'.join(sorted(_NUMBER_WORDS, key=len, reverse=True))
+NUMBER = rf"(?:\d{{1,3}}|(?:{_WORD})(?:[ -](?:{_WORD}))?)"
+PERCENT = r"(?: ?%| percent)?"
+ALL_SPEAKERS = {'everywhere', 'all speakers', 'all the speakers', 'all rooms', 'every room',
+                'the whole house', 'whole house', 'the house', 'all'}
+THIS_ROOM = {'here', 'in here', 'this room', 'the room'}
+
+_PREFIX = re.compile(r"^(?:(?:hey |ok |okay )?jarvis )?(?:please |can you |could you |would you )*", re.I)
+_SUFFIX = re.compile(r"(?: please| thanks| thank you)+$", re.I)
+
+SET_VOLUME_RULES = [
+    # "volume 30", "set the volume to 30 in the kitchen", "turn the music down to 20 percent"
+    # (up or down needs "to": "turn it up 5" is a relative change)
+    re.compile(rf"^(?:(?:set|change|turn|put|make) )?(?:the )?(?:volume|music|sound|speakers?|it)"
+               rf"(?:(?: up| down)? to| at)? (?P<volume>{NUMBER}){PERCENT}"
+               rf"(?: (?:(?:in|on|for) )?(?P<speakers>.+))?$", re.I),
+    # "set the kitchen to 40", "turn the patio volume down to 10"
+    re.compile(rf"^(?:set|change|turn|put) (?P<speakers>.+?)(?: volume| speakers?| music)?"
+               rf"(?: up| down)? to (?P<volume>{NUMBER}){PERCENT}$", re.I),
+    # "kitchen volume 30"
+    re.compile(rf"^(?P<speakers>.+?) volume (?:to )?(?P<volume>{NUMBER}){PERCENT}$", re.I),
+    # "set the volume in the office to 25"
+    re.compile(rf"^(?:set|change|turn|put) (?:the )?volume (?:in|on|for) (?P<speakers>.+?)"
+               rf"(?: up| down)? to (?P<volume>{NUMBER}){PERCENT}$", re.I),
+]
+MUTE_RULES = [
+    re.compile(r"^mute(?: the)?(?: music| volume| sound| speakers?| it)?(?: (?:in|on) (?P<speakers>.+))?$", re.I),
+    re.compile(r"^mute (?P<speakers>.+)$", re.I),
+]
+# What "it" can be in "turn it up": the music of the room (and its group)
+VOLUME_TARGET = r"(?:it|that|this|the (?:music|volume|sound|speakers?)|music|volume|sound)"
+SMALL_STEPS = r"a (?:little )?bit|a little|slightly|a touch|a tad"
+LARGE_STEPS = r"a lot|way|much"
+VOLUME_AMOUNT = rf"(?:(?:by )?(?P<by>{NUMBER}){PERCENT}|(?P<size>{SMALL_STEPS}|{LARGE_STEPS}))(?: more)?"
+ADJUST_VOLUME_RULES = [
+    # "turn it up a bit", "turn the music down in the office", "turn the kitchen up by 20", "turn it up 5"
+    re.compile(rf"^(?:turn|crank|bring) (?:(?P<target>.+?) )?(?P<direction>up|down)(?: {VOLUME_AMOUNT})?"
+               rf"(?: (?:in|on) (?P<speakers>.+))?$", re.I),
+    # "turn up the music", "turn down the volume a little in the patio"
+    re.compile(rf"^(?:turn|crank|bring) (?P<direction>up|down) (?P<target>{VOLUME_TARGET})(?: {VOLUME_AMOUNT})?"
+               rf"(?: (?:in|on) (?P<speakers>.+))?$", re.I),
+    # "volume up", "volume down by 15 in the kitchen"
+    re.compile(rf"^(?:the )?volume (?P<direction>up|down)(?: {VOLUME_AMOUNT})?(?: (?:in|on) (?P<speakers>.+))?$", re.I),
+    # "raise the volume", "lower the music a little on the deck"
+    re.compile(rf"^(?P<direction>raise|lower|increase|decrease) (?:the )?(?:volume|music|sound)"
+               rf"(?: {VOLUME_AMOUNT})?(?: (?:in|on) (?P<speakers>.+))?$", re.I),
+    # "louder", "make it a bit quieter in here"
+    re.compile(rf"^(?:make (?:it|the music) )?(?:(?P<size>{SMALL_STEPS}|{LARGE_STEPS}) )?"
+               rf"(?P<direction>louder|quieter|softer)(?: (?:in|on) (?P<speakers>.+))?$", re.I),
+]
+LOUDER = {'up', 'raise', 'increase', 'louder'}
+NOW_PLAYING_RULES = [
+    re.compile(r"^(?:what(?:'s| is) (?:playing|on)|what song is (?:this|that|playing|on)|what(?:'s| is) (?:this|that) song|"
+               r"what are we listening to)(?: (?:in|on) (?P<speakers>.+))?$", re.I),
+]
+VOLUME_QUERY_RULES = [
+    re.compile(r"^(?:what(?:'s| is) the volume(?: (?:at|set to))?|how loud is (?:it|the music))"
+               r"(?: (?:in|on) (?P<speakers>.+))?$", re.I),
+    re.compile(r"^how loud is (?P<speakers>.+)$", re.I),
+]
+STOP_SPEECH_RULE = re.compile(r"^(?:stop|cancel|quiet|be quiet|shush|shut up|enough|never ?mind)"
+                              r"(?: talking| speaking| it| that)?(?: (?:in|on) (?P<speakers>.+))?$", re.I)
+PLAY_RULE = re.compile(r"^(?:play|put on|start playing) (?P<rest>.+)$", re.I)
+PLAY_VOLUME_SUFFIX = re.compile(rf"^(?P<rest>.+?) (?:at|with(?: the)? volume(?: at)?|volume)"
+                                rf"(?: volume)? (?P<volume>{NUMBER}){PERCENT}(?: volume)?$", re.I)
+PLAY_PLATFORM_SUFFIX = re.compile(rf"^(?P<rest>.+?) (?:on|from|using) (?P<platform>{'|'.join(PLATFORMS)})$", re.I)
+PLAY_PLAYLIST = [
+    re.compile(r"^(?:the |my )?playlist (?P<playlist>.+)$", re.I),
+    re.compile(r"^(?:the |my )?(?P<playlist>.+?) playlist$", re.I),
+]
+VAGUE_NAMES = {'the', 'a', 'my', 'this', 'that', 'same', 'the same', 'that same', 'another', 'a different', 'some'}
+PLAY_ARTIST_ONLY = re.compile(r"^(?:some |any |a )?(?:music|songs?|tracks?|something|anything|stuff) by (?P<artist>.+)$",
+                              re.I)
+# Not song titles: "play the song by the Beatles" means a song from the conversation, or none in particular
+GENERIC_SONGS = {'song', 'the song', 'that song', 'this song', 'the track', 'that track', 'this track', 'one',
+                 'the one', 'that one', 'the other one', 'something', 'anything', 'music', 'the music'}
+PLAY_SONG_BY = re.compile(r"^(?:the song )?(?P<song>.+?) by (?P<artist>.+)$", re.I)
+
+
+def load_prompt_spec(path=SYSTEM_PROMPT_PATH):
+    """Reads the speaker list and function parameters out of the system prompt file."""
+    with open(path, 'r') as f:
+        return parse_prompt_spec(f.read())
+
+
+def parse_prompt_spec(prompt):
+    """
+    Extracts the speaker list and function parameters from the system prompt text.
+
+    Returns:
+        tuple: (list of speaker names, {function name: list of parameter names})
+    """
+    lines = prompt.splitlines()
+    speakers = []
+    functions = {}
+    current = None
+    in_speakers = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped == 'SPEAKERS:':
+            in_speakers = True
+            continue
+        if in_speakers:
+            if not stripped or stripped.startswith('---'):
+                in_speakers = False
+            else:
+                speakers.append(stripped)
+            continue
+        function = re.match(r"^FUNCTION:\s*(\w+)", stripped)
+        if function:
+            current = functions.setdefault(function.group(1), [])
+            continue
+        parameter = re.match(r"^(\w+) \(([^)]*)\):", stripped)
+        if parameter and current is not None:
+            current.append(parameter.group(1))
+    return speakers, functions
+
+
+def parse_number(text):
+    """'30', 'thirty', 'thirty five' -> int, or None."""
+    text = text.lower().replace('-', ' ')
+    if text.isdigit():
+        return int(text)
+    if text in _NUMBER_WORDS:
+        return _NUMBER_WORDS[text]
+    words = text.split()
+    if len(words) == 2 and _NUMBER_WORDS.get(words[0], 0) >= 20 and _NUMBER_WORDS.get(words[1], 10) < 10:
+        return _NUMBER_WORDS[words[0]] + _NUMBER_WORDS[words[1]]
+    return None
+
+
+def normalize(text):
+    """Drops punctuation (except apostrophes and %), filler words and extra spaces."""
+    text = re.sub(r"[^\w\s'%-]", ' ', text)
+    text = ' '.join(text.split())
+    text = _PREFIX.sub('', text)
+    return _SUFFIX.sub('', text).strip()
+
+
+class IntentMatcher:
+    """
+    Matches transcribed commands against local rules. match() returns a
+    {"function": ..., "parameters": ...} dict for a confident match, else None.
+    """
+    def __init__(self, prompt_path=SYSTEM_PROMPT_PATH, state_rules=True):
+        """
+        Args:
+            state_rules (bool): Also match commands that need the device state
+                                (relative volume, what's playing).
+        """
+        self.speakers, self.functions = load_prompt_spec(prompt_path)
+        self.state_rules = state_rules
+        # Speaker names as they might come out of STT: "joseph's room", "josephs room", "joseph room"
+        self.speaker_aliases = {}
+        for speaker in self.speakers:
+            name = speaker.lower()
+            for alias in (name, name.replace("'s", 's'), name.replace("'s", ''), name.replace("'", '')):
+                self.speaker_aliases[alias] = speaker
+
+    def match(self, message, source_room=None):
+        text = normalize(message)
+        if not text:
+            return None
+        matchers = [('setVolume', self._match_set_volume), ('playMusic', self._match_play_music),
+                    ('stopSpeech', self._match_stop_speech)]
+        if self.state_rules:
+            matchers += [('setVolume', self._match_adjust_volume), ('makeSpeech', self._match_state_question)]
+        for function, matcher in matchers:
+            if function not in self.functions:
+                continue
+            parameters = matcher(text, source_room)
+            if parameters is not None:
+                # Same parameter order as the API spec, like the LLM's replies
+                intent = {"function": function,
+                          "parameters": {k: parameters[k] for k in self.functions[function] if k in parameters}}
+                if 'state' in parameters:
+                    intent['state'] = parameters['state']  # Completed by DeviceStateStore.resolve()
+                return intent
+        return None
+
+    def resolve_speakers(self, phrase, source_room):
+        """
+        Turns "the kitchen and the patio", "everywhere" or "" (meaning the room
+        the command came from) into a list of speaker names, or None if any
+        part of it is not clearly a speaker.
+        """
+        phrase = (phrase or '').lower().strip()
+        if not phrase or phrase in THIS_ROOM:
+            room = self._resolve_one(source_room or '')
+            return [room] if room else None
+        if phrase in ALL_SPEAKERS:
+            return list(self.speakers)
+        resolved = []
+        for part in re.split(r",| and | & ", phrase):
+            speaker = self._resolve_one(part)
+            if speaker is None:
+                return None
+            if speaker not in resolved:
+                resolved.append(speaker)
+        return resolved or None
+
+    def _resolve_one(self, name):
+        name = re.sub(r"^(?:the|in|on) ", '', name.lower().strip())
+        name = re.sub(r" speakers?$", '', name)
+        if name in self.speaker_aliases:
+            return self.speaker_aliases[name]
+        # A misheard name skips the LLM, so it has to be close to one speaker and clearly not another
+        best = {}
+        for alias, speaker in self.speaker_aliases.items():
+            ratio = difflib.SequenceMatcher(None, name, alias).ratio()
+            best[speaker] = max(best.get(speaker, 0.0), ratio)
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        speaker, ratio = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if ratio < SPEAKER_MATCH_CUTOFF or ratio - runner_up < SPEAKER_MATCH_MARGIN:
+            return None
+        if "'s " in speaker.lower():
+            # "abe's room" needs the abe: "bedroom" or "game room" is someone else's room
+            owner = speaker.lower().split("'s ", 1)[0]
+            if name.split()[0] not in (owner, owner + 's', owner + "'s"):
+                return None
+        return speaker
+
+    def _match_set_volume(self, text, source_room):
+        for rule, fixed_volume in [(r, None) for r in SET_VOLUME_RULES] + [(r, 0) for r in MUTE_RULES]:
+            match = rule.match(text)
+            if not match:
+                continue
+            volume = fixed_volume if fixed_volume is not None else parse_number(match.group('volume'))
+            speakers = self.resolve_speakers(match.group('speakers'), source_room)
+            if volume is not None and 0 <= volume <= 100 and speakers:
+                return {"speakers": speakers, "volume": volume}
+        return None
+
+    def _match_adjust_volume(self, text, source_room):
+        for rule in ADJUST_VOLUME_RULES:
+            match = rule.match(text)
+            if not match:
+                continue
+            groups = match.groupdict()
+            phrase = groups.get('speakers')
+            target = groups.get('target')
+            if target and not re.fullmatch(VOLUME_TARGET, target, re.I):
+                if phrase:
+                    continue  # "turn the kitchen up in the office"
+                phrase = target  # "turn the kitchen up"
+            speakers = self.resolve_speakers(phrase, source_room)
+            step = VOLUME_STEP
+            if groups.get('by'):
+                step = parse_number(groups['by'])
+            elif groups.get('size'):
+                step = VOLUME_STEP_SMALL if re.fullmatch(SMALL_STEPS, groups['size'], re.I) else VOLUME_STEP_LARGE
+            if not speakers or step is None or not 0 < step <= 100:
+                continue
+            change = step if match.group('direction').lower() in LOUDER else -step
+            # Without a speaker named, "it" is the music of the room, which may be grouped with others
+            return {"speakers": speakers, "state": {"change": change, "follow_group": not phrase}}
+        return None
+
+    def _match_state_question(self, text, source_room):
+        reply_to = self.resolve_speakers('', source_room)
+        if not reply_to:
+            return None
+        for query, rules in (('now_playing', NOW_PLAYING_RULES), ('volume', VOLUME_QUERY_RULES)):
+            for rule in rules:
+                match = rule.match(text)
+                if not match:
+                    continue
+                phrase = match.group('speakers')
+                about = self.resolve_speakers(phrase, source_room)
+                if about:
+                    return {"speakers": reply_to,
+                            "state": {"query": query, "about": about, "follow_group": not phrase}}
+        return None
+
+    def _match_stop_speech(self, text, source_room):
+        match = STOP_SPEECH_RULE.match(text)
+        if not match:
+            return None
+        speakers = self.resolve_speakers(match.group('speakers'), source_room)
+        return {"speakers": speakers} if speakers else None
+
+    def _match_play_music(self, text, source_room):
+        match = PLAY_RULE.match(text)
+        if not match:
+            return None
+        rest = match.group('rest')
+        parameters = {}
+
+        # Peel "at 40 percent", "on spotify" and "in the kitchen" off the end, in any order
+        while True:
+            suffix = PLAY_VOLUME_SUFFIX.match(rest)
+            if suffix and 'volume' not in parameters:
+                volume = parse_number(suffix.group('volume'))
+                if volume is None or volume > 100:
+                    return None
+                parameters['volume'] = volume
+                rest = suffix.group('rest')
+                continue
+            suffix = PLAY_PLATFORM_SUFFIX.match(rest)
+            if suffix and 'platform' not in parameters:
+                parameters['platform'] = PLATFORMS[suffix.group('platform').lower()]
+                rest = suffix.group('rest')
+                continue
+            if 'speakers' not in parameters:
+                rest, speakers = self._split_speaker_suffix(rest, source_room)
+                if speakers:
+                    parameters['speakers'] = speakers
+                    continue
+            break
+
+        if 'speakers' not in parameters:
+            parameters['speakers'] = self.resolve_speakers('', source_room)
+            if not parameters['speakers']:
+                return None
+
+        for rule in PLAY_PLAYLIST:
+            what = rule.match(rest)
+            if what:
+                if what.group('playlist').lower() in VAGUE_NAMES:
+                    return None  # "play that playlist again" needs the conversation
+                parameters['playlist'] = what.group('playlist')
+                return parameters
+        what = PLAY_ARTIST_ONLY.match(rest)
+        if what:
+            parameters['artist'] = what.group('artist')
+            return parameters
+        what = PLAY_SONG_BY.match(rest)
+        if what:
+            if what.group('song').lower() in GENERIC_SONGS | VAGUE_NAMES:
+                return None
+            parameters['song'] = what.group('song')
+            parameters['artist'] = what.group('artist')
+            return parameters
+        # A bare "play jazz" could be a song, an artist or a genre: let the LLM decide
+        return None
+
+    def _split_speaker_suffix(self, text, source_room):
+        """Finds the shortest "in/on <speakers>" tail of `text` that names real speakers."""
+        lowered = text.lower()
+        if lowered.endswith(' everywhere'):
+            return text[:-len(' everywhere')], list(self.speakers)
+        positions = [m.start() for m in re.finditer(r" (?:in|on|to) ", lowered)]
+        for start in reversed(positions):
+            speakers = self.resolve_speakers(text[start + 4:], None)
+            if speakers:
+                return text[:start], speakers
+        return text, None
+
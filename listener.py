@@ -2,14 +2,22 @@
 
 import threading
 import time
+import selectors
 import numpy as np
-import openwakeword
-import pyaudio
-import speech_recognition as sr
-from openwakeword.model import Model
 from pathlib import Path
 import socket
-import audioop
+import queue
+
+from audio_codec import CODEC_NAMES, create_codec, negotiate_codec
+import backpressure
+from backpressure import RateLimiter
+from protocol import (ACK, CODEC_PCM16, PROTOCOL_MAGIC, AudioRingBuffer, FrameReader, RawStreamReader,
+                      is_framed_hello, pack_ack, unpack_hello)
+from metrics import metrics, start_metrics_reporter, startup
+from stt import STTError, create_stt_backend
+from tracing import Trace
+from vad import MAX_COMMAND_DURATION, NO_SPEECH_TIMEOUT, UtteranceSegmenter, VoiceActivityDetector
+from wake_word import WAKE_THRESHOLD, WakeEngineLoader, download_wake_word_models
 
 # --- CONFIGURATION ---
 SERVER_HOST = '0.0.0.0'  # Listen on all available network interfaces
@@ -18,56 +26,495 @@ SERVER_PORT = 12345      # The port for mic_clients to connect to
 # Audio stream settings (must match the client)
 AUDIO_RATE = 16000
 AUDIO_WIDTH = 2 # 2 bytes for paInt16 (16-bit audio)
-CHUNK_SIZE = 1280 # 80ms chunks for openWakeWord
+CHUNK_SIZE = 1280 # Samples per 80ms chunk for openWakeWord
+CHUNK_BYTES = CHUNK_SIZE * AUDIO_WIDTH
+CHUNK_SECONDS = CHUNK_SIZE / AUDIO_RATE
+
+# VAD settings (thresholds, timeouts, pre-roll) live in vad.py
+
+# Server mode: 'event' multiplexes every mic on one selector loop with a fixed
+# worker pool, 'sharded' is the event server with wake word inference spread over
+# worker processes (see sharded_listener.py), 'threaded' is the legacy
+# one-thread-per-mic ClientHandler server.
+LISTENER_MODE = 'event'
+STT_WORKER_THREADS = 4  # Worker pool size for command transcription
+MAX_PENDING_UTTERANCES = 32  # Commands waiting for an STT worker before new ones are dropped
+MAX_PENDING_FRAMES = 16  # Per-mic frames waiting for inference before the oldest are dropped
+HANDSHAKE_TIMEOUT = 5.0  # Seconds a new client has to send its whole HELLO (or mic ID)
+MAX_HANDSHAKE_BYTES = 1024  # A HELLO is at most a few hundred bytes
+
+# Wake word arbitration: mics in adjacent rooms that hear the same "hey jarvis"
+# within ARBITRATION_WINDOW of each other are grouped, and only the best of them
+# transcribes the command. The others go straight back to listening.
+WAKE_ARBITRATION = True
+ARBITRATION_WINDOW = 0.3  # Seconds between the first and the last detection of one wake word
+ARBITRATION_RANK = 'snr'  # 'snr' (wake word loudness above the mic's noise floor) or 'score' (model confidence)
+# Mics that can hear each other, by area: {"kitchen": "downstairs", "office": "upstairs", ...}.
+# Only detections in the same area are grouped; mics not listed all share one area.
+ARBITRATION_AREAS = {}
+# Per-mic rate limiting of wake words (see backpressure.py for the limits), so a
+# TV or a stuck mic cannot flood the STT workers and the command queue.
+MIC_RATE_LIMIT = True
+
+# --- COMMAND CAPTURE (VAD) ---
+
+class CommandCapture:
+    """
+    Collects the audio of a spoken command after the wake word, one chunk at a time.
+    The mic's VoiceActivityDetector decides where speech starts and ends (see vad.py);
+    the chunks just before the onset are kept as pre-roll so the first syllable
+    is not lost. Captured chunks are streamed to a TranscriptionJob as they arrive.
+
+    With a WakeClaim, the chunks are held back until the arbitration is decided:
+    if this mic wins, a job is started from `transcriber` and gets them all; if
+    another mic wins, the capture ends at once.
+    """
+    def __init__(self, mic_id, job=None, vad=None, claim=None, transcriber=None):
+        self.mic_id = mic_id
+        self.job = job
+        self.claim = claim
+        self.transcriber = transcriber
+        self.held = []  # Chunks captured while the claim is undecided
+        self.suppressed = False
+        self.started_at = time.monotonic()  # When the wake word was detected
+        self.segmenter = UtteranceSegmenter(vad or VoiceActivityDetector())
+
+    def feed(self, audio_chunk):
+        """Adds a chunk of audio. Returns True once the command has ended."""
+        if self.claim is not None and not self._arbitrate():
+            print(f"[{self.mic_id}] Another mic heard the wake word better. Ending capture.")
+            return True
+        was_started = self.segmenter.started
+        kept, ended = self.segmenter.feed(audio_chunk)
+        if self.segmenter.started and not was_started:
+            print(f"[{self.mic_id}] Speaking detected.")
+        for chunk in kept:
+            self._keep(chunk)
+
+        if ended:
+            reason = self.segmenter.end_reason
+            if reason == 'silence':
+                print(f"[{self.mic_id}] Silence detected. Ending capture.")
+            elif reason == 'no_speech':
+                print(f"[{self.mic_id}] No speech after wake word. Ending capture.")
+            else:
+                print(f"[{self.mic_id}] Maximum command length reached. Ending capture.")
+        return ended
+
+    def finish(self):
+        """Ends the capture; the STT worker then produces the final text."""
+        if self.claim is not None:
+            # Ended before the window did: settle the group with the mics that are in it
+            self._arbitrate(force=True)
+        if not self.suppressed:
+            metrics.record_latency('vad_capture', time.monotonic() - self.started_at)
+        if self.job is not None:
+            self.job.finish()
+
+    def _keep(self, audio_chunk):
+        if self.claim is not None:
+            self.held.append(audio_chunk.tobytes())
+        elif self.job is not None:
+            self.job.feed(audio_chunk.tobytes())
+
+    def _arbitrate(self, force=False):
+        """Settles the claim once its group is decided. Returns False if another mic won."""
+        won = self.claim.result(force)
+        if won is None:
+            return True
+        claim, self.claim = self.claim, None
+        if not won:
+            self.suppressed = True
+            self.held = []
+            return False
+        self.job = self.transcriber.begin(self.mic_id, claim.detected_at)
+        if self.job is not None:
+            self.job.trace.mark('arbitrated')
+            for chunk in self.held:
+                self.job.feed(chunk)
+        self.held = []
+        return True
+
+
+# --- WAKE WORD ARBITRATION ---
+
+class WakeClaim:
+    """One mic's wake word detection, waiting for the other mics of its group."""
+    def __init__(self, arbiter, group, mic_id, score, snr_db, detected_at):
+        self.arbiter = arbiter
+        self.group = group
+        self.mic_id = mic_id
+        self.score = score
+        self.snr_db = snr_db
+        self.detected_at = detected_at
+        self.won = None  # Set when the group is decided
+
+    def rank(self):
+        if ARBITRATION_RANK == 'score':
+            return (self.score, self.snr_db)
+        return (self.snr_db, self.score)
+
+    def result(self, force=False):
+        """True if this mic won, False if another one did, None while the group is still open."""
+        return self.arbiter.result(self, force)
+
+
+class WakeGroup:
+    def __init__(self, area, started_at):
+        self.area = area
+        self.started_at = started_at
+        self.claims = []
+        self.decided = False
+
+
+class WakeArbiter:
+    """
+    Groups wake word detections from different mics that fall within
+    ARBITRATION_WINDOW of each other: one "hey jarvis" heard in adjacent rooms.
+    Only the best mic of a group gets a transcription job, so the command is
+    transcribed, sent to the LLM and executed once instead of once per mic.
+
+    A detection opens a group or joins the open one. The group is decided by
+    the first claim that asks after the window has passed; captures ask on
+    every chunk, so the winner is known one chunk after the window at most.
+    A capture that ends sooner decides its group early.
+    """
+    def __init__(self, window=None, areas=None):
+        self.window = ARBITRATION_WINDOW if window is None else window
+        self.areas = ARBITRATION_AREAS if areas is None else areas
+        self.lock = threading.Lock()
+        self.open_groups = {}  # Area -> the WakeGroup still taking detections
+
+    def claim(self, mic_id, score, snr_db):
+        now = time.monotonic()
+        area = self.areas.get(mic_id)
+        with self.lock:
+            group = self.open_groups.get(area)
+            if group is None or group.decided or now - group.started_at > self.window:
+                group = self.open_groups[area] = WakeGroup(area, now)
+            claim = WakeClaim(self, group, mic_id, score, snr_db, now)
+            group.claims.append(claim)
+        return claim
+
+    def result(self, claim, force=False):
+        with self.lock:
+            group = claim.group
+            if not group.decided and (force or time.monotonic() - group.started_at >= self.window):
+                self._decide(group)
+            return claim.won
+
+    def _decide(self, group):
+        group.decided = True
+        if self.open_groups.get(group.area) is group:
+            del self.open_groups[group.area]
+        winner = max(group.claims, key=WakeClaim.rank)
+        for claim in group.claims:
+            claim.won = claim is winner
+        metrics.increment('wake_groups')
+        if len(group.claims) > 1:
+            losers = [claim.mic_id for claim in group.claims if claim is not winner]
+            metrics.increment('wake_suppressed', len(losers))
+            print(f"Wake arbitration: '{winner.mic_id}' (SNR {winner.snr_db:.0f} dB, score {winner.score:.2f}) "
+                  f"takes the command over {losers}.")
+
+
+def start_capture(mic_id, vad, transcriber, arbiter=None, score=1.0, rate_limiter=None):
+    """
+    The CommandCapture for a wake word just detected on `mic_id`, arbitrated if
+    there is an arbiter. None if the mic is over its rate limit.
+    """
+    if rate_limiter is not None and not rate_limiter.allow(mic_id):
+        metrics.increment('wake_rate_limited')
+        print(f"[{mic_id}] Too many wake words; ignoring this one.")
+        return None
+    if arbiter is None:
+        return CommandCapture(mic_id, transcriber.begin(mic_id), vad)
+    claim = arbiter.claim(mic_id, score, vad.recent_snr_db())
+    return CommandCapture(mic_id, vad=vad, claim=claim, transcriber=transcriber)
+
+
+# --- SPEECH-TO-TEXT WORKERS ---
+
+class TranscriptionJob:
+    """One utterance streaming from a CommandCapture to an STT worker."""
+    def __init__(self, mic_id, woke_at=None):
+        self.mic_id = mic_id
+        self.created_at = woke_at or time.monotonic()  # At wake word detection
+        self.ended_at = None  # At end of speech
+        self.trace = Trace(mic_id)  # Follows the command until its reply has been spoken
+        self.trace.mark('wake', self.created_at)
+        self.chunks = queue.SimpleQueue()
+        self._finished = False
+
+    def feed(self, pcm_bytes):
+        self.chunks.put(pcm_bytes)
+
+    def finish(self):
+        if not self._finished:
+            self._finished = True
+            self.ended_at = time.monotonic()
+            self.trace.mark('vad_end', self.ended_at)
+            self.chunks.put(None)
+
+
+class TranscriptionPool:
+    """
+    A fixed set of STT worker threads fed from a bounded job queue, so
+    transcription never blocks the threads that read audio from the mics.
+    A job is queued at wake word detection and its worker feeds the STT
+    backend while the command is still being captured, so streaming engines
+    have the text ready shortly after speech ends.
+    """
+    def __init__(self, command_queue, backend=None, workers=STT_WORKER_THREADS,
+                 max_pending=MAX_PENDING_UTTERANCES):
+        self.command_queue = command_queue
+        self.backend = backend or create_stt_backend()
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self.threads = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._worker, name=f"stt-worker-{i}", daemon=True)
+            worker.start()
+            self.threads.append(worker)
+        metrics.register_depth('stt_jobs', self.jobs.qsize)
+        print(f"STT backend: {self.backend.name}")
+
+    def begin(self, mic_id, woke_at=None):
+        """Starts a transcription job for a new command. Returns None if the pool is overloaded."""
+        job = TranscriptionJob(mic_id, woke_at)
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            metrics.increment('stt_jobs_dropped')
+            print(f"[{mic_id}] Transcription queue is full, dropping command.")
+            job.trace.end('stt_dropped')
+            return None
+        return job
+
+    def stop(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for worker in self.threads:
+            worker.join()
+        metrics.unregister_depth('stt_jobs')
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            metrics.record_latency('stt_queue_wait', time.monotonic() - job.created_at)
+            self._transcribe(job)
+
+    def _transcribe(self, job):
+        try:
+            stream = self.backend.start_stream()
+            got_audio = False
+            while True:
+                try:
+                    # The timeout only matters if a capture was abandoned without finish()
+                    chunk = job.chunks.get(timeout=MAX_COMMAND_DURATION + NO_SPEECH_TIMEOUT)
+                except queue.Empty:
+                    job.finish()
+                    break
+                if chunk is None:
+                    break
+                got_audio = True
+                partial = stream.accept_audio(chunk)
+                if partial:
+                    print(f"[{job.mic_id}] ... {partial}")
+
+            if not got_audio:
+                print(f"[{job.mic_id}] No command captured after wake word.")
+                job.trace.end('no_speech')
+                return
+
+            print(f"[{job.mic_id}] Transcribing audio...")
+            command_text = stream.finish()
+            done = time.monotonic()
+            job.trace.mark('stt', done)
+            metrics.record_latency('stt_final', done - job.ended_at)
+
+            if not command_text:
+                print(f"[{job.mic_id}] Could not understand audio after wake word.")
+                job.trace.end('not_understood')
+                return
+            queue_command(job.mic_id, command_text, self.command_queue, job.trace)
+            metrics.record_latency('wake_to_command', done - job.created_at)
+
+        except STTError as e:
+            print(f"[{job.mic_id}] {e}")
+            job.trace.end('stt_error')
+        except Exception as e:
+            print(f"An error occurred during transcription: {e}")
+            job.trace.end('stt_error')
+
+
+class Command:
+    """A transcribed command on its way from the listener to the command workers."""
+    def __init__(self, source_room, text, trace=None):
+        self.source_room = source_room
+        self.text = text
+        self.trace = trace or Trace(source_room)
+        # Counted from the end of speech (or the trace's origin without one): past it, the command is
+        # dropped unstarted. Not from the wake word, or a long command would expire while it was spoken
+        deadline = backpressure.COMMAND_DEADLINE
+        spoken_until = self.trace.marks.get('vad_end', self.trace.origin)
+        self.deadline = spoken_until + deadline if deadline else None
+        self.intent = None  # The local intent match, once the command processor has looked
+        self.intent_matched = False
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def tagged(self):
+        """The command as the LLM sees it: the message prefixed with the room it came from."""
+        return f"METADATA: {{source_room: '{self.source_room}'}} MESSAGE: {self.text}"
+
+    def __str__(self):
+        return self.tagged()
+
+
+def queue_command(mic_id, command_text, command_queue, trace=None):
+    """Puts a transcribed command, with its room and trace, into the shared queue."""
+    command = Command(mic_id, command_text, trace)
+    command.trace.mark('queued')
+    command_queue.put(command)
+
+
+class GatedSilence:
+    """
+    Puts back the silence a mic client's silence gate withheld (see mic_client.py).
+    While the gate is closed the client only sends keepalives, so a capture in
+    progress would never see the silence that ends it. On each keepalive during
+    a capture, the time since the last audio is written to the ring as silent
+    windows, and the capture's VAD and no-speech timeouts move on.
+    """
+    def __init__(self):
+        self.last_audio_at = time.monotonic()
+        self.keepalives = 0
+
+    def after_read(self, reader, capturing):
+        """Call after every reader.read(). Returns the number of silent windows written."""
+        keepalives = getattr(reader, 'keepalives', 0)  # Legacy raw streams are never gated
+        now = time.monotonic()
+        if keepalives == self.keepalives or not capturing:
+            self.keepalives = keepalives
+            self.last_audio_at = now
+            return 0
+        self.keepalives = keepalives
+        windows = min(int((now - self.last_audio_at) / CHUNK_SECONDS), MAX_PENDING_FRAMES)
+        if windows:
+            reader.ring.write(bytes(windows * CHUNK_BYTES))
+            metrics.increment('gated_silence_windows', windows)
+        self.last_audio_at = now if windows == MAX_PENDING_FRAMES else self.last_audio_at + windows * CHUNK_SECONDS
+        return windows
+
+
+def handshake_complete(data):
+    """
+    True once `data` holds a client's whole first message. A HELLO can arrive
+    split over several reads; a legacy mic ID is taken as it comes.
+    """
+    if len(data) > MAX_HANDSHAKE_BYTES:
+        raise ValueError(f"Handshake longer than {MAX_HANDSHAKE_BYTES} bytes")
+    if is_framed_hello(data):
+        return unpack_hello(data)[0] is not None
+    return not PROTOCOL_MAGIC.startswith(bytes(data))  # Maybe the start of a HELLO
+
+
+def receive_handshake(client_socket):
+    """Reads a client's first message from a blocking socket, waiting at most HANDSHAKE_TIMEOUT."""
+    client_socket.settimeout(HANDSHAKE_TIMEOUT)
+    data = b''
+    while not handshake_complete(data):
+        chunk = client_socket.recv(1024)
+        if not chunk:
+            raise ValueError("Disconnected during the handshake")
+        data += chunk
+    client_socket.settimeout(None)
+    return data
+
+
+def open_client_stream(handshake, ring=None):
+    """
+    Parses the first message from a mic client and sets up its audio buffer.
+    Framed clients open with a protocol HELLO and get a codec negotiated;
+    legacy clients just send their mic ID as text and then stream raw PCM.
+    The audio goes into `ring`, or a new AudioRingBuffer.
+
+    Returns:
+        tuple: (mic_id, reader for the rest of the stream, reply to send the client)
+    """
+    if ring is None:
+        ring = AudioRingBuffer(CHUNK_SIZE, MAX_PENDING_FRAMES + 1, AUDIO_WIDTH)
+
+    if not is_framed_hello(handshake):
+        return handshake.decode('utf-8', errors='replace'), RawStreamReader(ring), ACK
+
+    hello, _ = unpack_hello(handshake)
+    if hello is None:
+        raise ValueError("Incomplete protocol HELLO")
+    if hello['sample_rate'] != AUDIO_RATE:
+        raise ValueError(f"Unsupported sample rate {hello['sample_rate']}")
+
+    codec = negotiate_codec(hello['codec'])
+    decoder = None if codec == CODEC_PCM16 else create_codec(codec, AUDIO_RATE)
+    print(f"[{hello['mic_id']}] Streaming with codec '{CODEC_NAMES[codec]}'")
+    return hello['mic_id'], FrameReader(ring, codec, decoder), pack_ack(codec)
 
-# VAD Settings
-VAD_THRESHOLD = 600  # RMS volume threshold to start/stop recording. Adjust this for your mic sensitivity.
-VAD_SILENCE_TIMEOUT = 2.0  # Seconds of silence to wait before stopping recording.
 
 # --- PRODUCER: THE CLIENT HANDLER THREAD ---
 
 class ClientHandler(threading.Thread):
     """
     A "Producer" thread. Handles a single microphone client connection.
-    It receives raw audio, listens for a wake word, transcribes the command,
-    and puts the result into the shared queue.
+    It receives raw audio, listens for a wake word, captures the command and
+    hands it to the TranscriptionPool, which puts the result into the shared queue.
     """
-    def __init__(self, client_socket, address, command_queue, oww_model):
+    def __init__(self, client_socket, address, wake_engine, transcriber, arbiter=None, rate_limiter=None):
         super().__init__()
         self.client_socket = client_socket
         self.address = address
-        self.command_queue = command_queue
-        self.oww_model = oww_model
+        self.wake_engine = wake_engine
+        self.transcriber = transcriber
+        self.arbiter = arbiter
+        self.rate_limiter = rate_limiter
+        self.wake_stream = None
         self.is_running = True
-        self.recognizer = sr.Recognizer()
         self.mic_id = "Unknown"
+        self.reader = None
+        self.window = np.zeros(CHUNK_SIZE, dtype=np.int16)
+        self.vad = VoiceActivityDetector()
+        self.gated_silence = GatedSilence()
+        self.capturing = False
 
     def run(self):
         try:
-            # The first message from the client is its unique ID
-            self.mic_id = self.client_socket.recv(1024).decode('utf-8')
+            # The first message from the client is its unique ID (or a protocol HELLO)
+            self.mic_id, self.reader, reply = open_client_stream(receive_handshake(self.client_socket))
             print(f"[{self.mic_id}] Accepted connection from {self.address}")
+            self.wake_stream = self.wake_engine.create_stream(self.mic_id)
             
             # Send a confirmation byte to the client to start streaming
-            self.client_socket.sendall(b'\x01')
+            self.client_socket.sendall(reply)
 
             while self.is_running:
-                # Receive audio data from the client
-                audio_chunk = self.client_socket.recv(CHUNK_SIZE)
-                if not audio_chunk:
+                # Receive exactly one 80ms chunk from the client
+                if not self.read_chunk():
                     break # Client disconnected
 
-                audio_np = np.frombuffer(audio_chunk, dtype=np.int16)
+                self.wake_stream.add_audio(self.window)
+                self.vad.track_noise(self.window)
                 
-                prediction = self.oww_model.predict(audio_np)
+                scores = self.wake_engine.predict([self.wake_stream])
                 
-                if prediction['hey_jarvis_v0.1'] > 0.5:
+                if scores[self.wake_stream] > WAKE_THRESHOLD:
                     print(f"\n--- Wake Word Detected on [{self.mic_id}]! ---")
-                    # Pass the chunk that triggered the wake word to the transcriber
-                    self.transcribe_and_queue_command()
+                    # Capture the command; transcription happens on the STT workers
+                    self.capture_command(scores[self.wake_stream])
                     
-                    # FIX: Reset the model's internal state to prevent re-triggering
-                    self.oww_model.reset()
+                    # Reset this mic's wake word state to prevent re-triggering
+                    self.wake_stream.reset()
                     
                     print(f"[{self.mic_id}] Resuming wake word listening...")
 
@@ -79,73 +526,365 @@ class ClientHandler(threading.Thread):
             print(f"[{self.mic_id}] Closing connection.")
             self.client_socket.close()
 
-    def transcribe_and_queue_command(self):
-        try:
-            print(f"[{self.mic_id}] Capturing command (VAD enabled)...")
-            
-            command_audio_frames = []
-            is_speaking = False
-            silence_chunks = 0
-            max_silence_chunks = int(VAD_SILENCE_TIMEOUT * AUDIO_RATE / CHUNK_SIZE)
+    def capture_command(self, score=1.0):
+        print(f"[{self.mic_id}] Capturing command (VAD enabled)...")
+        capture = start_capture(self.mic_id, self.vad, self.transcriber, self.arbiter, score,
+                                self.rate_limiter)
+        if capture is None:
+            return
 
-            while True:
-                audio_chunk = self.client_socket.recv(CHUNK_SIZE)
-                if not audio_chunk:
+        self.capturing = True
+        try:
+            while self.read_chunk():
+                if capture.feed(self.window):
                     break
-                
-                # Calculate the volume (RMS) of the chunk
-                rms = audioop.rms(audio_chunk, AUDIO_WIDTH)
-
-                if rms > VAD_THRESHOLD:
-                    # If sound is detected, start recording and reset silence counter
-                    if not is_speaking:
-                        print(f"[{self.mic_id}] Speaking detected.")
-                        is_speaking = True
-                    command_audio_frames.append(audio_chunk)
-                    silence_chunks = 0
-                elif is_speaking:
-                    # If we were recording but are now in silence
-                    silence_chunks += 1
-                    command_audio_frames.append(audio_chunk) # Also capture the silence
-                    if silence_chunks > max_silence_chunks:
-                        print(f"[{self.mic_id}] Silence detected. Ending capture.")
-                        break
-            
-            if not command_audio_frames:
-                print(f"[{self.mic_id}] No command captured after wake word.")
-                return
+        except OSError as e:
+            print(f"[{self.mic_id}] Connection error during capture: {e}")
+        finally:
+            self.capturing = False
+            capture.finish()
+
+    def read_chunk(self):
+        """Fills self.window with the next 80ms of audio. Returns False on disconnect."""
+        ring = self.reader.ring
+        while not ring.pop_into(self.window):
+            if self.reader.read(self.client_socket) == 0:
+                return False
+            self.gated_silence.after_read(self.reader, self.capturing)
+        return True
+
+    def stop(self):
+        self.is_running = False
+
+# --- PRODUCER: THE EVENT-LOOP LISTENER SERVER ---
 
-            full_command_audio = b''.join(command_audio_frames)
-            audio_data = sr.AudioData(full_command_audio, AUDIO_RATE, AUDIO_WIDTH)
+class MicConnection:
+    """
+    Per-mic state for the event-loop server. The selector thread receives audio
+    straight into the mic's ring buffer; the inference thread takes one exact
+    80ms window per mic per tick, so each mic's audio is processed in order.
+    """
+    def __init__(self, client_socket, address):
+        self.client_socket = client_socket
+        self.address = address
+        self.mic_id = None
+        self.reader = None
+        self.handshake = b''  # The first message so far, until it is complete
+        self.connected_at = time.monotonic()
+        self.window = np.zeros(CHUNK_SIZE, dtype=np.int16)
+        self.wake_stream = None
+        self.vad = VoiceActivityDetector()
+        self.capture = None
+        self.gated_silence = GatedSilence()
+
+    @property
+    def dropped_frames(self):
+        """Windows dropped because inference fell behind, plus frames lost on the wire."""
+        if self.reader is None:
+            return 0
+        return self.reader.ring.dropped_windows + self.reader.lost_frames
+
+
+class EventListenerServer:
+    """
+    Accepts every mic_client connection on a single non-blocking selector loop.
+    Audio is split into exact CHUNK_SIZE windows per client. One inference thread runs
+    the wake word model and VAD for all mics in batched ticks, and a fixed
+    TranscriptionPool transcribes captured commands, so the thread count stays
+    the same no matter how many mics are connected.
+
+    `wake_engine` may be a WakeEngineLoader still loading the model: mics are
+    accepted right away and their wake word streams are created once it is ready.
+    """
+    def __init__(self, command_queue, wake_engine, host=SERVER_HOST, port=SERVER_PORT,
+                 workers=STT_WORKER_THREADS, stt_backend=None):
+        self.command_queue = command_queue
+        self.engine_loader = wake_engine if isinstance(wake_engine, WakeEngineLoader) else None
+        self.wake_engine = None if self.engine_loader is not None else wake_engine
+        self.host = host
+        self.port = port
+        self.selector = selectors.DefaultSelector()
+        self.transcriber = TranscriptionPool(command_queue, stt_backend, workers=workers)
+        self.arbiter = WakeArbiter() if WAKE_ARBITRATION else None
+        self.rate_limiter = RateLimiter() if MIC_RATE_LIMIT else None
+        self.connections = {}
+        self.connections_lock = threading.Lock()
+        self.closed = []  # Disconnected mics whose capture the inference thread still has to end
+        self.frames_ready = threading.Event()
+        self.inference_thread = None
+        self.is_running = False
+        self.server_socket = None
+        # A socket pair lets stop() wake the selector from another thread
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
 
-            print(f"[{self.mic_id}] Transcribing audio...")
-            command_text = self.recognizer.recognize_google(audio_data)
-            tagged_message = f"METADATA: {{source_room: '{self.mic_id}'}} MESSAGE: {command_text}"
-            self.command_queue.put(tagged_message)
+    def bind(self):
+        """Creates the listening socket. Returns the (host, port) actually bound."""
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(128)
+        self.server_socket.setblocking(False)
+        self.selector.register(self.server_socket, selectors.EVENT_READ, None)
+        self._wakeup_recv.setblocking(False)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ, None)
+        return self.server_socket.getsockname()
 
-        except sr.UnknownValueError:
-            print(f"[{self.mic_id}] Could not understand audio after wake word.")
-        except sr.RequestError as e:
-            print(f"[{self.mic_id}] STT service error; {e}")
+    def serve_forever(self):
+        """The selector loop. Runs until stop() is called."""
+        if self.server_socket is None:
+            self.bind()
+        startup.milestone('accepting mics')
+        self.is_running = True
+        metrics.register_depth('mic_audio_windows', self.pending_windows)
+        self.inference_thread = threading.Thread(target=self._inference_loop, name="wake-inference", daemon=True)
+        self.inference_thread.start()
+        try:
+            while self.is_running:
+                for key, _ in self.selector.select(timeout=1.0):
+                    if key.fileobj is self.server_socket:
+                        self._accept()
+                    elif key.fileobj is self._wakeup_recv:
+                        self._wakeup_recv.recv(64)
+                    else:
+                        self._read(key.data)
+                self._expire_handshakes()
         except Exception as e:
-            print(f"An error occurred during transcription: {e}")
+            print(f"Server error: {e}")
+        finally:
+            self._shutdown()
 
     def stop(self):
         self.is_running = False
+        try:
+            self._wakeup_send.send(b'\x00')
+        except OSError:
+            pass
+
+    def pending_windows(self):
+        """Audio windows received from all mics that inference has not reached yet."""
+        with self.connections_lock:
+            connections = list(self.connections.values())
+        return sum(len(conn.reader.ring) for conn in connections if conn.reader is not None)
+
+    def _accept(self):
+        try:
+            client_socket, address = self.server_socket.accept()
+        except BlockingIOError:
+            return
+        client_socket.setblocking(False)
+        conn = MicConnection(client_socket, address)
+        with self.connections_lock:
+            self.connections[client_socket.fileno()] = conn
+        self.selector.register(client_socket, selectors.EVENT_READ, conn)
+
+    def _read(self, conn):
+        if conn.reader is None:
+            self._handshake(conn)
+            return
+
+        try:
+            n = conn.reader.read(conn.client_socket)
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, ValueError) as e:
+            print(f"[{conn.mic_id}] Stream error: {e}")
+            n = 0
+
+        if n == 0:
+            self._close(conn)
+            return
+        conn.gated_silence.after_read(conn.reader, conn.capture is not None)
+        if len(conn.reader.ring):
+            self._frames_received(conn)
+
+    def _handshake(self, conn):
+        try:
+            # The first message from the client is its unique ID (or a protocol HELLO)
+            data = conn.client_socket.recv(1024)
+            if not data:
+                self._close(conn)
+                return
+            conn.handshake += data
+            if not handshake_complete(conn.handshake):
+                return  # The rest of a split HELLO comes with the next read
+            conn.mic_id, conn.reader, reply = open_client_stream(conn.handshake, self._create_ring(conn))
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, ValueError) as e:
+            print(f"Rejected client at {conn.address}: {e}")
+            self._close(conn)
+            return
+
+        self._stream_opened(conn)
+        print(f"[{conn.mic_id}] Accepted connection from {conn.address}")
+        # Send a confirmation byte to the client to start streaming
+        conn.client_socket.sendall(reply)
+
+    def _expire_handshakes(self):
+        """Drops clients that connected but never finished their HELLO."""
+        now = time.monotonic()
+        with self.connections_lock:
+            stalled = [conn for conn in self.connections.values()
+                       if conn.reader is None and now - conn.connected_at > HANDSHAKE_TIMEOUT]
+        for conn in stalled:
+            print(f"Rejected client at {conn.address}: no complete handshake within {HANDSHAKE_TIMEOUT:g} s")
+            self._close(conn)
+
+    # Hooks for the sharded server (sharded_listener.py), which runs inference in other processes
+
+    def _create_ring(self, conn):
+        """The ring buffer for a new mic's audio; None lets open_client_stream() make one."""
+        return None
+
+    def _stream_opened(self, conn):
+        with self.connections_lock:
+            if self.wake_engine is not None:  # Otherwise _await_engine() creates it
+                conn.wake_stream = self.wake_engine.create_stream(conn.mic_id)
+
+    def _frames_received(self, conn):
+        self.frames_ready.set()
+
+    def _inference_loop(self):
+        """
+        Runs on its own thread. Each tick takes the oldest pending frame of every
+        mic and runs the wake word model once for all of them.
+        """
+        if self.wake_engine is None and self.engine_loader is not None and not self._await_engine():
+            return
+        while self.is_running:
+            if not self.frames_ready.wait(timeout=1.0):
+                continue
+            self.frames_ready.clear()
+            try:
+                self._finish_closed()
+                while self._inference_tick():
+                    pass
+            except Exception as e:
+                print(f"Error in wake word inference: {e}")
+
+    def _await_engine(self):
+        """Waits for the wake word model to load. Returns False if it failed or the server stopped first."""
+        while self.is_running:
+            try:
+                engine = self.engine_loader.result(timeout=1.0)
+            except TimeoutError:
+                continue
+            except Exception:
+                return False  # The loader has said why
+            with self.connections_lock:
+                self.wake_engine = engine
+                # Mics that connected while the model loaded
+                for conn in self.connections.values():
+                    if conn.reader is not None and conn.wake_stream is None:
+                        conn.wake_stream = engine.create_stream(conn.mic_id)
+            return True
+        return False
+
+    def _inference_tick(self):
+        """Processes at most one frame per mic. Returns False when nothing was pending."""
+        with self.connections_lock:
+            connections = list(self.connections.values())
+
+        took_frame = False
+        batch = []
+        for conn in connections:
+            if conn.reader is None or not conn.reader.ring.pop_into(conn.window):
+                continue
+            took_frame = True
+
+            if conn.capture is not None:
+                self._feed_capture(conn, conn.window)
+                continue
+
+            conn.wake_stream.add_audio(conn.window)
+            conn.vad.track_noise(conn.window)
+            batch.append(conn)
+
+        if batch:
+            started = time.monotonic()
+            scores = self.wake_engine.predict([conn.wake_stream for conn in batch])
+            metrics.record_latency('wake_inference', time.monotonic() - started)
+            metrics.increment('wake_frames', len(batch))
+            for conn in batch:
+                if scores[conn.wake_stream] > WAKE_THRESHOLD:
+                    # Reset this mic's wake word state to prevent re-triggering
+                    conn.wake_stream.reset()
+                    print(f"\n--- Wake Word Detected on [{conn.mic_id}]! ---")
+                    print(f"[{conn.mic_id}] Capturing command (VAD enabled)...")
+                    conn.capture = start_capture(conn.mic_id, conn.vad, self.transcriber, self.arbiter,
+                                                 scores[conn.wake_stream], self.rate_limiter)
+        return took_frame
+
+    def _feed_capture(self, conn, audio_chunk):
+        if not conn.capture.feed(audio_chunk):
+            return
+        conn.capture.finish()
+        conn.capture = None
+        print(f"[{conn.mic_id}] Resuming wake word listening...")
+
+    def _close(self, conn):
+        print(f"[{conn.mic_id}] Closing connection.")
+        with self.connections_lock:
+            self.connections.pop(conn.client_socket.fileno(), None)
+        try:
+            self.selector.unregister(conn.client_socket)
+        except (KeyError, ValueError):
+            pass
+        conn.client_socket.close()
+        # The inference thread may be feeding this mic's capture right now, so it ends it on its next pass.
+        # The ring needs no clearing: it goes with the connection (a shard slot is reset when reused)
+        with self.connections_lock:
+            self.closed.append(conn)
+        self.frames_ready.set()
+
+    def _finish_closed(self):
+        """Ends the captures of mics that disconnected. Runs on the inference thread, which feeds them."""
+        with self.connections_lock:
+            closed, self.closed = self.closed, []
+        for conn in closed:
+            if conn.capture is not None:
+                conn.capture.finish()
+                conn.capture = None
+
+    def _shutdown(self):
+        print("Shutting down listener server.")
+        self.is_running = False
+        with self.connections_lock:
+            connections = list(self.connections.values())
+        for conn in connections:
+            self._close(conn)
+        if self.inference_thread is not None:
+            self.frames_ready.set()
+            self.inference_thread.join()
+        self._finish_closed()  # The inference thread has stopped; whatever it left is ours now
+        self.transcriber.stop()
+        metrics.unregister_depth('mic_audio_windows')
+        if self.server_socket is not None:
+            self.selector.unregister(self.server_socket)
+            self.server_socket.close()
+        self.selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
 
 # --- SERVICE STARTER FUNCTION ---
 
 def start_listening_service(command_queue):
     """
-    Initializes the wake word model and starts the TCP server to listen for mic clients.
+    Starts loading the wake word model and starts the TCP server to listen for mic clients.
+    The server accepts mics while the model loads and warms up in the background.
     Returns the main server thread so it can be managed.
     """
-    print("Downloading wake word models (if necessary)...")
-    openwakeword.utils.download_models()
-    oww_model = Model(wakeword_models=['hey_jarvis_v0.1'])
+    with startup.step('wake model cache'):
+        download_wake_word_models()  # Only when they are not cached yet
+    # Each shard process loads its own model
+    wake_engine = None if LISTENER_MODE == 'sharded' else WakeEngineLoader()
+    with startup.step('stt backend'):
+        stt_backend = create_stt_backend()
+    metrics.register_depth('command_queue', command_queue.qsize)
+    start_metrics_reporter()
 
     # Create a new thread for the server itself
-    server_thread = threading.Thread(target=run_server, args=(command_queue, oww_model))
+    server_thread = threading.Thread(target=run_server, args=(command_queue, wake_engine, stt_backend))
     # FIX: Set the thread as a daemon thread
     server_thread.daemon = True
     server_thread.start()
@@ -155,14 +894,31 @@ def start_listening_service(command_queue):
     return None
 
 
-def run_server(command_queue, oww_model):
+def run_server(command_queue, wake_engine, stt_backend=None):
     """The main loop for the TCP server."""
+    if LISTENER_MODE == 'event':
+        EventListenerServer(command_queue, wake_engine, stt_backend=stt_backend).serve_forever()
+    elif LISTENER_MODE == 'sharded':
+        from sharded_listener import ShardedListenerServer  # It builds on this module
+        ShardedListenerServer(command_queue, stt_backend=stt_backend).serve_forever()
+    else:
+        run_threaded_server(command_queue, wake_engine, stt_backend)
+
+
+def run_threaded_server(command_queue, wake_engine, stt_backend=None):
+    """The legacy server loop: one ClientHandler thread per mic connection."""
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_socket.bind((SERVER_HOST, SERVER_PORT))
     server_socket.listen(5) # Allow up to 5 pending connections
+    if isinstance(wake_engine, WakeEngineLoader):
+        wake_engine = wake_engine.result()  # Mics wait in the listen backlog meanwhile
+    startup.milestone('accepting mics')
 
     client_threads = []
+    transcriber = TranscriptionPool(command_queue, stt_backend)
+    arbiter = WakeArbiter() if WAKE_ARBITRATION else None
+    rate_limiter = RateLimiter() if MIC_RATE_LIMIT else None
 
     try:
         while True:
@@ -170,9 +926,11 @@ def run_server(command_queue, oww_model):
             client_socket, address = server_socket.accept()
             
             # Create and start a new thread for each connecting client
-            handler = ClientHandler(client_socket, address, command_queue, oww_model)
+            handler = ClientHandler(client_socket, address, wake_engine, transcriber, arbiter, rate_limiter)
             handler.daemon = True
             handler.start()
+            # Forget handlers whose mic has disconnected
+            client_threads = [t for t in client_threads if t.is_alive()]
             client_threads.append(handler)
 
     except Exception as e:
@@ -182,4 +940,5 @@ def run_server(command_queue, oww_model):
         for t in client_threads:
             t.stop()
             t.join()
+        transcriber.stop()
         server_socket.close()
@@ -0,0 +1,297 @@
+# llm_stream.py
+#
+# Acting on the LLM's JSON reply while it is still streaming in. The reply is
+# parsed one token at a time, so:
+#   - setVolume (and anything else in Dispatcher.EARLY_DISPATCH) runs as soon as
+#     its parameters are complete,
+#   - other functions run the moment the "parameters" object closes,
+#   - makeSpeech's message is spoken sentence by sentence while the rest of the
+#     answer is still being generated.
+
+import json
+import re
+import time
+
+from metrics import metrics
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_LITERAL_CHARS = set('0123456789+-.eEtruefalsn')
+
+
+class IncrementalJSONParser:
+    """
+    A streaming JSON parser. feed() takes any slice of the document and returns
+    the events it completed:
+
+        ('value', path, value)   a value (scalar, array or object) is complete
+        ('text', path, text)     more characters of a string that is still open
+
+    `path` is the tuple of keys/indexes leading to the value; the whole
+    document is the value at path (). Raises ValueError on malformed JSON.
+    """
+    def __init__(self):
+        self.stack = []  # [container, key] for every open object/array
+        self.state = 'value'
+        self.chars = []  # The string or literal being read
+        self.string_is_key = False
+        self.escape = None  # None, '' right after a backslash, or 'u' + hex digits
+        self.sent_chars = 0  # How much of the open string was already sent as 'text'
+        self.done = False
+
+    def feed(self, text):
+        events = []
+        for c in text:
+            self._feed_char(c, events)
+        if self.state == 'string' and not self.string_is_key and len(self.chars) > self.sent_chars:
+            events.append(('text', self._path(), ''.join(self.chars[self.sent_chars:])))
+            self.sent_chars = len(self.chars)
+        return events
+
+    def _path(self):
+        return tuple(key if isinstance(container, dict) else len(container)
+                     for container, key in self.stack)
+
+    def _feed_char(self, c, events):
+        state = self.state
+        if state == 'string':
+            self._string_char(c, events)
+            return
+        if state == 'literal':
+            if c in _LITERAL_CHARS:
+                self.chars.append(c)
+                return
+            literal = ''.join(self.chars)
+            try:
+                value = json.loads(literal)
+            except json.JSONDecodeError:
+                raise ValueError(f"Invalid JSON literal '{literal}'") from None
+            self._emit(value, events)
+            state = self.state
+        if c in ' \t\r\n' or state == 'done':
+            return
+
+        if state == 'value':
+            if c == '{':
+                self.stack.append([{}, None])
+                self.state = 'key'
+            elif c == '[':
+                self.stack.append([[], None])
+                self.state = 'value'
+            elif c == ']' and self.stack and self.stack[-1][0] == []:
+                self._close(events)
+            elif c == '"':
+                self._start_string(is_key=False)
+            elif c in _LITERAL_CHARS:
+                self.chars = [c]
+                self.state = 'literal'
+            else:
+                raise ValueError(f"Unexpected '{c}' where a JSON value should be")
+        elif state == 'key':
+            if c == '"':
+                self._start_string(is_key=True)
+            elif c == '}' and not self.stack[-1][0]:
+                self._close(events)
+            else:
+                raise ValueError(f"Unexpected '{c}' where an object key should be")
+        elif state == 'colon':
+            if c != ':':
+                raise ValueError(f"Expected ':' but got '{c}'")
+            self.state = 'value'
+        elif state == 'after':
+            container = self.stack[-1][0]
+            if c == ',':
+                self.state = 'key' if isinstance(container, dict) else 'value'
+            elif c == ('}' if isinstance(container, dict) else ']'):
+                self._close(events)
+            else:
+                raise ValueError(f"Unexpected '{c}' after a JSON value")
+
+    def _start_string(self, is_key):
+        self.state = 'string'
+        self.string_is_key = is_key
+        self.chars = []
+        self.sent_chars = 0
+
+    def _string_char(self, c, events):
+        if self.escape is None:
+            if c == '\\':
+                self.escape = ''
+            elif c == '"':
+                self._end_string(events)
+            else:
+                self.chars.append(c)
+        elif self.escape == '':
+            if c == 'u':
+                self.escape = 'u'
+            elif c in _ESCAPES:
+                self.chars.append(_ESCAPES[c])
+                self.escape = None
+            else:
+                raise ValueError(f"Invalid escape '\\{c}'")
+        else:
+            self.escape += c
+            if len(self.escape) == 5:
+                self.chars.append(chr(int(self.escape[1:], 16)))
+                self.escape = None
+
+    def _end_string(self, events):
+        value = ''.join(self.chars)
+        if self.string_is_key:
+            self.stack[-1][1] = value
+            self.state = 'colon'
+            return
+        if len(self.chars) > self.sent_chars:
+            events.append(('text', self._path(), value[self.sent_chars:]))
+        self._emit(value, events)
+
+    def _close(self, events):
+        container, _ = self.stack.pop()
+        self._emit(container, events)
+
+    def _emit(self, value, events):
+        self.chars = []
+        if not self.stack:
+            events.append(('value', (), value))
+            self.state = 'done'
+            self.done = True
+            return
+        path = self._path()
+        container, key = self.stack[-1]
+        if isinstance(container, dict):
+            container[key] = value
+        else:
+            container.append(value)
+        events.append(('value', path, value))
+        self.state = 'after'
+
+
+class SentenceSplitter:
+    """Cuts streamed text into sentences as soon as each one is complete."""
+    SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+')
+    ABBREVIATIONS = {'mr', 'mrs', 'ms', 'dr', 'st', 'vs', 'jr', 'sr', 'no', 'e.g', 'i.e', 'etc'}
+
+    def __init__(self):
+        self.buffer = ''
+
+    def feed(self, text):
+        """Returns the sentences completed by `text`."""
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in self.SENTENCE_END.finditer(self.buffer):
+            sentence = self.buffer[start:match.end()].strip()
+            last_word = sentence.rstrip('.!?"\')]').rsplit(None, 1)[-1].lower() if sentence else ''
+            if last_word in self.ABBREVIATIONS:
+                continue
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Returns whatever is left once the text has ended, or None."""
+        rest, self.buffer = self.buffer.strip(), ''
+        return rest or None
+
+
+class StreamingCommandHandler:
+    """
+    Receives the LLM reply token by token and drives the Dispatcher from it.
+    Create one per request, feed() every content delta, then call finish().
+    """
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.parser = IncrementalJSONParser()
+        self.splitter = SentenceSplitter()
+        self.started_at = time.monotonic()
+        self.first_action_at = None
+        self.function = None
+        self.parameters = {}
+        self.dispatched = False
+        self.pending_sentences = []
+        self.speech = None
+        self.error = None
+
+    def feed(self, text):
+        if self.error is not None:
+            return
+        try:
+            events = self.parser.feed(text)
+        except ValueError as e:
+            self.error = e
+            print(f"Error: LLM stream is not valid JSON ({e}).")
+            return
+        for kind, path, value in events:
+            if kind == 'text':
+                if path == ('parameters', 'message'):
+                    self.pending_sentences.extend(self.splitter.feed(value))
+            elif path == ('function',):
+                self.function = value
+            elif len(path) == 2 and path[0] == 'parameters':
+                self.parameters[path[1]] = value
+                if path[1] == 'message':
+                    rest = self.splitter.flush()
+                    if rest:
+                        self.pending_sentences.append(rest)
+            elif path == ('parameters',):
+                self._dispatch()
+        self._dispatch_early()
+
+    def finish(self):
+        """
+        Completes the command once the stream has ended.
+
+        Returns:
+            bool: False if nothing was dispatched because the reply never
+                  became a usable command.
+        """
+        rest = self.splitter.flush()
+        if rest:
+            self.pending_sentences.append(rest)
+        if self.function == 'makeSpeech' and (self.speech is not None or self.pending_sentences):
+            self._start_speech(force=True)
+            self.speech.close()
+            return True
+        if not self.dispatched:
+            if self.error is None and not self.parser.done:
+                print("Error: LLM stream ended before the JSON object was complete.")
+            return False
+        return True
+
+    def _dispatch_early(self):
+        if self.dispatched or self.function is None:
+            return
+        if self.function == 'makeSpeech':
+            self._start_speech()
+            return
+        required = self.dispatcher.EARLY_DISPATCH.get(self.function)
+        if required and all(name in self.parameters for name in required):
+            self._dispatch()
+
+    def _dispatch(self):
+        if self.dispatched or self.function is None:
+            return
+        if self.function == 'makeSpeech' and (self.speech is not None or self.pending_sentences):
+            self._start_speech(force=True)
+            return
+        self.dispatched = True
+        self._record_first_action()
+        self.dispatcher.execute(self.function, dict(self.parameters))
+
+    def _start_speech(self, force=False):
+        """Speaks the finished sentences once the target speakers are known (or `force`)."""
+        if self.speech is None:
+            if not self.pending_sentences or not (force or 'speakers' in self.parameters):
+                return
+            self.dispatched = True
+            self._record_first_action()
+            self.speech = self.dispatcher.begin_speech(dict(self.parameters))
+        for sentence in self.pending_sentences:
+            self.speech.say(sentence)
+        self.pending_sentences = []
+
+    def _record_first_action(self):
+        if self.first_action_at is None:
+            self.first_action_at = time.monotonic()
+            metrics.record_latency('llm_first_action', self.first_action_at - self.started_at)
@@ -1,31 +1,40 @@
 
+import time
+STARTED_AT = time.monotonic()  # Before the imports, which are part of the startup time
+
 import json
-import queue
 import os
 import threading
-import time
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
-from openai import OpenAI
 
+from backpressure import MAX_PENDING_PER_ROOM, CommandQueue, coalesce_key, drop_command
+from device_state import DeviceStateStore, needs_state
 from dispatcher import Dispatcher
 from listener import start_listening_service
+from intents import IntentMatcher
+from llm_stream import StreamingCommandHandler
+from metrics import metrics, startup
+from prompt_builder import PromptBuilder
+from response_cache import ResponseCache, awaits_answer, openai_embedder
+import tracing
+
+# --- CONFIGURATION ---
+LLM_MODEL = "gpt-4o"  # Using a modern and capable model
+LLM_STREAMING = True  # Parse the reply while it streams and start actions before it is complete
+MAX_CONCURRENT_COMMANDS = 4  # Commands (from different rooms) processed at the same time
+LLM_TIMEOUT = 30.0  # Seconds before an LLM request is abandoned
+LOCAL_INTENTS = True  # Handle common commands with intents.py rules instead of the LLM
+RESPONSE_CACHE = True  # Reuse LLM replies for repeated commands (see response_cache.py)
+RESPONSE_CACHE_EMBEDDINGS = False  # Also match paraphrases via OpenAI embeddings (one extra API call per miss)
+DEVICE_STATE_CONTEXT = True  # Show the LLM the speakers' state when a command mentions the music or volume
 
 # --- INITIAL SETUP ---
-def get_system_prompt():
-    """
-    Loads the entire system prompt from a single file.
-    This file should contain the role description, rules, and the full API spec.
-    """
-    try:
-        with open('system_prompt.txt', 'r') as f:
-            # add live context
-            prompt = f.read() +  f"\n\n--- LIVE CONTEXT ---\nCurrent Date and Time: {datetime.now().strftime('%A, %B %d, %Y %I:%M %p')}"
-            return prompt
-    except FileNotFoundError:
-        raise FileNotFoundError("Error: 'system_prompt.txt' not found.")
-    
+# Loads system_prompt.txt once (and again only when it changes) and builds each request's messages
+prompt_builder = PromptBuilder()
+
 
 # --- CORE LOGIC ---
 def get_llm_response(client, conversation_history):
@@ -35,12 +44,13 @@ def get_llm_response(client, conversation_history):
     try:
         print("\nSending request to LLM...")
         response = client.chat.completions.create(
-            model="gpt-4o",  # Using a modern and capable model
+            model=LLM_MODEL,
             messages=conversation_history,
             max_tokens=500, # Max tokens for the response
             temperature=0.2, # Lower temperature for more deterministic, command-like responses
             response_format={"type": "json_object"} # Enforce JSON output
         )
+        record_usage(getattr(response, 'usage', None))
         # The response content is a string containing the JSON
         return response.choices[0].message.content
     except Exception as e:
@@ -48,12 +58,64 @@ def get_llm_response(client, conversation_history):
         return None
 
 
+def record_usage(usage):
+    """Counts the prompt tokens the API billed, and how many it served from its prefix cache."""
+    if usage is None:
+        return
+    metrics.increment('llm_billed_prompt_tokens', usage.prompt_tokens)
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = getattr(details, 'cached_tokens', None) or 0
+    metrics.increment('llm_cached_prompt_tokens', cached)
+    print(f"LLM usage: {usage.prompt_tokens} prompt tokens ({cached} cached), "
+          f"{usage.completion_tokens} completion tokens")
+
+
+def stream_llm_response(client, conversation_history, handler):
+    """
+    Same request as get_llm_response, but streamed: every piece of the reply is
+    passed to `handler` (a StreamingCommandHandler) as soon as it arrives.
+
+    Returns:
+        str or None: The complete reply, for the conversation history.
+    """
+    try:
+        print("\nSending streaming request to LLM...")
+        started = time.monotonic()
+        stream = client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=conversation_history,
+            max_tokens=500,
+            temperature=0.2,
+            response_format={"type": "json_object"},
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        parts = []
+        for chunk in stream:
+            if not chunk.choices:
+                # The last chunk carries the token usage and no content
+                record_usage(getattr(chunk, 'usage', None))
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not parts:
+                    metrics.record_latency('llm_first_token', time.monotonic() - started)
+                parts.append(delta)
+                handler.feed(delta)
+        metrics.record_latency('llm_response', time.monotonic() - started)
+        return ''.join(parts)
+    except Exception as e:
+        print(f"An error occurred with the LLM API call: {e}")
+        return None
+
+
 def parse_and_execute(command_json_str, dispatcher):
     """
     Parses the JSON response from the LLM and "executes" the command.
     """
     try:
         command_data = json.loads(command_json_str)
+        tracing.mark('parsed')
 
         if "function" in command_data and "parameters" in command_data:
             dispatcher.execute( command_data["function"], command_data["parameters"])
@@ -63,54 +125,311 @@ def parse_and_execute(command_json_str, dispatcher):
         print(f"Error: LLM did not return a valid JSON object. Response was:\n{command_json_str}")
 
 
-def command_consumer_thread(command_queue, dispatcher, openai_client):
+def match_intent(command, intent_matcher):
+    """The local intent match of a command (or None), matched once: submit() needs it to coalesce."""
+    if not command.intent_matched:
+        started = time.monotonic()
+        command.intent = intent_matcher.match(command.text, command.source_room)
+        metrics.record_latency('intent_match', time.monotonic() - started)
+        command.intent_matched = True
+    return command.intent
+
+
+def try_local_intent(command, conversation_history, dispatcher, intent_matcher):
+    """
+    Executes the command directly if the local intent rules are confident about it.
+    The match is added to the history as if the LLM had answered, so follow-up
+    questions still have the context. Returns True if the command was handled.
+    """
+    matched = match_intent(command, intent_matcher)
+    if matched is not None and 'state' in matched:
+        # "Turn it up a bit", "what's playing": answered from what the speakers are doing now
+        matched = dispatcher.state.resolve(matched)
+    if matched is None:
+        metrics.increment('intent_llm_fallback')
+        return False
+
+    metrics.increment('intent_fast_path')
+    command.trace.annotate(route='intent')
+    command.trace.mark('resolved')
+    command.trace.mark('parsed')
+    print(f"Local intent match, skipping the LLM: {matched}")
+    dispatcher.execute(matched["function"], matched["parameters"])
+    conversation_history.append({"role": "user", "content": command.tagged()})
+    conversation_history.append({"role": "assistant", "content": json.dumps(matched)})
+    return True
+
+
+def try_cached_response(command, conversation_history, dispatcher, response_cache):
+    """Executes a cached LLM reply for a repeated command. Returns True on a cache hit."""
+    cached = response_cache.lookup(command.text, command.source_room)
+    if cached is None:
+        return False
+    command.trace.annotate(route='cache')
+    command.trace.mark('resolved')
+    print("Response cache hit, skipping the LLM.")
+    parse_and_execute(cached, dispatcher)
+    conversation_history.append({"role": "user", "content": command.tagged()})
+    conversation_history.append({"role": "assistant", "content": cached})
+    return True
+
+
+def ask_llm(command, conversation_history, dispatcher, openai_client):
+    """
+    Sends one command to the LLM with its room's conversation history and
+    executes the reply.
+
+    Returns:
+        tuple: (the reply or None, seconds spent waiting for the LLM)
+    """
+    command.trace.annotate(route='llm')
+    conversation_history.append({"role": "user", "content": command.tagged()})
+    prompt_builder.trim_history(conversation_history)
+    context = None
+    if DEVICE_STATE_CONTEXT and needs_state(command.text):
+        context = {"Device state": dispatcher.state.summary(command.source_room)}
+        metrics.increment('llm_device_state_context')
+    messages_to_send = prompt_builder.build_messages(conversation_history, command.source_room, context)
+
+    started = time.monotonic()
+    if LLM_STREAMING:
+        handler = StreamingCommandHandler(dispatcher)
+        llm_response_json = stream_llm_response(openai_client, messages_to_send, handler)
+        llm_seconds = time.monotonic() - started
+        command.trace.mark('resolved')
+        # Anything already dispatched from the stream still gets finished
+        if not handler.finish() and llm_response_json:
+            parse_and_execute(llm_response_json, dispatcher)
+        command.trace.mark('parsed')
+    else:
+        llm_response_json = get_llm_response(openai_client, messages_to_send)
+        llm_seconds = time.monotonic() - started
+        command.trace.mark('resolved')
+        if llm_response_json:
+            parse_and_execute(llm_response_json, dispatcher)
+
+    if llm_response_json:
+        conversation_history.append({"role": "assistant", "content": llm_response_json})
+    return llm_response_json, llm_seconds
+
+
+def process_command(command, conversation_history, dispatcher, openai_client,
+                    intent_matcher=None, response_cache=None):
+    """
+    Resolves and executes one command: the local intent rules first, then the
+    response cache, then the LLM. Updates `conversation_history` in place.
+
+    Args:
+        command (listener.Command): The transcribed command and its trace.
+
+    Returns:
+        bool: False if the LLM was asked and gave no usable reply.
+    """
+    if response_cache is not None and awaits_answer(conversation_history):
+        response_cache = None  # An answer to a question means nothing on its own; don't replay or keep it
+        metrics.increment('response_cache_skipped_answer')
+    handled = intent_matcher is not None and try_local_intent(
+        command, conversation_history, dispatcher, intent_matcher)
+    if not handled and response_cache is not None:
+        handled = try_cached_response(command, conversation_history, dispatcher, response_cache)
+    if not handled:
+        llm_response_json, llm_seconds = ask_llm(command, conversation_history, dispatcher, openai_client)
+        if llm_response_json and response_cache is not None:
+            response_cache.store(command.text, command.source_room, llm_response_json, llm_seconds)
+        handled = bool(llm_response_json)
+
+    prompt_builder.trim_history(conversation_history)
+    return handled
+
+
+class RoomSession:
+    """The conversation and the not-yet-processed commands of one source room."""
+    def __init__(self, room):
+        self.room = room
+        self.history = []
+        self.pending = deque()
+        self.running = False  # True while one of this room's commands is on a worker
+
+
+class CommandProcessor:
+    """
+    Processes queued commands on a bounded worker pool. Every source room has
+    its own conversation history; a room's commands run one at a time and in
+    order, while commands from different rooms run in parallel, up to
+    `max_workers` at once. All workers share one OpenAI client, so HTTP
+    connections to the API are kept alive and reused between requests.
+
+    A room's backlog is bounded (see backpressure.py): a new setVolume replaces
+    one for the same speakers that has not started yet, beyond `max_pending`
+    the oldest waiting command is shed, and a command past its deadline is
+    dropped instead of being started.
+    """
+    def __init__(self, dispatcher, openai_client, max_workers=MAX_CONCURRENT_COMMANDS, intent_matcher=None,
+                 response_cache=None, max_pending=MAX_PENDING_PER_ROOM):
+        self.dispatcher = dispatcher
+        self.openai_client = openai_client
+        self.intent_matcher = intent_matcher
+        self.response_cache = response_cache
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="command-worker")
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.idle = threading.Condition(self.lock)
+
+    def submit(self, command):
+        room = command.source_room
+        key = None
+        if self.intent_matcher is not None:
+            key = coalesce_key(match_intent(command, self.intent_matcher))
+        dropped, reason = None, None
+        with self.lock:
+            session = self.sessions.get(room)
+            if session is None:
+                session = self.sessions[room] = RoomSession(room)
+            if key is not None:
+                for i, (waiting, _) in enumerate(session.pending):
+                    if coalesce_key(waiting.intent) == key:
+                        dropped, reason = waiting, 'coalesced'
+                        del session.pending[i]
+                        break
+            if dropped is None and self.max_pending and len(session.pending) >= self.max_pending:
+                dropped, reason = session.pending.popleft()[0], 'shed'
+            session.pending.append((command, time.monotonic()))
+            if dropped is None:
+                self.in_flight += 1  # A dropped command hands its place to this one
+            start = not session.running  # Otherwise it runs after the room's current command
+            session.running = True
+        if dropped is not None:
+            drop_command(dropped, reason)
+        if start:
+            self.executor.submit(self._run_next, session)
+
+    def pending_commands(self):
+        """Commands accepted but not finished yet, across all rooms."""
+        with self.lock:
+            return self.in_flight
+
+    def wait_idle(self, timeout=None):
+        """Blocks until every submitted command has been processed."""
+        with self.idle:
+            return self.idle.wait_for(lambda: self.in_flight == 0, timeout)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        if self.response_cache is not None:
+            self.response_cache.save()
+
+    def _run_next(self, session):
+        with self.lock:
+            command, queued_at = session.pending.popleft()
+        metrics.record_latency('command_queue_wait', time.monotonic() - queued_at)
+        if command.expired():
+            drop_command(command, 'expired')
+        else:
+            self._process(session, command)
+
+        with self.lock:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self.idle.notify_all()
+            if not session.pending:
+                session.running = False
+                return
+        # Requeue instead of looping, so one busy room cannot hold a worker
+        self.executor.submit(self._run_next, session)
+
+    def _process(self, session, command):
+        command.trace.mark('dequeued')
+        print(f"\n--- MAIN: Processing command {command.trace.trace_id} from '{session.room}': '{command.text}' ---")
+        outcome = 'ok'
+        try:
+            # Handlers dispatched from here pick the trace up and keep it open until they finish
+            with tracing.activate(command.trace):
+                if not process_command(command, session.history, self.dispatcher, self.openai_client,
+                                       self.intent_matcher, self.response_cache):
+                    outcome = 'no_reply'
+        except Exception as e:
+            print(f"Error processing command from '{session.room}': {e}")
+            outcome = 'error'
+        command.trace.end(outcome)
+
+
+def command_consumer_thread(command_queue, dispatcher, openai_client, response_cache=None,
+                            max_workers=MAX_CONCURRENT_COMMANDS):
     """
     This function runs in its own thread. Its only job is to wait for commands
-    from the queue and process them.
+    from the queue and hand them to the CommandProcessor's workers.
     """
-    conversation_history = []
+    intent_matcher = IntentMatcher() if LOCAL_INTENTS else None
+    processor = CommandProcessor(dispatcher, openai_client, max_workers, intent_matcher, response_cache)
+    metrics.register_depth('commands_in_flight', processor.pending_commands)
 
     while True:
         try:
             # This is the only place a blocking call happens now.
-            tagged_command = command_queue.get()
+            command = command_queue.get()
+            print(f"\n--- MAIN: Popped command from queue: '{command}' ---")
+            processor.submit(command)
+        except Exception as e:
+            print(f"Error in consumer thread: {e}")
+
 
-            print(f"\n--- MAIN: Popped command from queue: '{tagged_command}' ---")
+def create_openai_client():
+    """
+    The single OpenAI client shared by every command worker. Its HTTP
+    connection pool keeps connections to the API alive between requests, so
+    only the first request from each worker pays for the TCP/TLS handshake.
+    """
+    from openai import OpenAI  # Imported here so the listener is up before this slow import
+    return OpenAI(api_key=os.getenv('OPENAI_KEY'), timeout=LLM_TIMEOUT)
 
-            live_prompt = get_system_prompt() # Get fresh timestamp
-            conversation_history.append({"role": "user", "content": tagged_command})
-            messages_to_send = [
-                {"role": "system", "content": live_prompt},
-                *conversation_history
-            ]
 
-            llm_response_json = get_llm_response(openai_client, messages_to_send)
+# --- MAIN APPLICATION LOOP ---
+def create_response_cache(openai_client):
+    """Loads the LLM response cache from disk, or returns None if it is disabled."""
+    if not RESPONSE_CACHE:
+        return None
+    embed_fn = openai_embedder(openai_client) if RESPONSE_CACHE_EMBEDDINGS else None
+    response_cache = ResponseCache(embed_fn=embed_fn)
+    print(f"Response cache: loaded {response_cache.load()} entries.")
+    return response_cache
 
-            if llm_response_json:
-                conversation_history.append({"role": "assistant", "content": llm_response_json})
-                parse_and_execute(llm_response_json, dispatcher)
 
-            if len(conversation_history) > 10:
-                conversation_history = conversation_history[-10:]
+def create_device_state():
+    """Restores the speakers' state from the last snapshot."""
+    device_state = DeviceStateStore()
+    print(f"Device state: restored {device_state.load()} speakers.")
+    return device_state
 
-        except Exception as e:
-            print(f"Error in consumer thread: {e}")
-        
 
-# --- MAIN APPLICATION LOOP ---
 def main():
+    startup.begin(STARTED_AT)
+    startup.record('imports', STARTED_AT, time.monotonic())
+    # Ready once mics can connect, the wake word model is warm and commands are being taken
+    startup.expect('accepting mics', 'wake words', 'taking commands')
     load_dotenv()
-    openai_client = OpenAI(api_key=os.getenv('OPENAI_KEY'))
-    dispatcher = Dispatcher()
-    command_queue = queue.Queue()
-    
-    # Start the listener service (which is a daemon thread)
+    command_queue = CommandQueue()  # Bounded: see backpressure.py
+    tracing.start_trace_log()
+
+    # Start the listener service first (a daemon thread): mics connect while the
+    # wake word model loads in the background and the rest of startup runs
     start_listening_service(command_queue)
 
-    # Start the command consumer thread (also a daemon)
-    consumer = threading.Thread(target=command_consumer_thread, args=(command_queue, dispatcher, openai_client))
+    with startup.step('openai client'):
+        openai_client = create_openai_client()
+    with startup.step('response cache'):
+        response_cache = create_response_cache(openai_client)
+    with startup.step('dispatcher'):
+        dispatcher = Dispatcher(state=create_device_state())
+    metrics.register_depth('zones_speaking', dispatcher.playback.busy_zones)
+
+    # Start the command consumer thread (also a daemon); commands captured so far are waiting in the queue
+    consumer = threading.Thread(target=command_consumer_thread,
+                                args=(command_queue, dispatcher, openai_client, response_cache))
     consumer.daemon = True
     consumer.start()
+    startup.milestone('taking commands')
 
     print("\n--- Jarvis Main Application is Running ---")
     print("Press Ctrl+C to exit.")
@@ -121,6 +440,10 @@ def main():
             time.sleep(1)
     except KeyboardInterrupt:
         print("\n--- Shutting down Jarvis ---")
+        dispatcher.shutdown()
+        if response_cache is not None:
+            response_cache.save()
+            print(f"Response cache: {response_cache.stats()}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
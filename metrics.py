@@ -0,0 +1,189 @@
+# metrics.py
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# --- CONFIGURATION ---
+LATENCY_SAMPLES = 1000  # Recent samples kept per stage for percentiles
+METRICS_REPORT_INTERVAL = 60.0  # Seconds between printed reports (0 disables the reporter)
+
+
+class StageStats:
+    """Latency samples and a running count for one pipeline stage."""
+    def __init__(self):
+        self.count = 0
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, seconds):
+        self.count += 1
+        self.samples.append(seconds)
+
+    def summary(self):
+        if not self.samples:
+            return {'count': self.count}
+        ordered = sorted(self.samples)
+        last = len(ordered) - 1
+        return {
+            'count': self.count,
+            'p50_ms': ordered[int(last * 0.50)] * 1000,
+            'p95_ms': ordered[int(last * 0.95)] * 1000,
+            'max_ms': ordered[-1] * 1000,
+        }
+
+
+class PipelineMetrics:
+    """
+    Per-stage latency, queue depth and event counters for the voice pipeline.
+    Queue depths are read lazily from callables registered by whoever owns the queue.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._depths = {}
+        self._counters = {}
+
+    def record_latency(self, stage, seconds):
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            stats.record(seconds)
+
+    def increment(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def register_depth(self, name, depth_fn):
+        """Registers a callable that returns the current depth of a queue."""
+        with self._lock:
+            self._depths[name] = depth_fn
+
+    def unregister_depth(self, name):
+        with self._lock:
+            self._depths.pop(name, None)
+
+    def snapshot(self):
+        with self._lock:
+            stages = {name: stats.summary() for name, stats in self._stages.items()}
+            depth_fns = dict(self._depths)
+            counters = dict(self._counters)
+        depths = {}
+        for name, depth_fn in depth_fns.items():
+            try:
+                depths[name] = depth_fn()
+            except Exception:
+                depths[name] = None
+        return {'latency': stages, 'queue_depth': depths, 'counters': counters}
+
+    def report(self):
+        """A printable multi-line summary of the current snapshot."""
+        snap = self.snapshot()
+        lines = ["--- PIPELINE METRICS ---"]
+        for name, depth in sorted(snap['queue_depth'].items()):
+            lines.append(f"  queue {name:<22} depth={depth}")
+        for name, s in sorted(snap['latency'].items()):
+            if 'p50_ms' in s:
+                lines.append(f"  stage {name:<22} n={s['count']:<6} p50={s['p50_ms']:.0f}ms "
+                             f"p95={s['p95_ms']:.0f}ms max={s['max_ms']:.0f}ms")
+            else:
+                lines.append(f"  stage {name:<22} n={s['count']}")
+        for name, value in sorted(snap['counters'].items()):
+            lines.append(f"  count {name:<22} {value}")
+        return "\n".join(lines)
+
+
+def start_metrics_reporter(interval=METRICS_REPORT_INTERVAL):
+    """Prints the metrics report every `interval` seconds on a daemon thread."""
+    if interval <= 0:
+        return None
+
+    def report_loop():
+        while True:
+            time.sleep(interval)
+            print("\n" + metrics.report())
+
+    reporter = threading.Thread(target=report_loop, name="metrics-reporter", daemon=True)
+    reporter.start()
+    return reporter
+
+
+class StartupTimer:
+    """
+    How long each step of startup took, including steps on background threads
+    (the wake word model loads while the server already accepts mics), and when
+    the service reached each milestone. Once every expected milestone is in,
+    the breakdown is printed.
+    """
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.steps = []  # (name, start, end, thread name), seconds since started_at
+        self.milestones = {}  # Name -> seconds since started_at
+        self.expected = ()
+        self._reported = False
+        self._lock = threading.Lock()
+
+    def begin(self, started_at):
+        """Moves the origin back, e.g. to before the heavy imports of the entry point."""
+        self.started_at = started_at
+
+    @contextmanager
+    def step(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            ended = time.monotonic()
+            self.record(name, started, ended)
+
+    def record(self, name, started, ended):
+        metrics.record_latency(f'startup_{name.replace(" ", "_")}', ended - started)
+        with self._lock:
+            self.steps.append((name, started - self.started_at, ended - self.started_at,
+                               threading.current_thread().name))
+
+    def expect(self, *milestones):
+        """The milestones that make the service ready; the report is printed when all are reached."""
+        self.expected = milestones
+        self._maybe_report()
+
+    def milestone(self, name):
+        with self._lock:
+            self.milestones.setdefault(name, time.monotonic() - self.started_at)
+        self._maybe_report()
+
+    def ready_after(self):
+        """Seconds from start until the last expected milestone, or None while one is missing."""
+        with self._lock:
+            if not self.expected or any(name not in self.milestones for name in self.expected):
+                return None
+            return max(self.milestones[name] for name in self.expected)
+
+    def report(self):
+        with self._lock:
+            steps = sorted(self.steps, key=lambda step: step[1])
+            milestones = sorted(self.milestones.items(), key=lambda item: item[1])
+        lines = ["--- STARTUP ---"]
+        for name, started, ended, thread in steps:
+            where = "" if thread == 'MainThread' else f"  ({thread})"
+            lines.append(f"  step {name:<22} {(ended - started) * 1000:7.0f} ms  "
+                         f"[{started:6.2f} s -> {ended:6.2f} s]{where}")
+        for name, at in milestones:
+            lines.append(f"  {name:<27} at {at:6.2f} s")
+        return "\n".join(lines)
+
+    def _maybe_report(self):
+        ready = self.ready_after()
+        with self._lock:
+            if ready is None or self._reported:
+                return
+            self._reported = True
+        metrics.record_latency('startup_ready', ready)
+        print(f"\n{self.report()}\n  ready after {ready:.2f} s")
+
+
+# The process-wide metrics registry shared by the listener and main application
+metrics = PipelineMetrics()
+# Startup timing for the process; main.py sets its origin and milestones
+startup = StartupTimer()
@@ -2,6 +2,13 @@ import pyaudio
 import socket
 import threading
 import sys
+import time
+from collections import deque
+import numpy as np
+
+# protocol.py and audio_codec.py must be copied next to this script on the mic device
+from audio_codec import CODEC_NAMES, available_codecs, create_codec
+from protocol import ACK, CODEC_PCM16, FRAME_AUDIO, FRAME_KEEPALIVE, pack_frame_header, pack_hello
 
 # --- CONFIGURATION ---
 SERVER_HOST = '10.0.0.145'  # <-- IMPORTANT: Change this to the IP address of your main server
@@ -9,11 +16,29 @@ SERVER_PORT = 12345         # The port the listener service is waiting on
 MIC_ID = "joseph room"       # A unique identifier for this microphone
 
 # Audio stream settings (must match the server's expectations)
-CHUNK = 1024
+CHUNK = 1280  # 80ms of audio, exactly one openWakeWord window
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 16000
 
+# Send length-prefixed frames with a sequence number. Set to False to talk to
+# an older listener that only understands the raw stream.
+USE_FRAMED_PROTOCOL = True
+
+# Codec to ask the server for (framed protocol only): 'pcm16', 'ulaw', 'adpcm' or 'opus'.
+# The server may answer with a different one; pcm16 always works.
+PREFERRED_CODEC = 'ulaw'
+
+# Silence gate (framed protocol only): after SILENCE_GATE_SECONDS below
+# SILENCE_THRESHOLD RMS, stop sending audio and send a keepalive every
+# KEEPALIVE_INTERVAL seconds instead. The last PREROLL_CHUNKS of gated audio
+# are sent when sound comes back so the start of the wake word is not lost.
+SILENCE_GATE_ENABLED = True
+SILENCE_THRESHOLD = 600  # RMS of the int16 samples (about 55 dB on vad.py's scale)
+SILENCE_GATE_SECONDS = 1.5
+KEEPALIVE_INTERVAL = 1.0
+PREROLL_CHUNKS = 4  # 320ms
+
 def list_audio_devices(p):
     """Lists all available audio input devices."""
     print("\n--- Available Audio Input Devices ---")
@@ -25,7 +50,54 @@ def list_audio_devices(p):
     print("-------------------------------------\n")
 
 
-def stream_audio(client_socket):
+class SilenceGate:
+    """
+    Decides chunk by chunk whether audio is worth sending. Chunks held back
+    while the gate is closed are kept in a short pre-roll buffer.
+    """
+    def __init__(self):
+        self.quiet_chunks_to_close = int(SILENCE_GATE_SECONDS * RATE / CHUNK)
+        self.quiet_chunks = 0
+        self.preroll = deque(maxlen=PREROLL_CHUNKS)
+        self.last_keepalive = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.quiet_chunks < self.quiet_chunks_to_close
+
+    def process(self, data):
+        """Returns the list of chunks to send now (empty while the gate is closed)."""
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        rms = np.sqrt(np.mean(samples * samples))
+
+        if rms >= SILENCE_THRESHOLD:
+            was_closed = not self.is_open
+            self.quiet_chunks = 0
+            if was_closed:
+                held_back = list(self.preroll)
+                self.preroll.clear()
+                return held_back + [data]
+            return [data]
+
+        self.quiet_chunks += 1
+        if self.is_open:
+            return [data]
+        self.preroll.append(data)
+        return []
+
+    def keepalive_due(self):
+        now = time.monotonic()
+        if now - self.last_keepalive >= KEEPALIVE_INTERVAL:
+            self.last_keepalive = now
+            return True
+        return False
+
+
+def send_frame(client_socket, frame_type, codec, payload, sequence):
+    client_socket.sendall(pack_frame_header(frame_type, codec, len(payload), sequence) + payload)
+
+
+def stream_audio(client_socket, preferred_codec=PREFERRED_CODEC):
     """Captures audio from the microphone and streams it to the server."""
     audio = pyaudio.PyAudio()
     list_audio_devices(audio)
@@ -40,18 +112,45 @@ def stream_audio(client_socket):
                             frames_per_buffer=CHUNK)
         print(">>> Microphone is live and streaming to the server...")
         
-        # First, send the mic_id to identify this client
-        client_socket.sendall(MIC_ID.encode('utf-8'))
-        
-        # Wait for a confirmation byte before streaming
-        confirmation = client_socket.recv(1)
-        if confirmation != b'\x01':
+        # First, identify this client: a protocol HELLO, or just the mic_id in legacy mode
+        if not USE_FRAMED_PROTOCOL:
+            client_socket.sendall(MIC_ID.encode('utf-8'))
+            # Wait for a confirmation byte before streaming
+            if client_socket.recv(1) != ACK:
+                print("Server did not acknowledge. Closing.")
+                return
+            while True:
+                client_socket.sendall(stream.read(CHUNK))
+
+        codec_ids = {name: codec for codec, name in CODEC_NAMES.items()}
+        requested = codec_ids.get(preferred_codec, CODEC_PCM16)
+        if requested not in available_codecs():
+            print(f"Codec '{preferred_codec}' is not available here, asking for pcm16.")
+            requested = CODEC_PCM16
+        client_socket.sendall(pack_hello(MIC_ID, requested, RATE, CHUNK))
+
+        # Wait for the confirmation byte and the codec the server accepted
+        reply = client_socket.recv(2)
+        if len(reply) == 1:
+            reply += client_socket.recv(1)
+        if len(reply) != 2 or reply[:1] != ACK:
             print("Server did not acknowledge. Closing.")
             return
+        codec = reply[1]
+        encoder = create_codec(codec, RATE)
+        print(f"Streaming with codec '{CODEC_NAMES.get(codec, codec)}'.")
 
+        gate = SilenceGate() if SILENCE_GATE_ENABLED else None
+        sequence = 0
         while True:
             data = stream.read(CHUNK)
-            client_socket.sendall(data)
+            chunks = gate.process(data) if gate else [data]
+            if not chunks and gate.keepalive_due():
+                send_frame(client_socket, FRAME_KEEPALIVE, codec, b'', sequence)
+                sequence += 1
+            for chunk in chunks:
+                send_frame(client_socket, FRAME_AUDIO, codec, encoder.encode(chunk), sequence)
+                sequence += 1
 
     except OSError as e:
         print(f"ERROR opening audio stream: {e}")
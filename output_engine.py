@@ -0,0 +1,609 @@
+# output_engine.py
+#
+# Routes speech to the speakers named in system_prompt.txt. Each speaker is an
+# output zone with its own sink:
+#
+#   tcp                   a speaker_client.py that connected with this speaker ID
+#   file:out/{speaker}.wav  a WAV file (any other extension is raw PCM, which also works for a FIFO)
+#   pipe:<command>        a command that reads raw 16 kHz int16 PCM on stdin, e.g. aplay
+#   device                this computer's default output device
+#   null                  discarded (benchmarks)
+#
+# One clock thread mixes every zone in 20 ms frames: the voices playing in a
+# zone are scaled by their volume and summed into preallocated NumPy buffers,
+# and the mixed frame is handed to the zone's sink. Every zone renders the
+# same frame sequence number on the same tick, and a message sent to several
+# zones starts on the same frame in all of them, so speaker clients that play
+# frames by sequence number stay in step. Sinks write on their own threads
+# from a small preallocated queue, so a slow sink drops frames instead of
+# delaying the clock for everyone.
+
+import shlex
+import socket
+import subprocess
+import threading
+import time
+import wave
+import weakref
+import numpy as np
+
+from audio_codec import create_codec, negotiate_codec
+from intents import SYSTEM_PROMPT_PATH, load_prompt_spec
+from metrics import metrics
+from protocol import FRAME_AUDIO, pack_ack, pack_frame_header, unpack_hello
+from tts import TTSError
+
+# --- CONFIGURATION ---
+OUTPUT_RATE = 16000  # Same rate as the mic link, so speaker clients can use the same codecs
+OUTPUT_FRAME_SAMPLES = 320  # 20 ms per mixed frame
+SPEAKER_HOST = '0.0.0.0'
+SPEAKER_PORT = 12346  # The port speaker_client.py connects to
+OUTPUT_DEFAULT_SINK = 'tcp'
+OUTPUT_SINKS = {
+    # Speaker name -> sink, for speakers that should not use OUTPUT_DEFAULT_SINK, e.g.
+    # "office": "pipe:aplay -q -t raw -f S16_LE -r 16000 -c 1",
+}
+VOICE_BUFFER_FRAMES = 25  # Resampled audio buffered ahead of the mixer per voice (500 ms)
+SINK_QUEUE_FRAMES = 10  # Frames a sink may fall behind before new ones are dropped (200 ms)
+SYNC_LEAD_FRAMES = 2  # Frames of head start so every zone of a message can join before it begins
+MAX_CLOCK_LAG = 0.1  # Seconds behind schedule before the clock resyncs instead of catching up
+
+
+class LinearResampler:
+    """Converts a stream of int16 chunks to another sample rate, carrying the phase across chunks."""
+    def __init__(self, source_rate, target_rate):
+        self.step = source_rate / target_rate
+        self.position = 0.0  # Next output position, in input samples from the start of the buffer
+        self.previous = None
+
+    def process(self, samples):
+        buffer = samples.astype(np.float32)
+        if self.previous is not None:
+            buffer = np.concatenate(([self.previous], buffer))
+        last = len(buffer) - 1
+        if last < 1:
+            return np.zeros(0, dtype=np.int16)
+        count = int(np.floor((last - self.position) / self.step)) + 1
+        positions = self.position + np.arange(count) * self.step
+        out = np.interp(positions, np.arange(len(buffer)), buffer)
+        self.position = positions[-1] + self.step - last
+        self.previous = buffer[-1]
+        return out.astype(np.int16)
+
+
+class Voice:
+    """
+    One message playing in one zone: a ring of resampled samples filled by the
+    caller's thread (which blocks while it is full) and drained by the mixer.
+    """
+    def __init__(self, capacity, gain, start_sequence, on_start):
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        self.read_pos = 0
+        self.count = 0
+        self.gain = gain
+        self.start_sequence = start_sequence
+        self.on_start = on_start
+        self.started = False
+        self.created_at = time.monotonic()
+        self.finished = False
+        self.cancelled = False
+        self.done = threading.Event()
+        self.cond = threading.Condition()
+
+    def write(self, samples, stopped=None):
+        """Appends samples, waiting for room. Returns False if the voice was cancelled."""
+        offset = 0
+        while offset < len(samples):
+            with self.cond:
+                while self.count == self.capacity and not self.cancelled:
+                    if stopped is not None and stopped():
+                        self.cancelled = True
+                        break
+                    self.cond.wait(0.05)
+                if self.cancelled:
+                    return False
+                write_pos = (self.read_pos + self.count) % self.capacity
+                n = min(len(samples) - offset, self.capacity - self.count, self.capacity - write_pos)
+                self.buffer[write_pos:write_pos + n] = samples[offset:offset + n]
+                self.count += n
+                offset += n
+        return True
+
+    def read_into(self, out):
+        """Moves up to len(out) samples into `out` without waiting. Returns how many."""
+        with self.cond:
+            n = min(len(out), self.count)
+            first = min(n, self.capacity - self.read_pos)
+            out[:first] = self.buffer[self.read_pos:self.read_pos + first]
+            out[first:n] = self.buffer[:n - first]
+            self.read_pos = (self.read_pos + n) % self.capacity
+            self.count -= n
+            if n:
+                self.cond.notify()
+        return n
+
+    def finish(self, cancel=False):
+        with self.cond:
+            self.finished = True
+            if cancel:
+                self.cancelled = True
+                self.count = 0
+            self.cond.notify()
+
+    @property
+    def exhausted(self):
+        return self.cancelled or (self.finished and self.count == 0)
+
+
+# --- SINKS ---
+
+class Sink:
+    """
+    Receives a zone's mixed frames. offer() runs on the mixer's clock thread
+    and never blocks: the frame is copied into a preallocated queue slot and
+    written by the sink's own thread.
+    """
+    def __init__(self, name, frame_samples=OUTPUT_FRAME_SAMPLES, rate=OUTPUT_RATE):
+        self.name = name
+        self.rate = rate
+        self.frames = np.zeros((SINK_QUEUE_FRAMES, frame_samples), dtype=np.int16)
+        self.sequences = [0] * SINK_QUEUE_FRAMES
+        self.head = 0
+        self.count = 0
+        self.written = 0
+        self.dropped = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def offer(self, frame, sequence):
+        with self.cond:
+            if self.count == SINK_QUEUE_FRAMES:
+                self.dropped += 1
+                metrics.increment('output_frames_dropped')
+                return
+            slot = (self.head + self.count) % SINK_QUEUE_FRAMES
+            np.copyto(self.frames[slot], frame)
+            self.sequences[slot] = sequence
+            self.count += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._write_loop, name=f"sink-{self.name}", daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+        else:
+            self.release()
+
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                while not self.count and not self.closed:
+                    self.cond.wait()
+                if not self.count:
+                    break
+                slot = self.head
+            try:
+                self.write(self.frames[slot], self.sequences[slot])
+                self.written += 1
+            except OSError as e:
+                print(f"Output: sink for '{self.name}' failed; {e}")
+                self.on_error()
+            with self.cond:
+                self.head = (self.head + 1) % SINK_QUEUE_FRAMES
+                self.count -= 1
+        self.release()
+
+    def write(self, frame, sequence):
+        raise NotImplementedError
+
+    def on_error(self):
+        pass
+
+    def release(self):
+        """Frees the sink's resources once its writer thread is done."""
+
+
+class NullSink(Sink):
+    def offer(self, frame, sequence):
+        self.written += 1
+
+
+class FileSink(Sink):
+    """Writes a WAV file, or raw PCM for any other extension (a FIFO works too)."""
+    def __init__(self, name, path, **kwargs):
+        super().__init__(name, **kwargs)
+        self.path = path
+        self.file = None
+
+    def write(self, frame, sequence):
+        if self.file is None:
+            if self.path.endswith('.wav'):
+                self.file = wave.open(self.path, 'wb')
+                self.file.setnchannels(1)
+                self.file.setsampwidth(2)
+                self.file.setframerate(self.rate)
+            else:
+                self.file = open(self.path, 'wb')  # Blocks until a FIFO has a reader
+        if isinstance(self.file, wave.Wave_write):
+            self.file.writeframes(frame)
+        else:
+            self.file.write(frame)
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class PipeSink(Sink):
+    """Feeds the frames to a command's stdin, e.g. `aplay -q -t raw -f S16_LE -r 16000 -c 1`."""
+    def __init__(self, name, command, **kwargs):
+        super().__init__(name, **kwargs)
+        self.command = shlex.split(command)
+        self.process = None
+
+    def write(self, frame, sequence):
+        if self.process is None:
+            self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE)
+        self.process.stdin.write(frame)
+        self.process.stdin.flush()
+
+    def on_error(self):
+        self.process = None  # Restarted with the next frame
+
+    def release(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+class DeviceSink(Sink):
+    """This computer's default output device, via PyAudio."""
+    def __init__(self, name, **kwargs):
+        super().__init__(name, **kwargs)
+        self.audio = None
+        self.stream = None
+
+    def write(self, frame, sequence):
+        if self.stream is None:
+            import pyaudio
+            self.audio = pyaudio.PyAudio()
+            self.stream = self.audio.open(format=pyaudio.paInt16, channels=1, rate=self.rate, output=True)
+        self.stream.write(frame.tobytes())
+
+    def release(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.audio.terminate()
+
+
+class TcpSink(Sink):
+    """A speaker_client.py connection. Frames are dropped while no client is connected."""
+    def __init__(self, name, **kwargs):
+        super().__init__(name, **kwargs)
+        self.connection = None
+        self.encoder = None
+        self.codec = None
+
+    def attach(self, client_socket, codec, encoder):
+        with self.cond:
+            old = self.connection
+            self.connection, self.codec, self.encoder = client_socket, codec, encoder
+        if old is not None:
+            old.close()  # A reconnecting speaker replaces its previous connection
+
+    def offer(self, frame, sequence):
+        if self.connection is None:
+            metrics.increment('output_frames_unrouted')
+            return
+        super().offer(frame, sequence)
+
+    def write(self, frame, sequence):
+        connection = self.connection
+        if connection is None:
+            return
+        payload = self.encoder.encode(frame.tobytes())
+        connection.sendall(pack_frame_header(FRAME_AUDIO, self.codec, len(payload), sequence) + payload)
+
+    def on_error(self):
+        if self.release():
+            print(f"Output: speaker '{self.name}' disconnected.")
+
+    def release(self):
+        with self.cond:
+            connection, self.connection = self.connection, None
+        if connection is not None:
+            connection.close()
+        return connection is not None
+
+
+def slug(speaker):
+    return speaker.replace("'", '').replace(' ', '_')
+
+
+def create_sink(spec, speaker, **kwargs):
+    """Builds a sink from a spec such as 'tcp', 'file:out/{speaker}.wav' or 'pipe:aplay ...'."""
+    kind, _, argument = spec.partition(':')
+    if kind == 'null':
+        return NullSink(speaker, **kwargs)
+    if kind == 'tcp':
+        return TcpSink(speaker, **kwargs)
+    if kind == 'device':
+        return DeviceSink(speaker, **kwargs)
+    if kind == 'file' and argument:
+        return FileSink(speaker, argument.format(speaker=slug(speaker)), **kwargs)
+    if kind == 'pipe' and argument:
+        return PipeSink(speaker, argument.format(speaker=slug(speaker)), **kwargs)
+    raise ValueError(f"Unknown output sink '{spec}' for speaker '{speaker}'")
+
+
+# --- ENGINE ---
+
+class OutputZone:
+    """One speaker: its sink, the voices playing on it and its preallocated mix buffers."""
+    def __init__(self, name, sink, frame_samples):
+        self.name = name
+        self.sink = sink
+        self.voices = []
+        self.mix = np.zeros(frame_samples, dtype=np.float32)
+        self.scaled = np.zeros(frame_samples, dtype=np.float32)
+        self.samples = np.zeros(frame_samples, dtype=np.int16)
+        self.out = np.zeros(frame_samples, dtype=np.int16)
+
+    def render(self, sequence, voices):
+        """Mixes one frame into self.out. Returns False if no voice has started yet."""
+        mixed = False
+        self.mix.fill(0.0)
+        for voice in voices:
+            if sequence < voice.start_sequence:
+                continue
+            n = voice.read_into(self.samples)
+            if not n:
+                if not voice.finished:
+                    metrics.increment('output_underruns')  # Synthesis is behind real time
+                continue
+            if not voice.started:
+                voice.started = True
+                metrics.record_latency('output_voice_start', time.monotonic() - voice.created_at)
+                voice.on_start()
+            np.multiply(self.samples[:n], voice.gain, out=self.scaled[:n])
+            np.add(self.mix[:n], self.scaled[:n], out=self.mix[:n])
+            mixed = True
+        if mixed:
+            np.clip(self.mix, -32768, 32767, out=self.mix)
+            np.copyto(self.out, self.mix, casting='unsafe')
+        return mixed
+
+
+class OutputEngine:
+    """
+    Mixes and streams speech to per-speaker sinks. Used as the AudioManager's
+    player: play_pcm() blocks the calling zone thread until its audio has been
+    handed to the sink (or stopped).
+    """
+    def __init__(self, speakers=None, sinks=None, default_sink=OUTPUT_DEFAULT_SINK, rate=OUTPUT_RATE,
+                 frame_samples=OUTPUT_FRAME_SAMPLES, host=SPEAKER_HOST, port=SPEAKER_PORT,
+                 prompt_path=SYSTEM_PROMPT_PATH):
+        """
+        Args:
+            speakers (list): Zones to create up front; read from the system prompt if omitted.
+            sinks (dict): Speaker name -> sink spec (defaults to OUTPUT_SINKS).
+            default_sink (str): Sink spec for speakers not in `sinks`.
+        """
+        self.speakers = speakers if speakers is not None else load_prompt_spec(prompt_path)[0]
+        self.sink_specs = OUTPUT_SINKS if sinks is None else sinks
+        self.default_sink = default_sink
+        self.rate = rate
+        self.frame_samples = frame_samples
+        self.frame_seconds = frame_samples / rate
+        self.address = (host, port)
+        self.zones = {}
+        self.sequence = 0
+        self.active_voices = 0
+        self.sync_starts = weakref.WeakKeyDictionary()  # SharedAudio -> first frame of that message
+        self.running = False
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.server = None
+        self.clock = None
+
+    def start(self):
+        for speaker in self.speakers:
+            self.zone(speaker)
+        self.running = True
+        self.clock = threading.Thread(target=self._clock_loop, name="output-clock", daemon=True)
+        self.clock.start()
+        if any(isinstance(zone.sink, TcpSink) for zone in self.zones.values()):
+            self.server = SpeakerServer(self, *self.address)
+            self.server.start()
+        metrics.register_depth('output_voices', lambda: self.active_voices)
+        print(f"Output engine started: {len(self.zones)} zones at {self.rate} Hz.")
+        return self
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            voices = [voice for zone in self.zones.values() for voice in zone.voices]
+            self.cond.notify_all()
+        for voice in voices:
+            voice.finish(cancel=True)
+            voice.done.set()
+        if self.server is not None:
+            self.server.close()
+        for zone in list(self.zones.values()):
+            zone.sink.close()
+
+    def zone(self, name):
+        """The zone of a configured speaker. Unknown names get no zone (and no sink): a KeyError."""
+        zone = self.zones.get(name)
+        if zone is None:
+            if name not in self.speakers:
+                raise KeyError(f"'{name}' is not a configured speaker")
+            spec = self.sink_specs.get(name, self.default_sink)
+            sink = create_sink(spec, name, frame_samples=self.frame_samples, rate=self.rate)
+            zone = self.zones.setdefault(name, OutputZone(name, sink, self.frame_samples))
+        return zone
+
+    # --- Player interface (see audio_manager.DevicePlayer) ---
+
+    def play_file(self, path, on_start, speaker=None, volume=None):
+        raise TTSError("The output engine mixes PCM only; use an offline TTS backend (piper or espeak) "
+                       "or set AUDIO_OUTPUT = 'device'")
+
+    def play_pcm(self, audio, speaker=None, volume=None, stopped=None):
+        """
+        Streams a SharedAudio to one speaker (or a list of them), blocking until
+        it has all been mixed or `stopped()` is true.
+        """
+        names = [speaker] if isinstance(speaker, str) else list(speaker or self.speakers)
+        unknown = [name for name in names if name not in self.speakers]
+        if unknown:
+            print(f"Output: ignoring unknown speakers {unknown}.")
+            metrics.increment('unknown_speakers', len(unknown))
+            names = [name for name in names if name in self.speakers]
+            if not names:
+                raise TTSError(f"No configured speaker among {unknown}")
+        gain = 1.0 if volume is None else max(0, min(100, volume)) / 100
+        resampler = LinearResampler(audio.sample_rate, self.rate) if audio.sample_rate != self.rate else None
+        capacity = VOICE_BUFFER_FRAMES * self.frame_samples
+        with self.cond:
+            if not self.running:
+                raise TTSError("The output engine is not running")
+            start = self.sync_starts.get(audio)
+            if start is None:
+                start = self.sync_starts[audio] = self.sequence + SYNC_LEAD_FRAMES
+            start = max(start, self.sequence)  # Joined after the message began elsewhere
+            voices = []
+            for name in names:
+                voice = Voice(capacity, gain, start, audio.mark_playing)
+                self.zone(name).voices.append(voice)
+                voices.append(voice)
+            self.active_voices += len(voices)
+            self.cond.notify_all()
+
+        cancelled = False
+        try:
+            for chunk in audio.chunks(stopped):
+                samples = np.frombuffer(chunk, dtype=np.int16)
+                if resampler is not None:
+                    samples = resampler.process(samples)
+                for voice in voices:
+                    voice.write(samples, stopped)
+                if all(voice.cancelled for voice in voices):
+                    break
+            cancelled = stopped is not None and stopped()
+        finally:
+            for voice in voices:
+                voice.finish(cancel=cancelled)
+        for voice in voices:
+            voice.done.wait()
+
+    # --- Mixer clock ---
+
+    def _clock_loop(self):
+        next_tick = None
+        while True:
+            with self.cond:
+                while self.running and not self.active_voices:
+                    self.cond.wait()
+                    next_tick = None
+                if not self.running:
+                    return
+            now = time.monotonic()
+            if next_tick is None:
+                next_tick = now
+            elif now < next_tick:
+                time.sleep(next_tick - now)
+                now = time.monotonic()
+            lag = now - next_tick
+            if lag > MAX_CLOCK_LAG:
+                metrics.increment('output_clock_resyncs')
+                next_tick = now
+                lag = 0.0
+            metrics.record_latency('output_clock_lag', lag)
+            self._tick()
+            next_tick += self.frame_seconds
+
+    def _tick(self):
+        with self.lock:
+            sequence = self.sequence
+            self.sequence += 1
+            work = [(zone, list(zone.voices)) for zone in self.zones.values() if zone.voices]
+        for zone, voices in work:
+            if zone.render(sequence, voices):
+                zone.sink.offer(zone.out, sequence)
+            finished = [voice for voice in voices if voice.exhausted]
+            if finished:
+                with self.lock:
+                    for voice in finished:
+                        zone.voices.remove(voice)
+                    self.active_voices -= len(finished)
+                for voice in finished:
+                    voice.done.set()
+
+
+class SpeakerServer:
+    """
+    Accepts speaker_client.py connections. A speaker opens with the same HELLO
+    as a mic (its speaker name in the ID field) and then only receives frames.
+    """
+    def __init__(self, engine, host=SPEAKER_HOST, port=SPEAKER_PORT):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.server_socket = None
+
+    def start(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(16)
+        self.port = self.server_socket.getsockname()[1]
+        threading.Thread(target=self._accept_loop, name="speaker-server", daemon=True).start()
+        print(f"Speaker server listening on {self.host}:{self.port}")
+
+    def close(self):
+        if self.server_socket is not None:
+            self.server_socket.close()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client_socket, address = self.server_socket.accept()
+            except OSError:
+                return  # Closed
+            threading.Thread(target=self._handshake, args=(client_socket, address), daemon=True).start()
+
+    def _handshake(self, client_socket, address):
+        try:
+            client_socket.settimeout(5.0)
+            data = b''
+            hello = None
+            while hello is None:
+                chunk = client_socket.recv(1024)
+                if not chunk:
+                    raise ValueError("disconnected during the handshake")
+                data += chunk
+                hello, _ = unpack_hello(data)
+            speaker = hello['mic_id']
+            zone = self.engine.zones.get(speaker)
+            if zone is None or not isinstance(zone.sink, TcpSink):
+                raise ValueError(f"'{speaker}' is not a speaker with a tcp sink")
+            if hello['sample_rate'] != self.engine.rate or hello['frame_samples'] != self.engine.frame_samples:
+                raise ValueError(f"expected {self.engine.rate} Hz and {self.engine.frame_samples}-sample frames")
+            codec = negotiate_codec(hello['codec'])
+            client_socket.settimeout(None)
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client_socket.sendall(pack_ack(codec))
+            zone.sink.attach(client_socket, codec, create_codec(codec, self.engine.rate))
+            print(f"Output: speaker '{speaker}' connected from {address[0]}.")
+        except (OSError, ValueError) as e:
+            print(f"Output: rejected speaker connection from {address[0]}; {e}")
+            client_socket.close()
@@ -0,0 +1,300 @@
+# playback.py
+#
+# Schedules speech on the house's speaker zones. Every zone (speaker) has its
+# own queue and playback thread, so an announcement in the kitchen never waits
+# for a long answer in the office, and a zone's messages play in the order they
+# were queued. A message for several zones is synthesized once and the same
+# audio is fanned out to each of them while it is still being synthesized.
+#
+#   preemption  stop() cuts off the zone's current speech and drops what is queued
+#   ducking     music in a zone is lowered while speech plays and restored after
+#
+# Music playback itself is still simulated; the zone only tracks whether music
+# is playing and at what volume, which is what ducking needs.
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from intents import SYSTEM_PROMPT_PATH, load_prompt_spec
+from metrics import metrics
+
+# --- CONFIGURATION ---
+DUCK_LEVEL = 0.3  # Fraction of its volume music keeps while speech plays over it
+DEFAULT_MUSIC_VOLUME = 50
+CHUNK_WAIT_SECONDS = 0.1  # How often a waiting reader re-checks whether it was stopped
+
+
+class SharedAudio:
+    """
+    Audio that is synthesized once and played by any number of zones. The
+    synthesizer appends chunks; each reader iterates chunks() from the start
+    and blocks until the next one arrives, so playback can begin before
+    synthesis is finished.
+    """
+    def __init__(self, fmt, sample_rate=None, cached=False, trace=None):
+        self.format = fmt
+        self.sample_rate = sample_rate
+        self.cached = cached
+        self.trace = trace  # The command this is spoken for, if it was traced
+        self.path = None
+        self.error = None
+        self.created_at = time.monotonic()
+        self.first_audio_at = None
+        self._chunks = []
+        self._done = False
+        self._cond = threading.Condition()
+
+    def append(self, chunk):
+        with self._cond:
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+        if self.trace is not None:
+            self.trace.mark('tts_ready')
+
+    def finish(self, path=None, error=None):
+        with self._cond:
+            self.path = path
+            self.error = error
+            self._done = True
+            self._cond.notify_all()
+
+    def wait(self, stopped=None):
+        """Blocks until synthesis is finished. False if `stopped()` became true first."""
+        with self._cond:
+            while not self._done:
+                if stopped is not None and stopped():
+                    return False
+                self._cond.wait(CHUNK_WAIT_SECONDS)
+            return True
+
+    def chunks(self, stopped=None):
+        """Yields every chunk in order, waiting for new ones, until done or `stopped()`."""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self._chunks) and not self._done:
+                    if stopped is not None and stopped():
+                        return
+                    self._cond.wait(CHUNK_WAIT_SECONDS)
+                if index >= len(self._chunks):
+                    return
+                chunk = self._chunks[index]
+            if stopped is not None and stopped():
+                return
+            index += 1
+            yield chunk
+
+    def mark_playing(self):
+        """Records time to first audio, once, when the first zone starts playing."""
+        with self._cond:
+            if self.first_audio_at is not None:
+                return
+            self.first_audio_at = time.monotonic()
+        stage = 'tts_first_audio_hit' if self.cached else 'tts_first_audio_miss'
+        metrics.record_latency(stage, self.first_audio_at - self.created_at)
+        if self.trace is not None:
+            self.trace.mark('first_audio', self.first_audio_at)
+
+
+class SpeechJob:
+    """One message queued on one or more zones. `future` resolves when every zone is done."""
+    def __init__(self, text, audio, volume, zone_names):
+        self.text = text
+        self.audio = audio
+        self.volume = volume
+        self.future = Future()
+        self.remaining = set(zone_names)
+        self.interrupted = False
+        self.error = None
+        self.queued_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def zone_done(self, zone_name, interrupted=False, error=None):
+        with self.lock:
+            self.remaining.discard(zone_name)
+            self.interrupted = self.interrupted or interrupted
+            self.error = self.error or error
+            if self.remaining:
+                return
+        metrics.record_latency('speech_playback', time.monotonic() - self.queued_at)
+        if self.error is not None:
+            self.future.set_exception(self.error)
+        else:
+            # True if the message was spoken everywhere, False if it was stopped somewhere
+            self.future.set_result(not self.interrupted)
+
+
+class Zone:
+    """One speaker's playback queue, its worker thread and its music state."""
+    def __init__(self, name, scheduler):
+        self.name = name
+        self.scheduler = scheduler
+        self.jobs = queue.Queue()
+        self.generation = 0  # Bumped by stop(); jobs queued before that are dropped
+        self.speaking = None
+        self.music_playing = False
+        self.music_volume = DEFAULT_MUSIC_VOLUME
+        self.ducked = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._play_loop, name=f"zone-{name}", daemon=True)
+        self.thread.start()
+
+    def add(self, job):
+        with self.lock:
+            self.jobs.put((job, self.generation))
+
+    def stop(self):
+        """Cuts off the current speech and drops everything queued. Returns True if anything was stopped."""
+        with self.lock:
+            self.generation += 1
+            return self.speaking is not None or not self.jobs.empty()
+
+    def _play_loop(self):
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                self._unduck()
+                return
+            job, generation = item
+            with self.lock:
+                dropped = generation != self.generation
+                if not dropped:
+                    self.speaking = job
+            if dropped:
+                job.zone_done(self.name, interrupted=True)
+            else:
+                self._speak(job, generation)
+            if self.jobs.empty():
+                self._unduck()
+
+    def _speak(self, job, generation):
+        def stopped():
+            return self.generation != generation
+
+        self._duck()
+        error = None
+        try:
+            self.scheduler.audio_manager.play(job.audio, self.name, job.volume, stopped)
+        except Exception as e:
+            print(f"Playback Error: could not speak in '{self.name}'; {e}")
+            error = e
+        with self.lock:
+            self.speaking = None
+        job.zone_done(self.name, interrupted=stopped(), error=error)
+
+    def _duck(self):
+        if self.music_playing and not self.ducked:
+            self.ducked = True
+            metrics.increment('music_ducked')
+            print(f"Playback: ducking music in '{self.name}' to {self.effective_music_volume()}%")
+
+    def _unduck(self):
+        if self.ducked:
+            self.ducked = False
+            print(f"Playback: restoring music in '{self.name}' to {self.music_volume}%")
+
+    def effective_music_volume(self):
+        if not self.music_playing:
+            return 0
+        return round(self.music_volume * DUCK_LEVEL) if self.ducked else self.music_volume
+
+
+class PlaybackScheduler:
+    """
+    Routes speech to per-speaker zones. speak() returns immediately with a
+    Future; synthesis and playback happen on the AudioManager's and the
+    zones' threads.
+    """
+    def __init__(self, audio_manager, speakers=None, prompt_path=SYSTEM_PROMPT_PATH):
+        """
+        Args:
+            audio_manager (AudioManager): Synthesizes the audio and plays it on a zone.
+            speakers (list): Every zone name; read from the system prompt if omitted.
+        """
+        self.audio_manager = audio_manager
+        self.speakers = speakers
+        self.prompt_path = prompt_path
+        self.zones = {}
+        self.lock = threading.Lock()
+
+    def zone(self, name):
+        with self.lock:
+            zone = self.zones.get(name)
+            if zone is None:
+                zone = self.zones[name] = Zone(name, self)
+            return zone
+
+    def resolve(self, speakers):
+        """
+        Accepts a list of names, a single name or 'all'. Names that are not in
+        the speaker list (a typo from the LLM, "garage") are dropped, so only
+        real speakers get a zone and its thread.
+        """
+        if self.speakers is None:
+            self.speakers = load_prompt_spec(self.prompt_path)[0]
+        if not speakers or speakers == 'all':
+            return list(self.speakers)
+        if isinstance(speakers, str):
+            speakers = [speakers]
+        known = {speaker.lower(): speaker for speaker in self.speakers}
+        names = []
+        for name in speakers:
+            speaker = known.get(str(name).strip().lower())
+            if speaker is None:
+                print(f"Playback: ignoring unknown speaker '{name}'.")
+                metrics.increment('unknown_speakers')
+            elif speaker not in names:
+                names.append(speaker)
+        return names
+
+    def speak(self, text, speakers, volume=None):
+        """
+        Queues a message on every target zone, synthesizing it only once.
+
+        Returns:
+            Future: Resolves to True once spoken everywhere, or False if it was stopped.
+        """
+        names = self.resolve(speakers)
+        if not names:
+            future = Future()
+            future.set_result(False)  # Nowhere to say it
+            return future
+        audio = self.audio_manager.synthesize(text)
+        job = SpeechJob(text, audio, volume, names)
+        for name in names:
+            self.zone(name).add(job)
+        metrics.increment('speech_fanout', len(names))
+        return job.future
+
+    def stop(self, speakers=None):
+        """Preempts speech in the given zones (all of them by default). Returns how many zones were speaking."""
+        names = self.resolve(speakers)
+        with self.lock:
+            zones = [self.zones[name] for name in names if name in self.zones]
+        stopped = sum(1 for zone in zones if zone.stop())
+        metrics.increment('speech_preempted', stopped)
+        return stopped
+
+    def set_music(self, speakers, playing=None, volume=None):
+        """Records music state for ducking. A volume change on a ducked zone applies once speech ends."""
+        for name in self.resolve(speakers):
+            zone = self.zone(name)
+            if playing is not None:
+                zone.music_playing = playing
+            if volume is not None:
+                zone.music_volume = volume
+
+    def busy_zones(self):
+        with self.lock:
+            return sum(1 for zone in self.zones.values() if zone.speaking is not None or not zone.jobs.empty())
+
+    def shutdown(self):
+        with self.lock:
+            zones = list(self.zones.values())
+        for zone in zones:
+            zone.stop()
+            zone.jobs.put(None)
+        for zone in zones:
+            zone.thread.join()
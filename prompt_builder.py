@@ -0,0 +1,147 @@
+# prompt_builder.py
+#
+# Builds the messages sent to the LLM. system_prompt.txt is loaded and checked
+# once, then only re-read when its modification time changes. The file's text
+# is sent unchanged as the first message of every request, so the provider can
+# reuse its cached prefix; the parts that change per request (time, room,
+# device state) go in a short system message at the end instead. Conversation
+# history is trimmed to a token budget rather than a fixed number of messages.
+
+import os
+import threading
+import time
+from datetime import datetime
+
+from intents import parse_prompt_spec
+from metrics import metrics
+
+try:
+    import tiktoken
+except ImportError:  # Token counts are estimated from the text length instead
+    tiktoken = None
+
+# --- CONFIGURATION ---
+SYSTEM_PROMPT_PATH = 'system_prompt.txt'
+PROMPT_CHECK_INTERVAL = 2.0  # Seconds between checks of the file's modification time
+HISTORY_TOKEN_BUDGET = 1500  # Tokens of conversation history sent with each request
+TOKENIZER_MODEL = 'gpt-4o'
+MESSAGE_OVERHEAD_TOKENS = 4  # Per-message framing tokens in the chat format
+CHARS_PER_TOKEN = 4  # Estimate used without tiktoken
+
+
+def _build_counter():
+    if tiktoken is None:
+        return lambda text: len(text) // CHARS_PER_TOKEN + 1
+    try:
+        encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+    except KeyError:
+        encoding = tiktoken.get_encoding('o200k_base')
+    return lambda text: len(encoding.encode(text))
+
+
+count_tokens = _build_counter()
+
+
+def message_tokens(message):
+    return count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+
+class PromptBuilder:
+    """
+    Holds the validated system prompt and assembles per-request message lists.
+    Safe to share between command workers.
+    """
+    def __init__(self, path=SYSTEM_PROMPT_PATH, history_budget=HISTORY_TOKEN_BUDGET):
+        self.path = path
+        self.history_budget = history_budget
+        self.lock = threading.Lock()
+        self.prompt = None
+        self.prompt_tokens = 0
+        self.speakers = []
+        self.functions = {}
+        self.mtime = None
+        self.last_check = 0.0
+
+    def system_prompt(self):
+        """The static system prompt, reloaded if the file has changed since the last check."""
+        with self.lock:
+            now = time.monotonic()
+            if self.prompt is None or now - self.last_check >= PROMPT_CHECK_INTERVAL:
+                self.last_check = now
+                self._reload_if_changed()
+            return self.prompt
+
+    def build_messages(self, conversation_history, source_room=None, context=None):
+        """
+        Returns the full message list for one request: the static system prompt,
+        the history (which must end with the new user message) and a trailing
+        live-context message.
+
+        Args:
+            conversation_history (list): The room's messages, oldest first.
+            source_room (str): The room the command came from.
+            context (dict): Extra live facts to include, e.g. {"Device state": "..."}.
+        """
+        system_prompt = self.system_prompt()
+        lines = [f"Current Date and Time: {datetime.now().strftime('%A, %B %d, %Y %I:%M %p')}"]
+        if source_room:
+            lines.append(f"Source room: {source_room}")
+        for name, value in (context or {}).items():
+            lines.append(f"{name}: {value}")
+        live_context = {"role": "system", "content": "--- LIVE CONTEXT ---\n" + "\n".join(lines)}
+
+        messages = [{"role": "system", "content": system_prompt}, *conversation_history, live_context]
+        history_tokens = sum(message_tokens(m) for m in conversation_history)
+        context_tokens = message_tokens(live_context)
+        total = self.prompt_tokens + MESSAGE_OVERHEAD_TOKENS + history_tokens + context_tokens
+        print(f"Prompt: {total} tokens (system {self.prompt_tokens}, history {history_tokens}, "
+              f"live context {context_tokens})")
+        metrics.increment('llm_requests')
+        metrics.increment('llm_prompt_tokens', total)
+        return messages
+
+    def trim_history(self, conversation_history):
+        """
+        Drops the oldest messages (in place) until the history fits the token
+        budget. The newest message is always kept, and the history never starts
+        with an assistant reply whose question was dropped.
+        """
+        tokens = sum(message_tokens(m) for m in conversation_history)
+        while len(conversation_history) > 1 and tokens > self.history_budget:
+            tokens -= message_tokens(conversation_history.pop(0))
+        while len(conversation_history) > 1 and conversation_history[0]['role'] == 'assistant':
+            conversation_history.pop(0)
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if self.prompt is None:
+                raise FileNotFoundError(f"Error: '{self.path}' not found.")
+            print(f"Warning: '{self.path}' disappeared; keeping the loaded system prompt.")
+            return
+        if mtime == self.mtime:
+            return
+
+        with open(self.path, 'r') as f:
+            prompt = f.read()
+        speakers, functions = parse_prompt_spec(prompt)
+        problem = None
+        if not speakers:
+            problem = "it has no SPEAKERS list"
+        elif not functions:
+            problem = "it has no FUNCTION specs"
+        if problem:
+            if self.prompt is None:
+                raise ValueError(f"Invalid system prompt '{self.path}': {problem}.")
+            print(f"Warning: not reloading '{self.path}' because {problem}; keeping the previous version.")
+            self.mtime = mtime
+            return
+
+        self.prompt = prompt.rstrip()
+        self.prompt_tokens = count_tokens(self.prompt)
+        self.speakers = speakers
+        self.functions = functions
+        if self.mtime is not None:
+            print(f"Reloaded system prompt from '{self.path}'.")
+        self.mtime = mtime
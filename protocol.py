@@ -0,0 +1,245 @@
+# protocol.py
+#
+# The wire protocol between mic_client.py and the listener, shared by both sides.
+#
+# Legacy clients send their mic ID as plain text, wait for the b'\x01' ack and
+# then stream raw int16 PCM. Framed clients open with a HELLO header instead:
+#
+#   HELLO:  magic "JRVS" | version u8 | codec u8 | sample rate u32 | frame samples u16 | mic ID length u8 | mic ID
+#
+# The codec in the HELLO is the one the client would like to use. The server
+# answers with the usual ack byte followed by the codec it accepted (PCM16 if it
+# cannot decode the requested one), and the client then sends length-prefixed frames:
+#
+#   FRAME:  frame type u8 | codec u8 | payload length u16 | sequence number u32 | payload
+#
+# Keepalive frames have no payload; a client sends them instead of audio while
+# its silence gate is closed.
+
+import struct
+import threading
+import numpy as np
+
+PROTOCOL_MAGIC = b'JRVS'
+PROTOCOL_VERSION = 1
+ACK = b'\x01'
+
+HELLO_HEADER = struct.Struct('!4sBBIHB')
+FRAME_HEADER = struct.Struct('!BBHI')
+
+FRAME_AUDIO = 0
+FRAME_KEEPALIVE = 1
+
+CODEC_PCM16 = 0
+CODEC_ULAW = 1
+CODEC_ADPCM = 2
+CODEC_OPUS = 3
+
+MAX_PAYLOAD_BYTES = 0xFFFF
+
+
+def is_framed_hello(data):
+    """True if the first bytes from a client are a framed-protocol HELLO."""
+    return data[:len(PROTOCOL_MAGIC)] == PROTOCOL_MAGIC
+
+
+def pack_hello(mic_id, codec, sample_rate, frame_samples):
+    mic_id_bytes = mic_id.encode('utf-8')
+    return HELLO_HEADER.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION, codec, sample_rate,
+                             frame_samples, len(mic_id_bytes)) + mic_id_bytes
+
+
+def unpack_hello(data):
+    """
+    Parses a HELLO message.
+
+    Returns:
+        tuple: (hello dict, number of bytes consumed), or (None, 0) if the
+               message is not complete yet.
+    """
+    if len(data) < HELLO_HEADER.size:
+        return None, 0
+    magic, version, codec, sample_rate, frame_samples, id_length = HELLO_HEADER.unpack_from(data)
+    if magic != PROTOCOL_MAGIC:
+        raise ValueError("Not a framed protocol HELLO")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    end = HELLO_HEADER.size + id_length
+    if len(data) < end:
+        return None, 0
+    hello = {
+        'mic_id': bytes(data[HELLO_HEADER.size:end]).decode('utf-8', errors='replace'),
+        'codec': codec,
+        'sample_rate': sample_rate,
+        'frame_samples': frame_samples,
+    }
+    return hello, end
+
+
+def pack_ack(codec):
+    """The server's reply to a framed HELLO: the ack byte and the accepted codec."""
+    return ACK + bytes([codec])
+
+
+def pack_frame_header(frame_type, codec, payload_length, sequence):
+    return FRAME_HEADER.pack(frame_type, codec, payload_length, sequence & 0xFFFFFFFF)
+
+
+class AudioRingBuffer:
+    """
+    A fixed ring of exact-size audio windows backed by one preallocated buffer.
+
+    The writer receives straight into the current window slot with recv_into()
+    (or copies decoded audio in with write()); the reader copies whole windows
+    into its own preallocated array with pop_into(), so no bytes objects are
+    created per chunk. When the reader falls behind, the oldest window is
+    dropped. One writer thread and one reader thread may use the ring at once.
+    """
+    def __init__(self, window_samples, capacity, sample_width=2):
+        self.window_bytes = window_samples * sample_width
+        self.capacity = capacity
+        self._buffer = bytearray(self.window_bytes * capacity)
+        self._view = memoryview(self._buffer)
+        self.windows = np.frombuffer(self._buffer, dtype=np.int16).reshape(capacity, window_samples)
+        self._read_slot = 0
+        self._write_slot = 0
+        self._write_offset = 0  # Bytes already written into the current write slot
+        self.count = 0  # Complete windows waiting to be read
+        self.dropped_windows = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def writable_view(self, max_bytes=None):
+        """The free part of the current write slot, for recv_into()."""
+        start = self._write_slot * self.window_bytes + self._write_offset
+        end = (self._write_slot + 1) * self.window_bytes
+        if max_bytes is not None:
+            end = min(end, start + max_bytes)
+        return self._view[start:end]
+
+    def commit(self, n_bytes):
+        """Marks n bytes of the writable view as written. Returns the number of windows completed."""
+        self._write_offset += n_bytes
+        if self._write_offset < self.window_bytes:
+            return 0
+        with self._lock:
+            self._write_offset = 0
+            self._write_slot = (self._write_slot + 1) % self.capacity
+            self.count += 1
+            # The write slot is never readable, so at most capacity - 1 windows are kept
+            if self.count > self.capacity - 1:
+                self._read_slot = (self._read_slot + 1) % self.capacity
+                self.count -= 1
+                self.dropped_windows += 1
+        return 1
+
+    def recv_into(self, sock, max_bytes=None):
+        """
+        Receives from a socket directly into the ring.
+
+        Returns:
+            int: The number of bytes received (0 means the peer disconnected).
+        """
+        n = sock.recv_into(self.writable_view(max_bytes))
+        if n:
+            self.commit(n)
+        return n
+
+    def write(self, data):
+        """Copies bytes (e.g. decoded audio) into the ring."""
+        data = memoryview(data).cast('B')
+        while len(data):
+            view = self.writable_view()
+            n = min(len(view), len(data))
+            view[:n] = data[:n]
+            self.commit(n)
+            data = data[n:]
+
+    def pop_into(self, out):
+        """Copies the oldest complete window into `out`. Returns False if there is none."""
+        with self._lock:
+            if self.count == 0:
+                return False
+            out[:] = self.windows[self._read_slot]
+            self._read_slot = (self._read_slot + 1) % self.capacity
+            self.count -= 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._read_slot = self._write_slot
+            self._write_offset = 0
+            self.count = 0
+
+
+class RawStreamReader:
+    """Reads a legacy raw PCM stream into an AudioRingBuffer."""
+    def __init__(self, ring):
+        self.ring = ring
+        self.lost_frames = 0
+
+    def read(self, sock):
+        """Performs one recv_into. Returns the bytes received (0 means disconnected)."""
+        return self.ring.recv_into(sock)
+
+
+class FrameReader:
+    """
+    Incrementally parses framed-protocol frames from a socket. Headers go into a
+    small reusable buffer and PCM payloads are received straight into the
+    AudioRingBuffer; compressed payloads are collected in a reusable scratch
+    buffer and decoded into the ring. Works with blocking and non-blocking
+    sockets alike.
+    """
+    def __init__(self, ring, codec=CODEC_PCM16, decoder=None):
+        self.ring = ring
+        self.codec = codec
+        self.decoder = decoder  # None means payloads are raw PCM16
+        self._header = bytearray(FRAME_HEADER.size)
+        self._header_view = memoryview(self._header)
+        self._header_received = 0
+        # Only compressed streams need a scratch buffer for whole payloads
+        self._payload_view = memoryview(bytearray(MAX_PAYLOAD_BYTES)) if decoder is not None else None
+        self._payload_length = 0
+        self._payload_remaining = 0
+        self.next_sequence = None
+        self.lost_frames = 0
+        self.keepalives = 0
+        self.payload_bytes = 0  # Bytes of audio payload received, compressed or not
+
+    def read(self, sock):
+        """Performs one recv_into. Returns the bytes received (0 means disconnected)."""
+        if self._payload_remaining:
+            if self.decoder is None:
+                n = self.ring.recv_into(sock, self._payload_remaining)
+            else:
+                start = self._payload_length - self._payload_remaining
+                n = sock.recv_into(self._payload_view[start:self._payload_length])
+            self._payload_remaining -= n
+            self.payload_bytes += n
+            if n and self._payload_remaining == 0 and self.decoder is not None:
+                self.ring.write(self.decoder.decode(self._payload_view[:self._payload_length]))
+            return n
+
+        n = sock.recv_into(self._header_view[self._header_received:])
+        self._header_received += n
+        if self._header_received == FRAME_HEADER.size:
+            self._header_received = 0
+            self._on_header(*FRAME_HEADER.unpack(self._header))
+        return n
+
+    def _on_header(self, frame_type, codec, payload_length, sequence):
+        if self.next_sequence is not None and sequence != self.next_sequence:
+            self.lost_frames += (sequence - self.next_sequence) & 0xFFFFFFFF
+        self.next_sequence = (sequence + 1) & 0xFFFFFFFF
+
+        if frame_type == FRAME_KEEPALIVE:
+            self.keepalives += 1
+        elif frame_type != FRAME_AUDIO:
+            raise ValueError(f"Unknown frame type {frame_type}")
+        elif codec != self.codec:
+            raise ValueError(f"Frame codec {codec} does not match the negotiated codec {self.codec}")
+        self._payload_length = payload_length
+        self._payload_remaining = payload_length
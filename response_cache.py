@@ -0,0 +1,340 @@
+# response_cache.py
+#
+# Remembers LLM replies so a repeated command ("play my dinner playlist in the
+# kitchen") is executed again without another gpt-4o round trip. Entries are
+# keyed on the normalized transcript plus the source room, expire after a TTL,
+# and the least recently used ones are evicted past a size limit. Optionally, a
+# miss can fall back to embedding similarity so close paraphrases also hit, as
+# long as they have the same numbers and quoted names.
+#
+# Anything whose answer can change over time (the time, the weather, "turn it
+# up", "what's playing") is never cached. Neither is anything that is not a
+# command or question on its own: "yes" or "the kitchen" mean something else
+# after every question, so only transcripts that start like a full request are
+# cached, and nothing is looked up or stored while the assistant is waiting for
+# an answer. The cache is saved as gzipped JSON, with embeddings stored as
+# base64 float16, so it survives restarts.
+
+import base64
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+from device_state import STATE_QUESTION
+from intents import NUMBER, normalize, parse_number
+from metrics import metrics
+
+# --- CONFIGURATION ---
+RESPONSE_CACHE_PATH = 'cache/responses.json.gz'
+RESPONSE_CACHE_SIZE = 512  # Entries kept before the least recently used is evicted
+RESPONSE_CACHE_TTL = 24 * 3600.0  # Seconds an entry stays valid
+RESPONSE_CACHE_SAVE_INTERVAL = 60.0  # Minimum seconds between writes to disk
+EMBEDDING_MODEL = 'text-embedding-3-small'
+EMBEDDING_SIMILARITY = 0.93  # Cosine similarity needed for a paraphrase to count as a hit
+
+# Questions whose answer depends on when they are asked
+TIME_SENSITIVE = re.compile(
+    r"\b(?:time|date|day|today|tonight|tomorrow|yesterday|now|current(?:ly)?|latest|news|weather|"
+    r"forecast|temperature|score|timer|alarm|remind(?:er)?|schedule|calendar|this (?:week|month|year)|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b", re.I)
+# Commands that only make sense with the conversation or the current device state
+CONTEXT_DEPENDENT = re.compile(
+    r"\b(?:it|that|this|those|them|again|same|louder|quieter|softer|more|less|up|down|next|previous|"
+    r"back|instead|too)\b", re.I)
+# Transcripts that read as a whole request without the conversation before them
+SELF_CONTAINED = re.compile(
+    r"^(?:play|put on|start|stop|pause|resume|skip|set|turn|mute|unmute|tell|say|announce|"
+    r"what|what's|who|who's|where|when|why|how|which|is|are|was|were|do|does|did|can|will|should)\b", re.I)
+# Replies that mention a clock time or a date were answered for this moment only
+TIME_IN_REPLY = re.compile(
+    r"\b\d{1,2}:\d{2}\b|\b(?:a\.m\.|p\.m\.|am|pm|today|tomorrow|yesterday|monday|tuesday|wednesday|"
+    r"thursday|friday|saturday|sunday|january|february|march|april|may|june|july|august|september|"
+    r"october|november|december)\b", re.I)
+
+
+# The specifics a paraphrase must keep: numbers ("volume 30") and quoted names
+DETAIL = re.compile(rf"\b{NUMBER}\b|'[^']+'", re.I)
+
+
+def is_cacheable_message(message):
+    """False for transcripts that mean something different with other context, or at another time."""
+    if not SELF_CONTAINED.search(normalize(message)):
+        return False
+    return not (TIME_SENSITIVE.search(message) or CONTEXT_DEPENDENT.search(message)
+                or STATE_QUESTION.search(message))
+
+
+def is_cacheable(message, reply):
+    """False for commands whose reply may be different next time."""
+    if not is_cacheable_message(message):
+        return False
+    try:
+        command = json.loads(reply)
+    except json.JSONDecodeError:
+        return False
+    if not isinstance(command, dict) or 'function' not in command or 'parameters' not in command:
+        return False
+    spoken = command['parameters'].get('message', '') if isinstance(command['parameters'], dict) else ''
+    return not TIME_IN_REPLY.search(str(spoken))
+
+
+def details(text):
+    """The numbers (as ints, so "thirty five" == "35") and quoted names in a normalized transcript."""
+    found = []
+    for detail in DETAIL.findall(text):
+        number = parse_number(detail) if not detail.startswith("'") else None
+        found.append(number if number is not None else detail.lower())
+    return sorted(found, key=str)
+
+
+def awaits_answer(conversation_history):
+    """True if the assistant's last turn asked the user something, so the next command is an answer."""
+    for turn in reversed(conversation_history):
+        if turn['role'] != 'assistant':
+            continue
+        try:
+            command = json.loads(turn['content'])
+            spoken = command['parameters'].get('message', '')
+        except (json.JSONDecodeError, TypeError, KeyError, AttributeError):
+            spoken = turn['content']
+        return str(spoken).rstrip().endswith('?')
+    return False
+
+
+def openai_embedder(client, model=EMBEDDING_MODEL):
+    """An embed_fn for ResponseCache that uses the OpenAI embeddings API."""
+    def embed(text):
+        response = client.embeddings.create(model=model, input=text)
+        return np.asarray(response.data[0].embedding, dtype=np.float32)
+    return embed
+
+
+class CacheEntry:
+    __slots__ = ('reply', 'created_at', 'llm_seconds', 'embedding')
+
+    def __init__(self, reply, created_at, llm_seconds, embedding=None):
+        self.reply = reply
+        self.created_at = created_at  # Wall-clock time, so the TTL holds across restarts
+        self.llm_seconds = llm_seconds  # How long the LLM took; what a hit saves
+        self.embedding = embedding
+
+
+class ResponseCache:
+    """
+    A thread-safe TTL + LRU cache of LLM replies keyed on (normalized transcript,
+    source room). Pass `embed_fn` (text -> vector) to also match paraphrases.
+    """
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_entries=RESPONSE_CACHE_SIZE,
+                 ttl=RESPONSE_CACHE_TTL, embed_fn=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embed_fn = embed_fn
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def key(message, source_room):
+        return normalize(message).lower(), source_room
+
+    def lookup(self, message, source_room):
+        """Returns the cached reply for this command, or None."""
+        key = self.key(message, source_room)
+        if not is_cacheable_message(message):
+            self._count_miss()  # Never stored, and not to be taken for a paraphrase of something else
+            return None
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry.created_at > self.ttl:
+                del self.entries[key]
+                self.dirty = True
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        if entry is None and self.embed_fn is not None:
+            entry = self._similar_entry(key, now)
+
+        if entry is None:
+            self._count_miss()
+            return None
+        with self.lock:
+            self.hits += 1
+            self.saved_seconds += entry.llm_seconds
+        metrics.increment('response_cache_hit')
+        metrics.increment('llm_ms_saved_by_cache', int(entry.llm_seconds * 1000))
+        return entry.reply
+
+    def store(self, message, source_room, reply, llm_seconds):
+        """Caches an LLM reply unless it is time-sensitive or depends on context."""
+        if not is_cacheable(message, reply):
+            metrics.increment('response_cache_uncacheable')
+            return False
+        key = self.key(message, source_room)
+        embedding = None
+        if self.embed_fn is not None:
+            try:
+                embedding = self.embed_fn(key[0])
+            except Exception as e:
+                print(f"Response cache: embedding failed; {e}")
+        with self.lock:
+            self.entries[key] = CacheEntry(reply, time.time(), llm_seconds, embedding)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+            save_due = time.monotonic() - self.last_save >= RESPONSE_CACHE_SAVE_INTERVAL
+        if save_due:
+            self.save()
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                    'llm_seconds_saved': self.saved_seconds}
+
+    def _count_miss(self):
+        with self.lock:
+            self.misses += 1
+        metrics.increment('response_cache_miss')
+
+    def _similar_entry(self, key, now):
+        """
+        The freshest cached reply from the same room whose transcript means the
+        same thing, with the same numbers and names: "volume 30" and "volume 40"
+        embed almost alike.
+        """
+        wanted = details(key[0])
+        with self.lock:
+            candidates = [(k, e) for k, e in self.entries.items()
+                          if k[1] == key[1] and e.embedding is not None and now - e.created_at <= self.ttl
+                          and details(k[0]) == wanted]
+        if not candidates:
+            return None
+        try:
+            query = self.embed_fn(key[0])
+        except Exception as e:
+            print(f"Response cache: embedding failed; {e}")
+            return None
+        matrix = np.stack([e.embedding for _, e in candidates]).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-9
+        similarity = matrix @ query / norms
+        best = int(np.argmax(similarity))
+        if similarity[best] < EMBEDDING_SIMILARITY:
+            return None
+        with self.lock:
+            if candidates[best][0] in self.entries:
+                self.entries.move_to_end(candidates[best][0])
+        return candidates[best][1]
+
+    # --- PERSISTENCE ---
+
+    def save(self):
+        """Writes the cache to disk (atomically) if anything changed."""
+        with self.lock:
+            if not self.dirty:
+                return
+            rows = []
+            for (text, room), entry in self.entries.items():
+                embedding = None
+                if entry.embedding is not None:
+                    embedding = base64.b64encode(entry.embedding.astype(np.float16).tobytes()).decode('ascii')
+                rows.append([text, room, entry.reply, int(entry.created_at),
+                             round(entry.llm_seconds, 3), embedding])
+            self.dirty = False
+            self.last_save = time.monotonic()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        try:
+            with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+                json.dump(rows, f, separators=(',', ':'))
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Response cache: could not save to '{self.path}'; {e}")
+
+    def load(self):
+        """Reads the cache from disk, dropping entries that expired while we were down."""
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                rows = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            print(f"Response cache: ignoring unreadable '{self.path}'; {e}")
+            return 0
+
+        now = time.time()
+        with self.lock:
+            for text, room, reply, created_at, llm_seconds, embedding in rows:
+                if now - created_at > self.ttl:
+                    continue
+                if embedding is not None:
+                    embedding = np.frombuffer(base64.b64decode(embedding), dtype=np.float16).astype(np.float32)
+                self.entries[(text, room)] = CacheEntry(reply, created_at, llm_seconds, embedding)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return len(self.entries)
+
+
+# This block allows you to test the cache independently.
+# To run, execute `python response_cache.py` in your terminal.
+if __name__ == '__main__':
+    import tempfile
+    print("--- Testing ResponseCache ---")
+    path = os.path.join(tempfile.mkdtemp(), 'responses.json.gz')
+    cache = ResponseCache(path=path, max_entries=2)
+    playlist = json.dumps({"function": "playMusic", "parameters": {"playlist": "dinner", "speakers": ["kitchen"]}})
+    clock = json.dumps({"function": "makeSpeech", "parameters": {"speakers": ["kitchen"], "message": "It is 7:30 PM."}})
+
+    assert cache.store("Play my dinner playlist.", 'kitchen', playlist, 1.2)
+    assert cache.lookup("play my dinner playlist", 'kitchen') == playlist
+    assert cache.lookup("play my dinner playlist", 'office') is None  # Other room, other entry
+    assert not cache.store("What time is it?", 'kitchen', clock, 0.9)
+    assert not cache.store("Play it again", 'kitchen', playlist, 0.9)
+    assert not cache.store("Yes.", 'kitchen', playlist, 0.9)  # Only means something after a question
+    assert not cache.store("the kitchen", 'kitchen', playlist, 0.9)
+    assert details("set the volume to thirty five") == details("volume 35 please") == [35]
+    question = json.dumps({"function": "makeSpeech", "parameters": {"speakers": ["kitchen"],
+                                                                    "message": "Which room, the kitchen or the patio?"}})
+    assert awaits_answer([{"role": "user", "content": "play jazz"}, {"role": "assistant", "content": question}])
+    assert not awaits_answer([{"role": "assistant", "content": question}, {"role": "user", "content": "the patio"},
+                              {"role": "assistant", "content": playlist}])
+    cache.store("play jazz", 'kitchen', playlist, 1.0)
+    cache.store("play rock", 'kitchen', playlist, 1.0)  # Evicts the least recently used entry
+    assert cache.lookup("play my dinner playlist", 'kitchen') is None
+
+    # Paraphrases: this embedding only sees the first word, so everything starting alike "means the same"
+    def first_word(text):
+        vector = np.zeros(16, dtype=np.float32)
+        vector[hash(text.split()[0]) % 16] = 1.0
+        return vector
+    similar = ResponseCache(path=os.path.join(os.path.dirname(path), 'similar.json.gz'), embed_fn=first_word)
+    volume = json.dumps({"function": "setVolume", "parameters": {"speakers": ["kitchen"], "volume": 30}})
+    assert similar.store("play jazz", 'kitchen', playlist, 1.0)
+    assert similar.store("set the volume to 30", 'kitchen', volume, 1.0)
+    assert similar.lookup("play some jazz", 'kitchen') == playlist
+    assert similar.lookup("play it again", 'kitchen') is None  # Filtered before the embedding search
+    assert similar.lookup("what song is this", 'kitchen') is None
+    assert similar.lookup("set the volume to 40", 'kitchen') is None  # Another number, another command
+    assert similar.lookup("set the volume to thirty", 'kitchen') == volume
+
+    cache.save()
+    reloaded = ResponseCache(path=path)
+    assert reloaded.load() == 2 and reloaded.lookup("play rock", 'kitchen') == playlist
+    expired = ResponseCache(path=path, ttl=0.0)
+    assert expired.load() == 0
+    print(f"OK: {cache.stats()}")
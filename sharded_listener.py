@@ -0,0 +1,414 @@
+# sharded_listener.py
+#
+# LISTENER_MODE = 'sharded': the event-loop listener with wake word inference
+# spread over worker processes, so it is no longer limited to the one core the
+# GIL lets a single process use.
+#
+#   main process    accepts mic sockets and receives their audio on the selector
+#                   loop, straight into a shared-memory ring per mic; captures,
+#                   arbitration, STT and the command queue stay here
+#   shard process   holds its own wake word model and runs it, with the VAD's
+#                   noise tracking, for the mics assigned to it
+#
+# A new mic is assigned to the shard with the most free slots. When a shard
+# detects the wake word it hands the mic's ring to the main process, which
+# captures the command from it as the event server does and hands the ring back
+# when the capture ends. Shards report detections and inference stats on one
+# results queue.
+
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from listener import (CHUNK_BYTES, CHUNK_SIZE, MAX_PENDING_FRAMES, SERVER_HOST, SERVER_PORT, STT_WORKER_THREADS,
+                      EventListenerServer, start_capture)
+from metrics import metrics, startup
+from protocol import AudioRingBuffer
+from vad import VoiceActivityDetector
+from wake_word import WAKE_THRESHOLD, WakeWordEngine
+
+# --- CONFIGURATION ---
+SHARD_PROCESSES = max(1, (os.cpu_count() or 2) - 1)  # Leaves a core for the main process
+MICS_PER_SHARD = 64
+SHARD_RING_WINDOWS = MAX_PENDING_FRAMES + 1  # Per mic, as in the event server
+SHARD_STATS_INTERVAL = 1.0  # Seconds between a shard's frame/latency reports
+SHARD_START_METHOD = 'spawn'  # Inference runtimes do not survive a fork of a threaded process
+
+# Per-slot header fields in shared memory
+WRITE, READ, DROPPED, OWNER = range(4)
+HEADER_FIELDS = 4
+OWNER_SHARD, OWNER_MAIN = 0, 1  # Who takes windows out of the ring: wake word inference or a capture
+
+
+class ShardMemory:
+    """The shared memory of one shard: a header and a ring of audio windows per mic slot."""
+    def __init__(self, slots, capacity, name=None):
+        header_bytes = slots * HEADER_FIELDS * 8
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=header_bytes + slots * capacity * CHUNK_BYTES)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.headers = np.ndarray((slots, HEADER_FIELDS), dtype=np.int64, buffer=self.shm.buf)
+        self.windows = np.ndarray((slots, capacity, CHUNK_SIZE), dtype=np.int16, buffer=self.shm.buf,
+                                  offset=header_bytes)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self, unlink=False):
+        self.headers = self.windows = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # A ring view is still alive; the mapping goes with the process
+        if unlink:
+            self.shm.unlink()
+
+
+class SharedAudioRing(AudioRingBuffer):
+    """
+    An AudioRingBuffer in a ShardMemory slot, written by the main process and
+    read by whichever process owns it. The read/write counters live in shared
+    memory and change under the shard's lock. Committing a window wakes the
+    shard while it owns the ring.
+    """
+    def __init__(self, memory, slot, lock, frames_ready=None):
+        self.windows = memory.windows[slot]
+        self.capacity = self.windows.shape[0]
+        self.window_bytes = CHUNK_BYTES
+        self._header = memory.headers[slot]
+        self._view = memoryview(self.windows).cast('B')
+        self._write_offset = 0
+        self._lock = lock
+        self._frames_ready = frames_ready
+
+    @property
+    def count(self):
+        return int(self._header[WRITE] - self._header[READ])
+
+    @property
+    def dropped_windows(self):
+        return int(self._header[DROPPED])
+
+    @property
+    def owner(self):
+        return int(self._header[OWNER])
+
+    @owner.setter
+    def owner(self, owner):
+        self._header[OWNER] = owner
+
+    def writable_view(self, max_bytes=None):
+        # Only the writer moves WRITE, so it needs no lock here
+        start = int(self._header[WRITE] % self.capacity) * self.window_bytes + self._write_offset
+        end = start - self._write_offset + self.window_bytes
+        if max_bytes is not None:
+            end = min(end, start + max_bytes)
+        return self._view[start:end]
+
+    def commit(self, n_bytes):
+        self._write_offset += n_bytes
+        if self._write_offset < self.window_bytes:
+            return 0
+        self._write_offset = 0
+        with self._lock:
+            self._header[WRITE] += 1
+            # The write slot is never readable, so at most capacity - 1 windows are kept
+            if self._header[WRITE] - self._header[READ] > self.capacity - 1:
+                self._header[READ] += 1
+                self._header[DROPPED] += 1
+        if self._frames_ready is not None and self._header[OWNER] == OWNER_SHARD:
+            self._frames_ready.set()
+        return 1
+
+    def pop_into(self, out):
+        with self._lock:
+            read = self._header[READ]
+            if read == self._header[WRITE]:
+                return False
+            out[:] = self.windows[read % self.capacity]
+            self._header[READ] = read + 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._header[READ] = self._header[WRITE]
+        self._write_offset = 0
+
+    def reset(self):
+        """Readies the slot for a new mic."""
+        with self._lock:
+            self._header[:] = 0
+        self._write_offset = 0
+
+
+# --- SHARD PROCESS ---
+
+class ShardMic:
+    """A mic as a shard sees it: its ring, wake word stream and noise tracking."""
+    def __init__(self, slot, ring, mic_id, generation, wake_stream):
+        self.slot = slot
+        self.ring = ring
+        self.mic_id = mic_id
+        self.generation = generation  # Which connection of the slot this is
+        self.wake_stream = wake_stream
+        self.vad = VoiceActivityDetector()
+        self.window = np.zeros(CHUNK_SIZE, dtype=np.int16)
+
+
+def shard_worker(index, memory_name, slots, capacity, lock, frames_ready, control, results, engine_factory):
+    """The main function of a shard process."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is the main process's to handle
+    memory = ShardMemory(slots, capacity, memory_name)
+    engine = engine_factory()
+    warm_up = getattr(engine, 'warm_up', None)
+    if warm_up is not None:
+        warm_up()
+    mics = {}  # Slot -> ShardMic
+    frames, latencies = 0, []
+    next_stats = time.monotonic() + SHARD_STATS_INTERVAL
+    results.put(('ready', index))
+
+    while True:
+        while True:
+            try:
+                message = control.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'stop':
+                mics.clear()
+                memory.close()
+                return
+            if message[0] == 'open':
+                _, slot, generation, mic_id = message
+                mics[slot] = ShardMic(slot, SharedAudioRing(memory, slot, lock), mic_id, generation,
+                                      engine.create_stream(mic_id))
+            elif message[0] == 'close':
+                mics.pop(message[1], None)
+
+        if frames_ready.wait(timeout=0.1):
+            frames_ready.clear()
+            try:
+                while True:
+                    batch = _shard_tick(index, engine, mics, results, latencies)
+                    if not batch:
+                        break
+                    frames += batch
+            except Exception as e:
+                print(f"Error in wake word shard {index}: {e}")
+
+        if time.monotonic() >= next_stats:
+            results.put(('stats', index, frames, latencies))
+            frames, latencies = 0, []
+            next_stats = time.monotonic() + SHARD_STATS_INTERVAL
+
+
+def _shard_tick(index, engine, mics, results, latencies):
+    """One window per listening mic through the wake word model. Returns the number of windows run."""
+    batch = []
+    for mic in mics.values():
+        if mic.ring.owner != OWNER_SHARD or not mic.ring.pop_into(mic.window):
+            continue
+        mic.wake_stream.add_audio(mic.window)
+        mic.vad.track_noise(mic.window)
+        batch.append(mic)
+    if not batch:
+        return 0
+
+    started = time.monotonic()
+    scores = engine.predict([mic.wake_stream for mic in batch])
+    latencies.append(time.monotonic() - started)
+    for mic in batch:
+        score = scores[mic.wake_stream]
+        if score > WAKE_THRESHOLD:
+            # Reset this mic's wake word state to prevent re-triggering
+            mic.wake_stream.reset()
+            mic.ring.owner = OWNER_MAIN
+            results.put(('wake', index, mic.slot, mic.generation, float(score),
+                         mic.vad.noise_floor_db, list(mic.vad.recent_db)))
+    return len(batch)
+
+
+# --- MAIN PROCESS ---
+
+class Shard:
+    """The main process's handle on one shard process and its shared memory."""
+    def __init__(self, index, slots, context):
+        self.index = index
+        self.slots = slots
+        self.memory = ShardMemory(slots, SHARD_RING_WINDOWS)
+        self.lock = context.Lock()
+        self.frames_ready = context.Event()
+        self.control = context.Queue()
+        self.free_slots = list(range(slots - 1, -1, -1))
+        self.generation = 0
+        self.process = None
+        self.context = context
+
+    def start(self, engine_factory, results):
+        self.process = self.context.Process(
+            target=shard_worker, name=f"wake-shard-{self.index}", daemon=True,
+            args=(self.index, self.memory.name, self.slots, SHARD_RING_WINDOWS, self.lock,
+                  self.frames_ready, self.control, results, engine_factory))
+        self.process.start()
+
+    def ring(self, slot):
+        return SharedAudioRing(self.memory, slot, self.lock, self.frames_ready)
+
+    def stop(self, timeout=5.0):
+        if self.process is not None:
+            self.control.put(('stop',))
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.memory.close(unlink=True)
+
+
+class ShardedListenerServer(EventListenerServer):
+    """
+    The EventListenerServer with wake word inference in `shards` worker
+    processes, each loading its own model with `engine_factory`. The main
+    process's inference thread only feeds the captures of mics whose wake word
+    was detected.
+    """
+    def __init__(self, command_queue, engine_factory=WakeWordEngine, shards=SHARD_PROCESSES,
+                 host=SERVER_HOST, port=SERVER_PORT, workers=STT_WORKER_THREADS, stt_backend=None,
+                 mics_per_shard=MICS_PER_SHARD):
+        super().__init__(command_queue, None, host, port, workers, stt_backend)
+        self.engine_factory = engine_factory
+        context = multiprocessing.get_context(SHARD_START_METHOD)
+        self.shards = [Shard(i, mics_per_shard, context) for i in range(shards)]
+        self.results = context.Queue()
+        self.assignments = {}  # MicConnection -> (shard, slot, generation)
+        self.by_slot = {}  # (shard index, slot) -> MicConnection
+        self.results_thread = None
+        self.shards_ready = 0
+        self.ready = threading.Event()  # Set once every shard has loaded its model
+
+    def serve_forever(self):
+        for shard in self.shards:
+            shard.start(self.engine_factory, self.results)
+        self.is_running = True
+        self.results_thread = threading.Thread(target=self._results_loop, name="shard-results", daemon=True)
+        self.results_thread.start()
+        print(f"Wake word inference: {len(self.shards)} shard processes")
+        super().serve_forever()
+
+    def wait_ready(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    # --- EventListenerServer hooks ---
+
+    def _create_ring(self, conn):
+        with self.connections_lock:
+            shard = max(self.shards, key=lambda s: len(s.free_slots))
+            if not shard.free_slots:
+                raise ValueError("Every wake word shard is full")
+            slot = shard.free_slots.pop()
+            shard.generation += 1
+            self.assignments[conn] = (shard, slot, shard.generation)
+            self.by_slot[(shard.index, slot)] = conn
+        ring = shard.ring(slot)
+        ring.reset()
+        return ring
+
+    def _stream_opened(self, conn):
+        shard, slot, generation = self.assignments[conn]
+        shard.control.put(('open', slot, generation, conn.mic_id))
+        print(f"[{conn.mic_id}] Wake word inference on shard {shard.index}")
+
+    def _frames_received(self, conn):
+        # The ring wakes its shard itself; the inference thread here only serves captures
+        if conn.capture is not None:
+            self.frames_ready.set()
+
+    def _inference_tick(self):
+        with self.connections_lock:
+            capturing = [conn for conn in self.connections.values() if conn.capture is not None]
+        took_frame = False
+        for conn in capturing:
+            if conn.reader.ring.pop_into(conn.window):
+                took_frame = True
+                self._feed_capture(conn, conn.window)
+        return took_frame
+
+    def _feed_capture(self, conn, audio_chunk):
+        super()._feed_capture(conn, audio_chunk)
+        if conn.capture is None:
+            conn.reader.ring.owner = OWNER_SHARD  # Back to listening for the wake word
+
+    def _close(self, conn):
+        super()._close(conn)
+        with self.connections_lock:
+            assignment = self.assignments.pop(conn, None)
+            if assignment is None:
+                return
+            shard, slot, _ = assignment
+            self.by_slot.pop((shard.index, slot), None)
+            shard.free_slots.append(slot)
+        shard.control.put(('close', slot))
+
+    def _shutdown(self):
+        super()._shutdown()
+        if self.results_thread is not None:
+            self.results_thread.join()
+        for shard in self.shards:
+            shard.stop()
+
+    # --- Shard results ---
+
+    def _results_loop(self):
+        while self.is_running:
+            try:
+                message = self.results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                if message[0] == 'wake':
+                    self._on_wake(*message[1:])
+                elif message[0] == 'stats':
+                    _, index, frames, latencies = message
+                    metrics.increment('wake_frames', frames)
+                    for seconds in latencies:
+                        metrics.record_latency('wake_inference', seconds)
+                elif message[0] == 'ready':
+                    self.shards_ready += 1
+                    print(f"Wake word shard {message[1]} is ready")
+                    if self.shards_ready == len(self.shards):
+                        startup.milestone('wake words')
+                        self.ready.set()
+            except Exception as e:
+                print(f"Error handling a wake word shard result: {e}")
+
+    def _on_wake(self, index, slot, generation, score, noise_floor_db, recent_db):
+        with self.connections_lock:
+            conn = self.by_slot.get((index, slot))
+            if conn is None or self.assignments[conn][2] != generation:
+                return  # That mic has disconnected since
+        print(f"\n--- Wake Word Detected on [{conn.mic_id}]! ---")
+        # Continue from the noise floor the shard learned, for the SNR and the capture's VAD
+        conn.vad.noise_floor_db = noise_floor_db
+        conn.vad.recent_db.clear()
+        conn.vad.recent_db.extend(recent_db)
+        print(f"[{conn.mic_id}] Capturing command (VAD enabled)...")
+        capture = start_capture(conn.mic_id, conn.vad, self.transcriber, self.arbiter, score, self.rate_limiter)
+        if capture is None:
+            conn.reader.ring.owner = OWNER_SHARD
+            return
+        # Attach it only if the mic is still connected: once _close() has run, nothing would feed or end it
+        with self.connections_lock:
+            connected = any(other is conn for other in self.connections.values())
+            if connected:
+                conn.capture = capture
+        if not connected:
+            print(f"[{conn.mic_id}] Disconnected before its capture started.")
+            capture.finish()  # Releases its arbitration claim and STT job
+            return
+        self.frames_ready.set()
@@ -0,0 +1,164 @@
+import pyaudio
+import socket
+import threading
+from collections import deque
+import numpy as np
+
+# protocol.py and audio_codec.py must be copied next to this script on the speaker device
+from audio_codec import CODEC_NAMES, available_codecs, create_codec
+from protocol import ACK, CODEC_PCM16, FRAME_AUDIO, FRAME_HEADER, pack_hello
+
+# --- CONFIGURATION ---
+SERVER_HOST = '10.0.0.145'  # <-- IMPORTANT: Change this to the IP address of your main server
+SERVER_PORT = 12346         # The port the output engine's speaker server is waiting on
+SPEAKER_ID = "kitchen"      # Must be one of the SPEAKERS in system_prompt.txt
+
+# Audio stream settings (must match the output engine's)
+FRAME_SAMPLES = 320  # 20 ms
+FORMAT = pyaudio.paInt16
+CHANNELS = 1
+RATE = 16000
+
+# Codec to ask the server for: 'pcm16', 'ulaw', 'adpcm' or 'opus'. The server
+# may answer with a different one; pcm16 always works.
+PREFERRED_CODEC = 'ulaw'
+
+# Jitter buffer: playback starts once JITTER_BUFFER_FRAMES have arrived (and
+# again after the buffer runs dry), so network jitter up to that much does not
+# cause gaps. Beyond MAX_BUFFERED_FRAMES the oldest frames are dropped so a
+# speaker that fell behind catches up with the others. Missing frames (by
+# sequence number) are replaced with silence to keep the timing.
+JITTER_BUFFER_FRAMES = 3  # 60 ms
+MAX_BUFFERED_FRAMES = 10  # 200 ms
+MAX_GAP_FRAMES = 5
+
+
+class JitterBuffer:
+    """Decoded frames waiting to be played, ordered by the server's sequence numbers."""
+    def __init__(self):
+        self.frames = deque()
+        self.cond = threading.Condition()
+        self.next_sequence = None
+        self.playing = False
+        self.silence = np.zeros(FRAME_SAMPLES, dtype=np.int16)
+        self.late_frames = 0
+        self.lost_frames = 0
+        self.dropped_frames = 0
+
+    def push(self, sequence, samples):
+        with self.cond:
+            if self.next_sequence is not None:
+                gap = (sequence - self.next_sequence) & 0xFFFFFFFF
+                if gap >= 0x80000000:
+                    self.late_frames += 1  # Older than what was already played
+                    return
+                if 0 < gap <= MAX_GAP_FRAMES and self.frames:
+                    self.lost_frames += gap
+                    self.frames.extend([self.silence] * gap)
+            self.next_sequence = (sequence + 1) & 0xFFFFFFFF
+            self.frames.append(samples)
+            while len(self.frames) > MAX_BUFFERED_FRAMES:
+                self.frames.popleft()
+                self.dropped_frames += 1
+            self.cond.notify()
+
+    def pop(self):
+        """Blocks until a frame may be played."""
+        with self.cond:
+            while not (self.playing and self.frames):
+                if len(self.frames) >= JITTER_BUFFER_FRAMES:
+                    self.playing = True
+                    break
+                self.cond.wait()
+            frame = self.frames.popleft()
+            if not self.frames:
+                self.playing = False  # Ran dry: buffer up again before the next frame
+            return frame
+
+
+def recv_exact(client_socket, view):
+    """Fills a memoryview from the socket. Returns False if the server disconnected."""
+    received = 0
+    while received < len(view):
+        n = client_socket.recv_into(view[received:])
+        if not n:
+            return False
+        received += n
+    return True
+
+
+def receive_audio(client_socket, decoder, jitter):
+    """Reads frames from the server and hands the decoded audio to the jitter buffer."""
+    header = bytearray(FRAME_HEADER.size)
+    payload = bytearray(0xFFFF)
+    header_view, payload_view = memoryview(header), memoryview(payload)
+    while True:
+        if not recv_exact(client_socket, header_view):
+            return
+        frame_type, codec, length, sequence = FRAME_HEADER.unpack(header)
+        if not recv_exact(client_socket, payload_view[:length]):
+            return
+        if frame_type == FRAME_AUDIO and length:
+            jitter.push(sequence, decoder.decode(payload_view[:length]))
+
+
+def play_audio(stream, jitter):
+    while True:
+        stream.write(jitter.pop().tobytes())
+
+
+def connect(client_socket, preferred_codec=PREFERRED_CODEC):
+    """Sends the HELLO and returns the codec the server accepted, or None."""
+    codec_ids = {name: codec for codec, name in CODEC_NAMES.items()}
+    requested = codec_ids.get(preferred_codec, CODEC_PCM16)
+    if requested not in available_codecs():
+        print(f"Codec '{preferred_codec}' is not available here, asking for pcm16.")
+        requested = CODEC_PCM16
+    client_socket.sendall(pack_hello(SPEAKER_ID, requested, RATE, FRAME_SAMPLES))
+
+    reply = client_socket.recv(2)
+    if len(reply) == 1:
+        reply += client_socket.recv(1)
+    if len(reply) != 2 or reply[:1] != ACK:
+        print("Server did not acknowledge. Closing.")
+        return None
+    return reply[1]
+
+
+def main():
+    """Connects to the server and plays what it sends until the connection drops."""
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    audio = pyaudio.PyAudio()
+    stream = None
+    try:
+        print(f"Attempting to connect to server at {SERVER_HOST}:{SERVER_PORT}...")
+        client_socket.connect((SERVER_HOST, SERVER_PORT))
+        codec = connect(client_socket)
+        if codec is None:
+            return
+        print(f"Connected as '{SPEAKER_ID}', receiving codec '{CODEC_NAMES.get(codec, codec)}'.")
+
+        stream = audio.open(format=FORMAT, channels=CHANNELS, rate=RATE, output=True,
+                            frames_per_buffer=FRAME_SAMPLES)
+        jitter = JitterBuffer()
+        threading.Thread(target=play_audio, args=(stream, jitter), daemon=True).start()
+        receive_audio(client_socket, create_codec(codec, RATE), jitter)
+        print(f"Connection to the server was lost (late {jitter.late_frames}, lost {jitter.lost_frames}, "
+              f"dropped {jitter.dropped_frames} frames).")
+    except ConnectionRefusedError:
+        print("Connection refused. Is main.py running with AUDIO_OUTPUT = 'zones'?")
+    except KeyboardInterrupt:
+        print("Stopping.")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+    finally:
+        if stream:
+            stream.stop_stream()
+            stream.close()
+        audio.terminate()
+        client_socket.close()
+        print("Stream and connection closed.")
+
+
+if __name__ == "__main__":
+    main()
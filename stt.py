@@ -0,0 +1,198 @@
+# stt.py
+#
+# Speech-to-text backends for the listener. Every backend hands out one stream
+# per utterance: audio is pushed in 80 ms chunks while VAD capture is still
+# running, and finish() returns the final text once speech has ended.
+#
+#   google          speech_recognition's recognize_google (network, batch only)
+#   vosk            local Kaldi models via the vosk package (true streaming)
+#   faster_whisper  local Whisper via faster-whisper (re-decodes the buffer for partials)
+
+import json
+import numpy as np
+
+# --- CONFIGURATION ---
+STT_BACKEND = 'google'  # 'google', 'vosk' or 'faster_whisper'
+VOSK_MODEL_PATH = 'models/vosk-model-small-en-us-0.15'
+WHISPER_MODEL = 'base.en'
+WHISPER_COMPUTE_TYPE = 'int8'
+WHISPER_PARTIAL_INTERVAL = 1.0  # Seconds of new audio between partial re-decodes
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+
+class STTError(Exception):
+    """The STT engine failed (network error, missing model...), as opposed to not understanding."""
+
+
+class STTStream:
+    """One utterance being transcribed. Backends override accept_audio() and finish()."""
+    def accept_audio(self, pcm_bytes):
+        """
+        Feeds a chunk of 16 kHz int16 audio.
+
+        Returns:
+            str or None: A partial hypothesis if the engine has a new one.
+        """
+        raise NotImplementedError
+
+    def finish(self):
+        """
+        Ends the utterance.
+
+        Returns:
+            str or None: The final text, or None if nothing was understood.
+        """
+        raise NotImplementedError
+
+
+class STTBackend:
+    """Creates STTStreams. One backend instance is shared by all STT workers."""
+    name = 'base'
+    streaming = False  # True if the engine does real work while audio is still arriving
+
+    def start_stream(self):
+        raise NotImplementedError
+
+
+# --- GOOGLE (speech_recognition) ---
+
+class GoogleSTTStream(STTStream):
+    def __init__(self, sr, recognizer):
+        self.sr = sr
+        self.recognizer = recognizer
+        self.chunks = []
+
+    def accept_audio(self, pcm_bytes):
+        self.chunks.append(pcm_bytes)
+        return None
+
+    def finish(self):
+        audio_data = self.sr.AudioData(b''.join(self.chunks), SAMPLE_RATE, SAMPLE_WIDTH)
+        try:
+            return self.recognizer.recognize_google(audio_data)
+        except self.sr.UnknownValueError:
+            return None
+        except self.sr.RequestError as e:
+            raise STTError(f"STT service error; {e}") from e
+
+
+class GoogleSTT(STTBackend):
+    """The original backend: the whole utterance goes to Google after capture ends."""
+    name = 'google'
+
+    def __init__(self):
+        import speech_recognition  # Only this backend needs it
+        self._sr = speech_recognition
+
+    def start_stream(self):
+        return GoogleSTTStream(self._sr, self._sr.Recognizer())
+
+
+# --- VOSK ---
+
+class VoskSTTStream(STTStream):
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+        self.finished_text = []
+        self.last_partial = None
+
+    def accept_audio(self, pcm_bytes):
+        if self.recognizer.AcceptWaveform(bytes(pcm_bytes)):
+            # Vosk found a pause and finalized a segment
+            text = json.loads(self.recognizer.Result()).get('text', '')
+            if text:
+                self.finished_text.append(text)
+            return ' '.join(self.finished_text) or None
+        partial = json.loads(self.recognizer.PartialResult()).get('partial', '')
+        if partial and partial != self.last_partial:
+            self.last_partial = partial
+            return ' '.join(self.finished_text + [partial])
+        return None
+
+    def finish(self):
+        text = json.loads(self.recognizer.FinalResult()).get('text', '')
+        if text:
+            self.finished_text.append(text)
+        return ' '.join(self.finished_text) or None
+
+
+class VoskSTT(STTBackend):
+    """Offline streaming recognition. Most of the decoding happens while the user speaks."""
+    name = 'vosk'
+    streaming = True
+
+    def __init__(self, model_path=VOSK_MODEL_PATH):
+        try:
+            import vosk
+        except ImportError as e:
+            raise STTError("The vosk backend needs `pip install vosk`") from e
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        self.model = vosk.Model(model_path)
+
+    def start_stream(self):
+        return VoskSTTStream(self._vosk.KaldiRecognizer(self.model, SAMPLE_RATE))
+
+
+# --- FASTER-WHISPER ---
+
+class WhisperSTTStream(STTStream):
+    def __init__(self, backend):
+        self.backend = backend
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.samples_at_last_decode = 0
+
+    def accept_audio(self, pcm_bytes):
+        samples = np.frombuffer(pcm_bytes, dtype=np.int16).astype(np.float32) / 32768.0
+        self.audio = np.concatenate((self.audio, samples))
+        if len(self.audio) - self.samples_at_last_decode < WHISPER_PARTIAL_INTERVAL * SAMPLE_RATE:
+            return None
+        self.samples_at_last_decode = len(self.audio)
+        return self.backend.transcribe(self.audio) or None
+
+    def finish(self):
+        if len(self.audio) == 0:
+            return None
+        return self.backend.transcribe(self.audio) or None
+
+
+class FasterWhisperSTT(STTBackend):
+    """
+    Offline Whisper on CPU. Whisper is not a streaming model, so partials come
+    from re-decoding the audio so far, and the final pass decodes the whole
+    utterance once more. Use a small model to keep that pass short.
+    """
+    name = 'faster_whisper'
+    streaming = True
+
+    def __init__(self, model_name=WHISPER_MODEL, compute_type=WHISPER_COMPUTE_TYPE):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as e:
+            raise STTError("The faster_whisper backend needs `pip install faster-whisper`") from e
+        self.model = WhisperModel(model_name, device='cpu', compute_type=compute_type)
+
+    def transcribe(self, audio):
+        segments, _ = self.model.transcribe(audio, language='en', beam_size=1,
+                                            vad_filter=False, without_timestamps=True)
+        return ' '.join(segment.text.strip() for segment in segments).strip()
+
+    def start_stream(self):
+        return WhisperSTTStream(self)
+
+
+STT_BACKENDS = {
+    'google': GoogleSTT,
+    'vosk': VoskSTT,
+    'faster_whisper': FasterWhisperSTT,
+}
+
+
+def create_stt_backend(name=STT_BACKEND):
+    """Builds the configured backend. Local models are loaded here, once."""
+    backend_class = STT_BACKENDS.get(name)
+    if backend_class is None:
+        raise ValueError(f"Unknown STT backend '{name}'. Choose one of: {', '.join(STT_BACKENDS)}")
+    return backend_class()
@@ -0,0 +1,303 @@
+# tracing.py
+#
+# Follows one command from the wake word to the first audio out. A Trace is
+# created when the wake word fires and travels with the command: on the
+# TranscriptionJob, in the Command on the command queue, and on the command,
+# dispatcher and TTS threads as the thread's current trace. Each stage marks
+# a monotonic timestamp:
+#
+#   wake        wake word detected
+#   arbitrated  this mic won the wake word arbitration against adjacent mics
+#   vad_end     end of speech (VAD)
+#   stt         final transcript ready
+#   queued      command put on the command queue
+#   dequeued    a command worker picked it up
+#   resolved    the reply is known (local intent, response cache or LLM)
+#   parsed      the reply has been parsed into function calls
+#   dispatched  the first handler started running
+#   tts_ready   the first synthesized audio is available
+#   first_audio the first zone started playing it
+#   done        the command and everything it started (speech) has finished
+#
+# Finished traces are appended to a JSONL file (see start_trace_log) and their
+# stage durations are recorded in the metrics registry as 'trace_<span>'.
+#
+# Usage: python tracing.py [traces.jsonl] [--route llm] [--room kitchen] [--histogram]
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from metrics import metrics
+
+# --- CONFIGURATION ---
+TRACE_LOG_PATH = 'logs/traces.jsonl'  # Where main.py appends finished traces
+
+# Durations reported per trace: (name, from mark, to mark). Marks missing from
+# a trace (a cached reply is never parsed, a setVolume never speaks) skip the span.
+SPANS = [
+    ('arbitration', 'wake', 'arbitrated'),
+    ('capture', 'wake', 'vad_end'),
+    ('stt', 'vad_end', 'stt'),
+    ('queue_wait', 'queued', 'dequeued'),
+    ('resolve', 'dequeued', 'resolved'),
+    ('parse', 'resolved', 'parsed'),
+    ('first_action', 'dequeued', 'dispatched'),  # A streamed reply dispatches before it is resolved
+    ('tts', 'dispatched', 'tts_ready'),
+    ('playback_start', 'tts_ready', 'first_audio'),
+    ('speech_to_audio', 'vad_end', 'first_audio'),  # What the user waits for after speaking
+    ('total', 'wake', 'done'),
+]
+HISTOGRAM_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class Trace:
+    """
+    The stage timestamps of one command. Marks are first-wins, so a stage
+    reached several times (every sentence of a streamed reply is synthesized)
+    records when it was first reached.
+
+    The trace is written out once it has ended and nothing holds it any more:
+    the command worker ends it, while dispatched handlers and the speech they
+    start hold it until they finish.
+    """
+    def __init__(self, source_room, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:12]
+        self.source_room = source_room
+        self.started_at = time.time()
+        self.origin = time.monotonic()
+        self.marks = {}
+        self.attributes = {}
+        self.outcome = None
+        self._holds = 0
+        self._exported = False
+        self._lock = threading.Lock()
+
+    def mark(self, stage, at=None):
+        with self._lock:
+            if stage not in self.marks:
+                self.marks[stage] = time.monotonic() if at is None else at
+
+    def annotate(self, **attributes):
+        """Adds details to the exported record, e.g. route='llm'."""
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def hold(self):
+        with self._lock:
+            self._holds += 1
+
+    def release(self):
+        with self._lock:
+            self._holds -= 1
+        self._maybe_export()
+
+    def end(self, outcome='ok'):
+        """Ends the trace; it is exported as soon as nothing holds it."""
+        with self._lock:
+            if self.outcome is None:
+                self.outcome = outcome
+        self._maybe_export()
+
+    def spans(self):
+        """Seconds spent in each SPANS stage this trace has both marks for."""
+        with self._lock:
+            marks = dict(self.marks)
+        return {name: marks[end] - marks[start] for name, start, end in SPANS
+                if start in marks and end in marks}
+
+    def to_record(self):
+        with self._lock:
+            return {
+                'trace_id': self.trace_id,
+                'room': self.source_room,
+                'started_at': round(self.started_at, 3),
+                'outcome': self.outcome,
+                **self.attributes,
+                # Milliseconds since the trace was created (at the wake word, if it has one)
+                'marks': {stage: round((at - self.origin) * 1000, 1)
+                          for stage, at in sorted(self.marks.items(), key=lambda item: item[1])},
+            }
+
+    def _maybe_export(self):
+        with self._lock:
+            if self._exported or self.outcome is None or self._holds > 0:
+                return
+            self._exported = True
+        self.mark('done')
+        trace_log.export(self)
+
+
+# --- CURRENT TRACE ---
+# The trace of the command a thread is working on, so the dispatcher, the
+# playback scheduler and the TTS can mark stages without it being passed
+# through every call.
+
+_local = threading.local()
+
+
+def current():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def activate(trace):
+    """Makes `trace` (which may be None) the current trace for the duration of the block."""
+    previous = current()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+def mark(stage):
+    """Marks a stage on the current trace, if there is one."""
+    trace = current()
+    if trace is not None:
+        trace.mark(stage)
+
+
+def annotate(**attributes):
+    trace = current()
+    if trace is not None:
+        trace.annotate(**attributes)
+
+
+# --- EXPORT ---
+
+class TraceLog:
+    """Records finished traces in the metrics registry and, once opened, in a JSONL file."""
+    def __init__(self):
+        self.path = None
+        self._lock = threading.Lock()
+
+    def open(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def export(self, trace):
+        for name, seconds in trace.spans().items():
+            metrics.record_latency(f'trace_{name}', seconds)
+        metrics.increment(f'trace_outcome_{trace.outcome}')
+        if self.path is None:
+            return
+        line = json.dumps(trace.to_record())
+        try:
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            print(f"Tracing: could not write to {self.path}; {e}")
+
+
+# The process-wide trace exporter; main.py opens its file at startup
+trace_log = TraceLog()
+
+
+def start_trace_log(path=TRACE_LOG_PATH):
+    trace_log.open(path)
+    print(f"Tracing: writing command traces to {path}")
+
+
+# --- SUMMARY CLI ---
+
+def load_traces(path):
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # A line cut short by a crash
+    return records
+
+
+def record_spans(record):
+    """The SPANS durations (ms) of an exported record."""
+    marks = record.get('marks', {})
+    return {name: marks[end] - marks[start] for name, start, end in SPANS
+            if start in marks and end in marks}
+
+
+def percentile(ordered, fraction):
+    return ordered[int((len(ordered) - 1) * fraction)]
+
+
+def summarize(records):
+    """Per span: (count, p50, p95, p99, max) in milliseconds, in SPANS order."""
+    values = {name: [] for name, _, _ in SPANS}
+    for record in records:
+        for name, ms in record_spans(record).items():
+            values[name].append(ms)
+    summary = {}
+    for name, samples in values.items():
+        if samples:
+            ordered = sorted(samples)
+            summary[name] = (len(ordered), percentile(ordered, 0.50), percentile(ordered, 0.95),
+                             percentile(ordered, 0.99), ordered[-1])
+    return summary, values
+
+
+def histogram(samples):
+    """Counts per HISTOGRAM_BUCKETS_MS upper bound, plus one for anything slower."""
+    counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+    for ms in samples:
+        for i, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if ms <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarizes command traces per stage (p50/p95/p99).")
+    parser.add_argument('path', nargs='?', default=TRACE_LOG_PATH)
+    parser.add_argument('--route', help="Only traces resolved this way: intent, cache or llm")
+    parser.add_argument('--room', help="Only traces from this source room")
+    parser.add_argument('--histogram', action='store_true', help="Also print a histogram per stage")
+    args = parser.parse_args(argv)
+
+    try:
+        records = load_traces(args.path)
+    except FileNotFoundError:
+        print(f"No trace log at {args.path}")
+        return
+    if args.route:
+        records = [r for r in records if r.get('route') == args.route]
+    if args.room:
+        records = [r for r in records if r.get('room') == args.room]
+
+    outcomes = {}
+    for record in records:
+        outcomes[record.get('outcome')] = outcomes.get(record.get('outcome'), 0) + 1
+    routes = {}
+    for record in records:
+        if 'route' in record:
+            routes[record['route']] = routes.get(record['route'], 0) + 1
+    print(f"--- {len(records)} traces from {args.path} ---")
+    print("outcomes: " + ", ".join(f"{k}={v}" for k, v in sorted(outcomes.items(), key=str)))
+    if routes:
+        print("routes:   " + ", ".join(f"{k}={v}" for k, v in sorted(routes.items())))
+
+    summary, values = summarize(records)
+    print(f"\n{'stage':<16} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, (count, p50, p95, p99, worst) in summary.items():
+        print(f"{name:<16} {count:>6} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {worst:>9.1f}")
+
+    if args.histogram:
+        labels = [f"<={b}" for b in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]}"]
+        print(f"\n{'stage':<16} " + " ".join(f"{label:>7}" for label in labels))
+        for name in summary:
+            print(f"{name:<16} " + " ".join(f"{n:>7}" for n in histogram(values[name])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+# tts.py
+#
+# Text-to-speech backends and the synthesized-audio cache used by AudioManager.
+#
+#   gtts    Google Translate TTS via gTTS (network, MP3, the original backend)
+#   piper   local neural voices via the piper binary (raw PCM, streamed)
+#   espeak  local formant synthesis via espeak-ng (WAV on stdout, streamed)
+#
+# Offline backends yield int16 PCM while they are still synthesizing, so
+# playback can start after the first chunk. Every finished clip is stored in a
+# content-addressed cache (in memory and on disk) keyed by backend, voice,
+# language and text, so repeated phrases skip synthesis entirely.
+
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+import wave
+from collections import OrderedDict
+
+# --- CONFIGURATION ---
+TTS_BACKEND = 'gtts'  # 'gtts', 'piper' or 'espeak'
+TTS_LANG = 'en'
+PIPER_BINARY = 'piper'
+PIPER_MODEL = 'models/en_US-lessac-medium.onnx'
+ESPEAK_BINARY = 'espeak-ng'
+ESPEAK_VOICE = 'en-us'
+PCM_CHUNK_BYTES = 4096  # Bytes read from the synthesizer per streamed chunk
+
+TTS_CACHE_DIR = 'cache/tts'
+TTS_MEMORY_CACHE_BYTES = 32 * 1024 * 1024  # Clips kept in memory before the least recently used is dropped
+TTS_DISK_CACHE_BYTES = 512 * 1024 * 1024  # Clips kept on disk before the least recently used are deleted
+TTS_DISK_CACHE_MAX_AGE = 30 * 24 * 3600.0  # Seconds unused before a clip on disk is deleted at startup
+
+FORMAT_MP3 = 'mp3'
+FORMAT_PCM16 = 'pcm16'  # Mono, little-endian int16
+
+
+class TTSError(Exception):
+    """The TTS engine failed (network error, missing binary or voice...)."""
+
+
+class AudioClip:
+    """One synthesized phrase. `path` is set once the clip is on disk."""
+    def __init__(self, fmt, data, sample_rate=None, path=None):
+        self.format = fmt
+        self.data = data
+        self.sample_rate = sample_rate
+        self.path = path
+
+
+class TTSBackend:
+    """
+    Synthesizes speech. stream() yields the audio in chunks of `format`;
+    backends with `streaming = True` yield PCM as it is produced.
+    """
+    name = 'base'
+    voice = ''
+    format = FORMAT_PCM16
+    sample_rate = None
+    streaming = False
+
+    def stream(self, text, lang=TTS_LANG):
+        raise NotImplementedError
+
+
+# --- GTTS ---
+
+class GTTSBackend(TTSBackend):
+    """The original backend. MP3 has to be complete before playsound can play it."""
+    name = 'gtts'
+    voice = 'google'
+    format = FORMAT_MP3
+
+    def __init__(self):
+        from gtts import gTTS, gTTSError
+        self._gtts = gTTS
+        self._error = gTTSError
+
+    def stream(self, text, lang=TTS_LANG):
+        try:
+            yield from self._gtts(text=text, lang=lang, slow=False).stream()
+        except self._error as e:
+            raise TTSError(f"gTTS failed; {e}") from e
+
+
+# --- OFFLINE (subprocess) BACKENDS ---
+
+class _SubprocessBackend(TTSBackend):
+    streaming = True
+
+    def _run(self, command, stdin_text=None, skip_header=0):
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL)
+        except OSError as e:
+            raise TTSError(f"Could not start {command[0]}; {e}") from e
+        if stdin_text is not None:
+            # Write on a thread so a long text cannot deadlock against a full stdout pipe
+            def feed():
+                try:
+                    process.stdin.write(stdin_text.encode('utf-8'))
+                    process.stdin.close()
+                except OSError:
+                    pass
+            threading.Thread(target=feed, daemon=True).start()
+        else:
+            process.stdin.close()
+
+        completed = False
+        try:
+            pending = skip_header
+            odd_byte = b''
+            while True:
+                chunk = process.stdout.read1(PCM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                if pending:
+                    dropped = min(pending, len(chunk))
+                    chunk = chunk[dropped:]
+                    pending -= dropped
+                chunk = odd_byte + chunk
+                # Only yield whole int16 samples
+                odd_byte = chunk[-1:] if len(chunk) % 2 else b''
+                chunk = chunk[:len(chunk) - len(odd_byte)]
+                if chunk:
+                    yield chunk
+            completed = True
+        finally:
+            if not completed:
+                process.kill()  # Playback was abandoned
+            process.stdout.close()
+            process.wait()
+        if process.returncode != 0:
+            raise TTSError(f"{command[0]} exited with status {process.returncode}")
+
+
+class PiperBackend(_SubprocessBackend):
+    """Piper neural TTS. Reads text on stdin and writes raw PCM at the voice's sample rate."""
+    name = 'piper'
+
+    def __init__(self, model_path=PIPER_MODEL, binary=PIPER_BINARY):
+        config_path = model_path + '.json'
+        try:
+            with open(config_path, 'r') as f:
+                self.sample_rate = json.load(f)['audio']['sample_rate']
+        except (OSError, KeyError, ValueError) as e:
+            raise TTSError(f"Could not read the piper voice config '{config_path}'; {e}") from e
+        self.model_path = model_path
+        self.binary = binary
+        self.voice = os.path.basename(model_path)
+
+    def stream(self, text, lang=TTS_LANG):
+        # Piper voices are single-language; `lang` is part of the cache key only
+        return self._run([self.binary, '--model', self.model_path, '--output-raw'], stdin_text=text)
+
+
+class EspeakBackend(_SubprocessBackend):
+    """espeak-ng. Writes a 22.05 kHz WAV to stdout; its 44-byte header is skipped."""
+    name = 'espeak'
+    sample_rate = 22050
+    WAV_HEADER_BYTES = 44
+
+    def __init__(self, voice=ESPEAK_VOICE, binary=ESPEAK_BINARY):
+        self.voice = voice
+        self.binary = binary
+
+    def stream(self, text, lang=TTS_LANG):
+        voice = self.voice if self.voice.startswith(lang) else lang
+        return self._run([self.binary, '--stdout', '-v', voice, '--stdin'], stdin_text=text,
+                         skip_header=self.WAV_HEADER_BYTES)
+
+
+TTS_BACKENDS = {
+    'gtts': GTTSBackend,
+    'piper': PiperBackend,
+    'espeak': EspeakBackend,
+}
+
+
+def create_tts_backend(name=TTS_BACKEND):
+    backend_class = TTS_BACKENDS.get(name)
+    if backend_class is None:
+        raise ValueError(f"Unknown TTS backend '{name}'. Choose one of: {', '.join(TTS_BACKENDS)}")
+    return backend_class()
+
+
+# --- CACHE ---
+
+class TTSCache:
+    """
+    Content-addressed cache of synthesized clips: an in-memory LRU (bounded
+    by total bytes) in front of one file per clip in `directory`. MP3 clips
+    are stored as-is; PCM clips as WAV so their sample rate is kept. The
+    files are an LRU too, bounded by `disk_bytes`; a file's mtime is its last
+    use, and clips unused for `max_age` are deleted at startup.
+    """
+    def __init__(self, directory=TTS_CACHE_DIR, memory_bytes=TTS_MEMORY_CACHE_BYTES,
+                 disk_bytes=TTS_DISK_CACHE_BYTES, max_age=TTS_DISK_CACHE_MAX_AGE):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.disk_bytes = disk_bytes
+        self.max_age = max_age
+        self.disk = OrderedDict()  # key -> (path, size), least recently used first
+        self.disk_used = 0
+        self.lock = threading.Lock()
+        self._scan_disk()
+
+    @staticmethod
+    def key(backend, text, lang=TTS_LANG):
+        identity = '\0'.join((backend.name, backend.voice, lang, text))
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the cached AudioClip, or None. A disk hit is promoted to memory."""
+        with self.lock:
+            clip = self.memory.get(key)
+            if clip is not None:
+                self.memory.move_to_end(key)
+        if clip is None:
+            clip = self._read(key)
+            if clip is not None:
+                self._remember(key, clip)
+        if clip is not None:
+            self._touch(key)
+        return clip
+
+    def put(self, key, clip):
+        """Stores a finished clip. Returns it with `path` set (playsound needs a file)."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key + ('.mp3' if clip.format == FORMAT_MP3 else '.wav'))
+        temp_path = path + '.tmp'
+        try:
+            if clip.format == FORMAT_MP3:
+                with open(temp_path, 'wb') as f:
+                    f.write(clip.data)
+            else:
+                with wave.open(temp_path, 'wb') as wav:
+                    wav.setnchannels(1)
+                    wav.setsampwidth(2)
+                    wav.setframerate(clip.sample_rate)
+                    wav.writeframes(clip.data)
+            os.replace(temp_path, path)
+            size = os.path.getsize(path)
+            clip.path = path
+        except OSError as e:
+            print(f"TTS cache: could not write '{path}'; {e}")
+        self._remember(key, clip)
+        if clip.path is not None:
+            with self.lock:
+                self._index(key, path, size)
+                self._evict_disk()
+        return clip
+
+    def _scan_disk(self):
+        """Indexes the clips already on disk, deleting stale, partial and excess ones."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"TTS cache: could not list '{self.directory}'; {e}")
+            return
+        now = time.time()
+        found = []
+        removed = 0
+        for name in names:
+            path = os.path.join(self.directory, name)
+            key, extension = os.path.splitext(name)
+            try:
+                stat = os.stat(path)
+                if extension == '.tmp' or now - stat.st_mtime > self.max_age:
+                    os.remove(path)  # Left over from a crash, or not used for a long time
+                    removed += 1
+                elif extension in ('.mp3', '.wav'):
+                    found.append((stat.st_mtime, key, path, stat.st_size))
+            except OSError as e:
+                print(f"TTS cache: could not check '{path}'; {e}")
+        with self.lock:
+            for _, key, path, size in sorted(found):
+                self._index(key, path, size)
+            removed += self._evict_disk()
+        if removed:
+            print(f"TTS cache: removed {removed} old clips; {len(self.disk)} kept "
+                  f"({self.disk_used / (1024 * 1024):.1f} MB)")
+
+    def _index(self, key, path, size):
+        """Records a clip file as the most recently used. Call with the lock held."""
+        previous = self.disk.pop(key, None)
+        if previous is not None:
+            self.disk_used -= previous[1]
+        self.disk[key] = (path, size)
+        self.disk_used += size
+
+    def _evict_disk(self):
+        """
+        Deletes the least recently used files past `disk_bytes` (never the
+        newest one). Call with the lock held. Returns the number deleted.
+        """
+        evicted = 0
+        while self.disk_used > self.disk_bytes and len(self.disk) > 1:
+            key, (path, size) = self.disk.popitem(last=False)
+            self.disk_used -= size
+            evicted += 1
+            dropped = self.memory.pop(key, None)  # Its path is gone, and MP3 clips play from the file
+            if dropped is not None:
+                self.memory_used -= len(dropped.data)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return evicted
+
+    def _touch(self, key):
+        """Marks a clip as just used, so it is the last to be evicted (also across restarts)."""
+        with self.lock:
+            entry = self.disk.get(key)
+            if entry is None:
+                return
+            self.disk.move_to_end(key)
+        try:
+            os.utime(entry[0])
+        except OSError:
+            pass
+
+    def _read(self, key):
+        mp3_path = os.path.join(self.directory, key + '.mp3')
+        wav_path = os.path.join(self.directory, key + '.wav')
+        try:
+            if os.path.exists(mp3_path):
+                with open(mp3_path, 'rb') as f:
+                    return AudioClip(FORMAT_MP3, f.read(), path=mp3_path)
+            if os.path.exists(wav_path):
+                with wave.open(wav_path, 'rb') as wav:
+                    return AudioClip(FORMAT_PCM16, wav.readframes(wav.getnframes()),
+                                     wav.getframerate(), path=wav_path)
+        except (OSError, EOFError, wave.Error) as e:
+            print(f"TTS cache: ignoring unreadable clip {key}; {e}")
+        return None
+
+    def _remember(self, key, clip):
+        with self.lock:
+            if key in self.memory:
+                return
+            self.memory[key] = clip
+            self.memory_used += len(clip.data)
+            while self.memory_used > self.memory_bytes and len(self.memory) > 1:
+                _, dropped = self.memory.popitem(last=False)
+                self.memory_used -= len(dropped.data)
+
+
+def pcm_chunks(data, chunk_bytes=PCM_CHUNK_BYTES):
+    """Splits a PCM buffer into playback-sized chunks."""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_bytes):
+        yield view[start:start + chunk_bytes]
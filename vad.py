@@ -0,0 +1,196 @@
+# vad.py
+#
+# NumPy voice activity detection for command capture. Replaces the fixed
+# audioop.rms threshold (audioop is gone in Python 3.13) with:
+#   - a per-mic noise floor that keeps adapting while the mic is idle,
+#   - frame features: energy above the floor, zero-crossing rate and the share
+#     of energy in the speech band,
+#   - onset/hangover smoothing so single clicks or short dips don't flip the state,
+#   - an end-of-speech timeout that starts short and grows only for speakers
+#     who pause mid-command,
+#   - a pre-roll buffer so the quiet start of the first word is kept.
+
+from collections import deque
+import numpy as np
+
+# --- CONFIGURATION ---
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = 1280  # 80 ms, the same frames the wake word model sees
+FRAME_SECONDS = FRAME_SAMPLES / SAMPLE_RATE
+
+NOISE_FLOOR_INIT_DB = 35.0  # Starting noise floor, in dB relative to one int16 step
+NOISE_FLOOR_RISE = 0.05  # How fast the floor follows louder background noise (per frame)
+NOISE_FLOOR_FALL = 0.3  # How fast it follows quieter background noise (per frame)
+NOISE_FLOOR_LOUD_RISE = 0.005  # Speech-level frames only nudge the floor (a TV left on, ~16 s)
+SPEECH_MARGIN_DB = 12.0  # Energy above the noise floor needed to call a frame speech
+MIN_SPEECH_DB = 40.0  # Never call anything quieter than this speech (~100 RMS)
+MAX_SPEECH_ZCR = 0.45  # Zero crossings per sample; broadband hiss sits above this
+MIN_SPEECH_BAND_RATIO = 0.5  # Share of energy between 100 Hz and 4 kHz
+SPEECH_BAND_HZ = (100.0, 4000.0)
+
+ONSET_FRAMES = 2  # Consecutive speech frames that start an utterance
+HANGOVER_FRAMES = 2  # Non-speech frames still counted as speech after it stops
+
+PREROLL_FRAMES = 4  # Audio kept from before the onset (320 ms)
+MIN_EOS_TIMEOUT = 0.6  # Seconds of silence that end a command
+MAX_EOS_TIMEOUT = 1.4  # Upper bound once the speaker has paused mid-command
+EOS_PAUSE_FACTOR = 1.5  # The timeout grows to this multiple of the longest pause seen
+NO_SPEECH_TIMEOUT = 4.0  # Give up if nobody speaks this long after the wake word
+MAX_COMMAND_DURATION = 15.0  # Hard cap on a single command recording, in seconds
+WAKE_SNR_FRAMES = 8  # Recent frames (640 ms, about one "hey jarvis") recent_snr_db() looks at
+
+_FREQUENCIES = np.fft.rfftfreq(FRAME_SAMPLES, 1.0 / SAMPLE_RATE)
+_SPEECH_BAND = (_FREQUENCIES >= SPEECH_BAND_HZ[0]) & (_FREQUENCIES <= SPEECH_BAND_HZ[1])
+
+
+def frame_energy_db(frames):
+    """RMS energy in dB of one frame or a (n, samples) batch of int16 frames."""
+    x = np.asarray(frames, dtype=np.float32)
+    mean_square = np.mean(x * x, axis=-1)
+    return 10.0 * np.log10(mean_square + 1.0)
+
+
+def frame_features(frames):
+    """
+    Computes VAD features for one frame or a batch of frames.
+
+    Returns:
+        tuple: (energy in dB, zero-crossing rate, speech-band energy ratio),
+               each a float or an array with one value per frame.
+    """
+    x = np.asarray(frames, dtype=np.float32)
+    energy_db = frame_energy_db(x)
+    signs = np.signbit(x)
+    zcr = np.count_nonzero(signs[..., 1:] != signs[..., :-1], axis=-1) / (x.shape[-1] - 1)
+    power = np.abs(np.fft.rfft(x, axis=-1)) ** 2
+    band_ratio = power[..., _SPEECH_BAND].sum(axis=-1) / (power.sum(axis=-1) + 1e-9)
+    return energy_db, zcr, band_ratio
+
+
+class VoiceActivityDetector:
+    """
+    Frame-by-frame speech/non-speech decisions for one microphone. Call
+    track_noise() on idle audio (while listening for the wake word) so the noise
+    floor is already right when a command starts.
+    """
+    def __init__(self):
+        self.noise_floor_db = NOISE_FLOOR_INIT_DB
+        self.recent_db = deque(maxlen=WAKE_SNR_FRAMES)
+        self.speech_run = 0
+        self.hangover = 0
+        self.in_speech = False
+
+    def track_noise(self, frame):
+        """Updates the noise floor from a frame known not to be a command."""
+        energy_db = float(frame_energy_db(frame))
+        self.recent_db.append(energy_db)
+        self._update_floor(energy_db)
+
+    def recent_snr_db(self):
+        """
+        How far the loudest of the last few tracked frames rose above the noise
+        floor. Right after a wake word detection, that is the wake word's SNR.
+        """
+        if not self.recent_db:
+            return 0.0
+        return max(self.recent_db) - self.noise_floor_db
+
+    def is_speech(self, frame):
+        """Returns the smoothed speech decision for the next frame."""
+        energy_db, zcr, band_ratio = frame_features(frame)
+        raw = (energy_db > max(self.noise_floor_db + SPEECH_MARGIN_DB, MIN_SPEECH_DB)
+               and zcr < MAX_SPEECH_ZCR
+               and band_ratio > MIN_SPEECH_BAND_RATIO)
+
+        if raw:
+            self.speech_run += 1
+            if self.speech_run >= ONSET_FRAMES:
+                self.in_speech = True
+                self.hangover = HANGOVER_FRAMES
+        else:
+            self.speech_run = 0
+            self._update_floor(float(energy_db))
+            if self.hangover > 0:
+                self.hangover -= 1
+            else:
+                self.in_speech = False
+        return self.in_speech
+
+    def reset(self):
+        """Clears the speech state but keeps the learned noise floor."""
+        self.speech_run = 0
+        self.hangover = 0
+        self.in_speech = False
+
+    def _update_floor(self, energy_db):
+        if energy_db > self.noise_floor_db + SPEECH_MARGIN_DB:
+            rate = NOISE_FLOOR_LOUD_RISE  # Probably someone talking, e.g. the wake word itself
+        elif energy_db > self.noise_floor_db:
+            rate = NOISE_FLOOR_RISE
+        else:
+            rate = NOISE_FLOOR_FALL
+        self.noise_floor_db += rate * (energy_db - self.noise_floor_db)
+
+
+class UtteranceSegmenter:
+    """
+    Turns the frames after a wake word into one utterance. feed() returns the
+    frames that belong to the command (pre-roll first, then speech and the
+    trailing pauses) and whether the utterance has ended.
+    """
+    def __init__(self, vad):
+        self.vad = vad
+        self.vad.reset()
+        self.preroll = deque(maxlen=PREROLL_FRAMES)
+        self.started = False
+        self.frames_seen = 0
+        self.frames_kept = 0
+        self.silence_frames = 0
+        self.longest_pause_frames = 0
+        self.end_reason = None
+
+    @property
+    def eos_timeout(self):
+        """The current end-of-speech timeout in seconds."""
+        timeout = self.longest_pause_frames * FRAME_SECONDS * EOS_PAUSE_FACTOR
+        return min(max(timeout, MIN_EOS_TIMEOUT), MAX_EOS_TIMEOUT)
+
+    def feed(self, frame):
+        """
+        Args:
+            frame (np.ndarray): One FRAME_SAMPLES int16 frame.
+
+        Returns:
+            tuple: (list of frames to keep, True once the utterance has ended)
+        """
+        self.frames_seen += 1
+        speech = self.vad.is_speech(frame)
+
+        if not self.started:
+            if speech:
+                self.started = True
+                kept = list(self.preroll) + [frame.copy()]
+                self.preroll.clear()
+                self.frames_kept += len(kept)
+                return kept, False
+            self.preroll.append(frame.copy())
+            if self.frames_seen * FRAME_SECONDS >= NO_SPEECH_TIMEOUT:
+                self.end_reason = 'no_speech'
+                return [], True
+            return [], False
+
+        self.frames_kept += 1
+        if speech:
+            if self.silence_frames:
+                self.longest_pause_frames = max(self.longest_pause_frames, self.silence_frames)
+            self.silence_frames = 0
+        else:
+            self.silence_frames += 1
+            if self.silence_frames * FRAME_SECONDS >= self.eos_timeout:
+                self.end_reason = 'silence'
+                return [frame.copy()], True
+
+        if self.frames_kept * FRAME_SECONDS >= MAX_COMMAND_DURATION:
+            self.end_reason = 'max_duration'
+            return [frame.copy()], True
+        return [frame.copy()], False
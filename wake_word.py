@@ -0,0 +1,250 @@
+# wake_word.py
+
+import importlib.util
+import os
+import threading
+import numpy as np
+
+from metrics import startup
+
+# openwakeword is imported where it is used: it pulls in the inference runtimes,
+# which takes longer than everything else at startup put together.
+
+# --- CONFIGURATION ---
+WAKE_WORD_MODEL = 'hey_jarvis_v0.1'
+WAKE_THRESHOLD = 0.5  # Score above which the wake word counts as detected
+# ONNX sessions accept a batch dimension, which lets one call cover every mic
+WAKE_INFERENCE_FRAMEWORK = 'onnx'
+WAKE_FEATURE_MODELS = ['melspectrogram', 'embedding_model']  # Shared by every wake word model
+WARMUP_WINDOWS = 4  # Windows of silence run through a new engine before it serves mics
+
+WINDOW_SAMPLES = 1280  # openWakeWord consumes audio in 80 ms windows
+MELSPEC_CONTEXT_SAMPLES = 160 * 3  # Extra history the melspectrogram model needs per window
+MELSPEC_WINDOW_FRAMES = 76  # Melspectrogram frames per embedding
+MELSPEC_FEATURES = 32
+MAX_PENDING_SAMPLES = WINDOW_SAMPLES * 8  # Per-mic audio waiting for inference before the oldest is dropped
+
+
+class WakeWordStream:
+    """
+    The streaming state of one microphone: its raw audio history, melspectrogram
+    frames and embedding features. Resetting a stream never touches other mics.
+    """
+    def __init__(self, mic_id, initial_features):
+        self.mic_id = mic_id
+        self._initial_features = initial_features
+        self._pending = np.zeros(MAX_PENDING_SAMPLES, dtype=np.int16)
+        self._pending_len = 0
+        self.dropped_samples = 0
+        self.reset()
+
+    @property
+    def ready(self):
+        """True when at least one full 80 ms window is waiting for inference."""
+        return self._pending_len >= WINDOW_SAMPLES
+
+    def add_audio(self, audio_np):
+        """Queues int16 samples of any length for the next inference ticks."""
+        n = len(audio_np)
+        if n >= MAX_PENDING_SAMPLES:
+            self.dropped_samples += self._pending_len + n - MAX_PENDING_SAMPLES
+            self._pending[:] = audio_np[-MAX_PENDING_SAMPLES:]
+            self._pending_len = MAX_PENDING_SAMPLES
+            return
+        overflow = self._pending_len + n - MAX_PENDING_SAMPLES
+        if overflow > 0:
+            self.dropped_samples += overflow
+            self._pending[:self._pending_len - overflow] = self._pending[overflow:self._pending_len]
+            self._pending_len -= overflow
+        self._pending[self._pending_len:self._pending_len + n] = audio_np
+        self._pending_len += n
+
+    def reset(self):
+        """Clears this mic's feature buffers, e.g. after a detection to avoid re-triggering."""
+        self.raw_history = np.zeros(WINDOW_SAMPLES + MELSPEC_CONTEXT_SAMPLES, dtype=np.int16)
+        self.melspec_buffer = np.ones((MELSPEC_WINDOW_FRAMES, MELSPEC_FEATURES), dtype=np.float32)
+        self.feature_buffer = self._initial_features.copy()
+        self.last_score = 0.0
+
+    def _take_window(self):
+        """Moves the next 80 ms window into the raw history and returns the melspec input."""
+        window = self._pending[:WINDOW_SAMPLES]
+        self.raw_history[:MELSPEC_CONTEXT_SAMPLES] = self.raw_history[-MELSPEC_CONTEXT_SAMPLES:]
+        self.raw_history[MELSPEC_CONTEXT_SAMPLES:] = window
+        self._pending[:self._pending_len - WINDOW_SAMPLES] = self._pending[WINDOW_SAMPLES:self._pending_len]
+        self._pending_len -= WINDOW_SAMPLES
+        return self.raw_history
+
+
+class WakeWordEngine:
+    """
+    Runs openWakeWord for many microphones at once. The melspectrogram, embedding
+    and wake word models are loaded once and shared; every mic keeps its own
+    WakeWordStream, and each call to predict() stacks one window from every ready
+    stream into a single batched call per model.
+    """
+    def __init__(self, model_name=WAKE_WORD_MODEL, inference_framework=WAKE_INFERENCE_FRAMEWORK, model=None):
+        if model is None:
+            from openwakeword.model import Model
+            model = Model(wakeword_models=[model_name], inference_framework=inference_framework)
+        self.model_name = model_name
+        self.model = model
+        self.preprocessor = self.model.preprocessor
+        self.n_feature_frames = self.model.model_inputs[model_name]
+        self.classifier = self.model.model_prediction_function[model_name]
+        # Same starting point openWakeWord uses: embeddings of a few seconds of noise
+        self.initial_features = np.asarray(
+            self.preprocessor.feature_buffer[-self.n_feature_frames:], dtype=np.float32
+        )
+        # Stages whose model rejected a batched input fall back to one row at a time
+        self._batched = {'melspec': True, 'embedding': True, 'classifier': True}
+        self.lock = threading.Lock()
+
+    def create_stream(self, mic_id):
+        return WakeWordStream(mic_id, self.initial_features)
+
+    def warm_up(self, windows=WARMUP_WINDOWS):
+        """
+        Runs silence through every model, alone and in a batch, so the first
+        mics do not pay for the inference sessions' first-run setup.
+        """
+        streams = [self.create_stream('warm-up'), self.create_stream('warm-up')]
+        silence = np.zeros(WINDOW_SAMPLES, dtype=np.int16)
+        for i in range(windows):
+            batch = streams if i % 2 else streams[:1]
+            for stream in batch:
+                stream.add_audio(silence)
+            self.predict(batch)
+
+    def predict(self, streams):
+        """
+        Runs one 80 ms window for every stream that has one ready.
+
+        Args:
+            streams (list): WakeWordStream objects to run.
+
+        Returns:
+            dict: The wake word score for each stream. Streams without a full
+                  window waiting keep their previous score.
+        """
+        with self.lock:
+            ready = [s for s in streams if s.ready]
+            if ready:
+                self._predict_batch(ready)
+            return {s: s.last_score for s in streams}
+
+    def _predict_batch(self, streams):
+        n = len(streams)
+
+        # Stage 1: melspectrogram of each mic's newest window plus context
+        audio = np.empty((n, WINDOW_SAMPLES + MELSPEC_CONTEXT_SAMPLES), dtype=np.float32)
+        for i, stream in enumerate(streams):
+            audio[i] = stream._take_window()
+        spec = self._run('melspec', self.preprocessor.melspec_model_predict, audio, lambda out: out[0])
+        spec = spec.reshape(n, -1, MELSPEC_FEATURES) / 10 + 2
+
+        # Stage 2: one embedding per mic from its latest 76 melspectrogram frames
+        melspec_windows = np.empty((n, MELSPEC_WINDOW_FRAMES, MELSPEC_FEATURES, 1), dtype=np.float32)
+        for i, stream in enumerate(streams):
+            stream.melspec_buffer = np.vstack((stream.melspec_buffer, spec[i]))[-MELSPEC_WINDOW_FRAMES:]
+            melspec_windows[i, :, :, 0] = stream.melspec_buffer
+        embeddings = self._run('embedding', self.preprocessor.embedding_model_predict, melspec_windows)
+        embeddings = embeddings.reshape(n, -1)
+
+        # Stage 3: the wake word classifier over each mic's recent features
+        features = np.empty((n, self.n_feature_frames, embeddings.shape[1]), dtype=np.float32)
+        for i, stream in enumerate(streams):
+            stream.feature_buffer = np.vstack((stream.feature_buffer, embeddings[i]))[-self.n_feature_frames:]
+            features[i] = stream.feature_buffer
+        scores = self._run('classifier', self.classifier, features, lambda out: out[0])
+        scores = scores.reshape(n, -1)[:, 0]
+
+        for stream, score in zip(streams, scores):
+            stream.last_score = float(score)
+
+    def _run(self, stage, predict_fn, batch, unpack=lambda out: out):
+        """Calls a model on the whole batch, or row by row if it only accepts batch size 1."""
+        if self._batched[stage] and len(batch) > 1:
+            try:
+                return np.asarray(unpack(predict_fn(batch)))
+            except Exception as e:
+                print(f"Wake word {stage} model does not accept batches, running per mic: {e}")
+                self._batched[stage] = False
+        rows = [np.asarray(unpack(predict_fn(batch[i:i + 1]))).reshape(1, -1) for i in range(len(batch))]
+        return np.concatenate(rows)
+
+
+def model_directory():
+    """openWakeWord's model cache, located without importing the package."""
+    spec = importlib.util.find_spec('openwakeword')
+    if spec is None:
+        raise ImportError("The wake word engine needs `pip install openwakeword`")
+    return os.path.join(list(spec.submodule_search_locations)[0], 'resources', 'models')
+
+
+def missing_model_files(framework=WAKE_INFERENCE_FRAMEWORK):
+    """The model files the engine needs that are not in the local cache yet."""
+    extension = 'onnx' if framework == 'onnx' else 'tflite'
+    directory = model_directory()
+    names = WAKE_FEATURE_MODELS + [WAKE_WORD_MODEL]
+    return [name for name in names if not os.path.exists(os.path.join(directory, f"{name}.{extension}"))]
+
+
+def download_wake_word_models():
+    """Downloads the wake word models, unless the local cache already has them."""
+    missing = missing_model_files()
+    if not missing:
+        print(f"Wake word models: using the local cache in {model_directory()}")
+        return
+    print(f"Downloading wake word models ({', '.join(missing)})...")
+    import openwakeword.utils
+    openwakeword.utils.download_models([WAKE_WORD_MODEL])
+
+
+def load_wake_word_engine():
+    """Downloads the wake word models if necessary and builds the engine."""
+    download_wake_word_models()
+    return WakeWordEngine()
+
+
+class WakeEngineLoader:
+    """
+    Builds the wake word engine and warms it up on a background thread, so the
+    listener can bind its socket and accept mics while the model loads.
+    Audio that arrives meanwhile waits in the mics' ring buffers.
+    """
+    def __init__(self, factory=WakeWordEngine):
+        self.factory = factory
+        self.engine = None
+        self.error = None
+        self._done = threading.Event()
+        self.thread = threading.Thread(target=self._load, name="wake-model-loader", daemon=True)
+        self.thread.start()
+
+    @property
+    def ready(self):
+        return self._done.is_set() and self.error is None
+
+    def result(self, timeout=None):
+        """The engine, once loaded. Raises whatever the load raised."""
+        if not self._done.wait(timeout):
+            raise TimeoutError("The wake word model is still loading")
+        if self.error is not None:
+            raise self.error
+        return self.engine
+
+    def _load(self):
+        try:
+            with startup.step('wake model load'):
+                engine = self.factory()
+            warm_up = getattr(engine, 'warm_up', None)
+            if warm_up is not None:
+                with startup.step('wake model warm-up'):
+                    warm_up()
+            self.engine = engine
+            startup.milestone('wake words')
+        except Exception as e:
+            print(f"Could not load the wake word model: {e}")
+            self.error = e
+        finally:
+            self._done.set()